@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+#
+# Avalon Music Server
+#
+# Copyright 2012-2015 TSH Labs <projects@tshlabs.org>
+#
+# Available under the MIT license. See LICENSE for details.
+#
+
+
+"""Expose a configured, ASGI compatible application.
+
+By default the application will attempt to read the path of an installation
+specific configuration file from the :data:`AVALON_CONFIG` environmental
+variable.
+
+Note that this module should typically not be imported directly, instead it
+is meant to be used by an ASGI application server such as Uvicorn or Hypercorn.
+Importing it has the side-effect of bootstrapping the entire Avalon Music Server
+application. Each request is handled by the same application as the WSGI
+entry point (:mod:`avalon.app.wsgi`) in a pool of ``ASGI_THREADS`` threads.
+
+This module requires Python 3.5 or above.
+"""
+
+from __future__ import absolute_import, print_function, unicode_literals
+import sys
+
+if sys.version_info < (3, 5):
+    raise ImportError("The ASGI entry point requires Python 3.5 or above")
+
+# pylint: disable=wrong-import-position
+import avalon.web.asgi
+from avalon.app.bootstrap import bootstrap, CONFIG_ENV_VAR
+
+
+try:
+    # Handle keyboard interrupts during bootstrap quietly by
+    # just exiting, the same as the WSGI entry point.
+    # pylint: disable=invalid-name
+    _wsgi_application = bootstrap(config_env=CONFIG_ENV_VAR)
+except KeyboardInterrupt:
+    print("Caught SIGINT during bootstrap, exiting", file=sys.stderr)
+    sys.exit(1)
+
+# pylint: disable=invalid-name
+application = avalon.web.asgi.AsgiAdapter(
+    _wsgi_application, threads=_wsgi_application.config['ASGI_THREADS'])
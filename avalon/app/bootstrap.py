@@ -14,8 +14,11 @@ a WSGI application."""
 from __future__ import print_function, unicode_literals
 
 import pkgutil
+import random
+import time
 
 import os
+import simplejson
 from flask import Flask, Config
 import avalon
 import avalon.exc
@@ -66,16 +69,12 @@ def bootstrap(config_env=None):
     stats_client = avalon.app.factory.new_stats_client(log, app.config)
     avalon.metrics.bridge.client = stats_client
 
-    log.info("Connecting to database")
-    database = avalon.app.factory.new_db_engine(app.config)
-    database.connect()
+    # Keep histograms of each timing and count in-process if enabled,
+    # for environments without a Statsd server.
+    histograms = avalon.app.factory.new_histograms(app.config)
+    avalon.metrics.bridge.histograms = histograms
 
-    dao = avalon.app.factory.new_dao(database)
-    id_cache = avalon.app.factory.new_id_cache(dao)
-
-    log.info("Building in-memory stores")
-    controller = avalon.app.factory.new_controller(dao, id_cache)
-    controller.reload()
+    controller = _new_profiled_controller(app.config, log, stats_client)
 
     app.json_decoder = avalon.web.response.AvalonJsonDecoder
     app.json_encoder = avalon.web.response.AvalonJsonEncoder
@@ -89,6 +88,15 @@ def bootstrap(config_env=None):
     app.add_url_rule(path_resolver('artists'), view_func=controller.get_artists)
     app.add_url_rule(path_resolver('genres'), view_func=controller.get_genres)
     app.add_url_rule(path_resolver('songs'), view_func=controller.get_songs)
+    app.add_url_rule(path_resolver('suggest'), view_func=controller.get_suggestions)
+    app.add_url_rule(path_resolver('batch'), view_func=controller.get_batch, methods=['POST'])
+
+    if histograms is not None:
+        app.add_url_rule(path_resolver('stats'), view_func=controller.get_stats)
+    if app.config.get('METRICS_PROMETHEUS_PATH'):
+        app.add_url_rule(path_resolver('metrics'), view_func=controller.get_metrics)
+    if app.config.get('ADMIN_TOKEN'):
+        app.add_url_rule(path_resolver('profile'), view_func=controller.get_profile)
 
     # Catch-all for any unexpected errors that ensures we still render
     # a JSON payload in the same format the client is expecting while
@@ -104,6 +112,92 @@ def bootstrap(config_env=None):
     return app
 
 
+def _new_profiled_controller(config, log, stats_client):
+    """Construct and load a controller, recording the time taken and, if
+    enabled, a profile of the time and memory used by each phase of loading
+    that is logged as JSON and recorded as Statsd gauges.
+    """
+    profiler = avalon.app.factory.new_startup_profiler(config)
+    if profiler is not None:
+        profiler.start()
+        avalon.metrics.bridge.profiler = profiler
+
+    try:
+        with avalon.metrics.timing('startup'):
+            controller = _new_controller(config, log)
+    finally:
+        if profiler is not None:
+            avalon.metrics.bridge.profiler = None
+            profiler.stop()
+
+    if profiler is not None:
+        log.info("Startup profile: %s", simplejson.dumps(
+            {'phases': profiler.get_phases()}, sort_keys=True))
+        if stats_client is not None:
+            profiler.send_gauges(stats_client, 'startup')
+
+    return controller
+
+
+def _new_controller(config, log):
+    """Construct and load a controller that uses in-memory stores loaded
+    from the database or, if there are shards configured, one that sends
+    requests to each of the shards.
+    """
+    if config.get('SHARD_URLS'):
+        log.info("Sending requests to %s shards", len(config['SHARD_URLS']))
+        controller = avalon.app.factory.new_sharded_controller(config)
+        controller.reload()
+        return controller
+
+    log.info("Connecting to database")
+    database = avalon.app.factory.new_db_engine(config, read_only=True)
+    with avalon.metrics.timing('reload.connect'):
+        database.connect()
+
+    dao = avalon.app.factory.new_dao(database)
+    interner = avalon.app.factory.new_intern_table()
+    id_cache = avalon.app.factory.new_id_cache(dao, interner=interner)
+
+    log.info("Building in-memory stores")
+    controller = avalon.app.factory.new_controller(
+        dao, id_cache, config=config, interner=interner)
+    _reload_controller(controller, config, log)
+
+    # Close any pooled connections since they won't be used until the
+    # stores are reloaded and shouldn't be shared with worker processes
+    # forked after the application has been loaded.
+    database.dispose()
+    return controller
+
+
+def _reload_controller(controller, config, log):
+    """Load the in-memory stores of the controller after waiting a random
+    amount of time (up to the configured jitter) and for one of the slots
+    for loading on this machine (if limited) so that many servers starting
+    at once don't all read from the database at the same time.
+    """
+    jitter = config.get('RELOAD_JITTER')
+    semaphore = avalon.app.factory.new_reload_semaphore(config)
+
+    with avalon.metrics.timing('reload.wait') as wait:
+        if jitter:
+            time.sleep(random.uniform(0, jitter))
+        if semaphore is not None:
+            semaphore.acquire()
+
+    log.info("Waited %s ms to start loading", wait.ms)
+
+    try:
+        with avalon.metrics.timing('reload.total') as elapsed:
+            controller.reload()
+    finally:
+        if semaphore is not None:
+            semaphore.release()
+
+    log.info("Loaded in-memory stores in %s ms", elapsed.ms)
+
+
 class _EndpointPathResolver(object):
     """Logic for combining a user supplied 'REQUEST_PATH' setting and
     each of the various endpoints supported by the Avalon Music Server
@@ -12,14 +12,22 @@
 
 from __future__ import absolute_import, unicode_literals
 
+import functools
 import logging
+import multiprocessing
+import tempfile
 from datetime import datetime
 
+import os
 import re
 import mutagen
+import sqlalchemy.pool
 import avalon.cache
 import avalon.log
+import avalon.metrics
 import avalon.models
+import avalon.profiling
+import avalon.prometheus
 import avalon.tags.insert
 import avalon.tags.read
 import avalon.tags.crawl
@@ -28,6 +36,7 @@ import avalon.web.services
 import avalon.web.controller
 import avalon.web.filtering
 import avalon.web.search
+import avalon.web.sharding
 
 
 def configure_logger(logger, config):
@@ -71,7 +80,33 @@ def configure_sentry_logger(logger, config):
         logger.info("Sentry client configured for ERROR messages")
 
 
-def new_stats_client(logger, config):
+def new_histograms(config):
+    """Construct a new registry of in-process histograms for each timing
+    and count if enabled, None otherwise.
+
+    :param flask.Config config: Application configuration
+    :return: New histogram registry or None
+    :rtype: avalon.metrics.HistogramRegistry
+    """
+    if not config.get('METRICS_HISTOGRAMS'):
+        return None
+    return avalon.metrics.HistogramRegistry()
+
+
+def new_startup_profiler(config):
+    """Construct a new profiler for the phases of loading the music
+    collection at startup if enabled, None otherwise.
+
+    :param flask.Config config: Application configuration
+    :return: New profiler or None
+    :rtype: avalon.metrics.PhaseProfiler
+    """
+    if not config.get('PROFILE_STARTUP'):
+        return None
+    return avalon.metrics.PhaseProfiler()
+
+
+def new_stats_client(logger, config, prometheus=True):
     """Configure a stats client for recording metric counts or timings.
 
     If a stats client is not installed ``None`` will be returned. By
@@ -79,14 +114,43 @@ def new_stats_client(logger, config):
     8125. Since it uses UDP, if there is no server running these will
     just be ignored.
 
+    If a directory for Prometheus metrics is configured (and Prometheus
+    metrics are wanted for this process), a client that keeps metrics
+    in-process to be scraped by Prometheus is used instead. Otherwise,
+    if a batch interval is configured, a client that sends
+    metrics in batches from a background thread is used. Neither of these
+    require a stats client to be installed.
+
     See https://github.com/etsy/statsd/ or https://github.com/jsocol/pystatsd
     for more information.
 
     :param logging.Logger logger: Flask application logger
     :param flask.Config config: Application configuration
+    :param bool prometheus: False for processes other than the server
+        (such as the scanner) so that their metrics are not included in
+        the metrics scraped from the server
     :return: Configured stats client or None
     :rtype: statsd.StatsClient
     """
+    path = config.get('METRICS_PROMETHEUS_PATH')
+    if path and prometheus:
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        removed = avalon.prometheus.remove_stale(path)
+        logger.info(
+            "Prometheus metrics will be written to %s, removed %s stale files",
+            path, len(removed))
+        return avalon.prometheus.PrometheusStatsClient(path)
+
+    interval = config.get('STATSD_BATCH_INTERVAL')
+    if interval:
+        logger.info("Statsd metrics will be sent in batches every %s seconds", interval)
+        return avalon.metrics.BatchingStatsClient(
+            host=config['STATSD_HOST'],
+            port=config['STATSD_PORT'],
+            prefix=config['STATSD_PREFIX'],
+            interval=interval)
+
     try:
         import statsd
     except ImportError:
@@ -100,25 +164,57 @@ def new_stats_client(logger, config):
         prefix=config['STATSD_PREFIX'])
 
 
-def new_db_engine(config):
-    """Construct a new database handler with an SQLite backend based on the
-    given configuration and logger.
+def new_db_engine(config, read_only=False):
+    """Construct a new database handler based on the given configuration.
 
-    Expected configuration properties are: db_path.
+    Expected configuration properties are: DATABASE_URL and optionally
+    DATABASE_REPLICA_URL and the DATABASE_POOL_* settings.
 
     :param flask.Config config: Application level configuration
+    :param bool read_only: If true, connect to the read replica of the
+        database if one is configured
     :return: Handler for managing database sessions
     :rtype: avalon.models.SessionHandler
     """
     url = config.get('DATABASE_URL')
+    if read_only and config.get('DATABASE_REPLICA_URL'):
+        url = config.get('DATABASE_REPLICA_URL')
+
     db_config = avalon.models.SessionHandlerConfig()
-    db_config.engine = avalon.models.get_engine(url)
+    db_config.engine = avalon.models.get_engine(url, options=new_db_engine_options(config))
     db_config.session_factory = avalon.models.get_session_factory()
     db_config.metadata = avalon.models.get_metadata()
 
     return avalon.models.SessionHandler(db_config)
 
 
+def new_db_engine_options(config):
+    """Construct the options for the connection pool of a database engine
+    based on the given configuration.
+
+    Only options that have been set are included since not every type
+    of connection pool supports them (SQLite databases don't use a pool
+    of connections by default, for example).
+
+    :param flask.Config config: Application level configuration
+    :return: Keyword arguments for creating a database engine
+    :rtype: dict
+    """
+    options = {}
+    if config.get('DATABASE_NULL_POOL'):
+        options['poolclass'] = sqlalchemy.pool.NullPool
+    if config.get('DATABASE_POOL_PRE_PING'):
+        options['pool_pre_ping'] = True
+
+    for setting, option in (
+            ('DATABASE_POOL_SIZE', 'pool_size'),
+            ('DATABASE_POOL_MAX_OVERFLOW', 'max_overflow'),
+            ('DATABASE_POOL_RECYCLE', 'pool_recycle')):
+        if config.get(setting) is not None:
+            options[option] = config.get(setting)
+    return options
+
+
 def new_crawler(path):
     """Construct a new tag crawler capable finding all audio files
     under a given path and reading their audio metadata.
@@ -150,18 +246,101 @@ def new_dao(db_engine):
     return avalon.models.ReadOnlyDao(db_engine)
 
 
-def new_id_cache(dao):
+def new_intern_table():
+    """Construct a new table for sharing UUIDs and names between each of
+    the in-memory stores.
+
+    :return: Empty intern table
+    :rtype: avalon.cache.InternTable
+    """
+    return avalon.cache.InternTable()
+
+
+def new_id_cache(dao, interner=None):
     """Construct a new ID-to-name store based on the given read-only DAO.
 
     :param avalon.cache.ReadOnlyDao dao: Read-only DAO for loading ID-name
         mappings
+    :param avalon.cache.InternTable interner: Optional table for sharing
+        UUIDs and names with the other in-memory stores
     :return: ID-name lookup cache
     :rtype: avalon.cache.IdLookupCache
     """
-    return avalon.cache.IdLookupCache(dao)
+    return avalon.cache.IdLookupCache(dao, interner=interner)
+
 
+def new_search_pool_factory(config):
+    """Construct a factory for process pools used to tokenize names when
+    building search indexes based on the given configuration.
 
-def new_controller(dao, id_cache):
+    :param flask.Config config: Application configuration
+    :return: Factory for new process pools or None if names should be
+        tokenized in the current process
+    :rtype: callable
+    """
+    processes = config.get('SEARCH_BUILD_PROCESSES')
+    if not processes:
+        return None
+    return functools.partial(multiprocessing.Pool, processes)
+
+
+def new_reload_semaphore(config):
+    """Construct a semaphore for limiting how many servers on this machine
+    may load the music collection from the database at once based on the
+    given configuration.
+
+    :param flask.Config config: Application configuration
+    :return: Semaphore to hold while loading or None if loading should
+        not be limited
+    :rtype: avalon.util.FileSemaphore
+    """
+    slots = config.get('RELOAD_CONCURRENCY')
+    if not slots:
+        return None
+    return avalon.util.FileSemaphore(
+        config.get('RELOAD_LOCK_DIR') or tempfile.gettempdir(), 'avalon-reload', slots)
+
+
+def new_trie_factory(config):
+    """Construct a factory for new search tries of the type to use for
+    search indexes based on the given configuration.
+
+    :param flask.Config config: Application configuration
+    :return: Factory for new empty search tries
+    :rtype: callable
+    :raises ValueError: If the configured index type is not known
+    """
+    index_type = config.get('SEARCH_INDEX_TYPE', avalon.web.search.INDEX_TYPE_RADIX)
+    if index_type == avalon.web.search.INDEX_TYPE_TRIE:
+        return functools.partial(
+            avalon.web.search.SearchTrie, avalon.web.search.TrieNode)
+    if index_type == avalon.web.search.INDEX_TYPE_RADIX:
+        return functools.partial(
+            avalon.web.search.RadixTrie, avalon.web.search.RadixNode)
+    raise ValueError(
+        "The SEARCH_INDEX_TYPE setting must be '{0}' or '{1}'".format(
+            avalon.web.search.INDEX_TYPE_TRIE, avalon.web.search.INDEX_TYPE_RADIX))
+
+
+def new_shard_partition(config):
+    """Construct a callable for determining which tracks belong to this
+    server when the collection is split between multiple servers (shards)
+    based on the given configuration.
+
+    :param flask.Config config: Application configuration
+    :return: Partition of tracks for this shard or None if all tracks
+        should be loaded
+    :rtype: avalon.web.sharding.ShardPartition
+    :raises ValueError: If the shard index is not valid for the number
+        of shards
+    """
+    count = config.get('SHARD_COUNT')
+    if not count:
+        return None
+    return avalon.web.sharding.ShardPartition(config.get('SHARD_INDEX') or 0, count)
+
+
+def new_controller(dao, id_cache, config=None, interner=None):
     """Construct a new web request handler using the given DAO.
 
     :param avalon.cache.ReadOnlyDao dao: Read-only DAO for various
@@ -169,32 +348,87 @@ def new_controller(dao, id_cache):
     :param avalon.cache.IdLookupCache id_cache: ID-name cache used
         by the request handler for translating by-name requests into
         ID based lookups
+    :param flask.Config config: Optional application configuration. If
+        not given, default settings are used
+    :param avalon.cache.InternTable interner: Optional table for sharing
+        UUIDs and names between the in-memory stores and the ID-name cache
     :return: Controller to be used as web API endpoints
     :rtype: avalon.web.controller.AvalonController
     """
+    if config is None:
+        config = {}
+
     service_config = avalon.web.services.AvalonMetadataServiceConfig()
-    service_config.track_store = avalon.cache.TrackStore(dao)
-    service_config.album_store = avalon.cache.AlbumStore(dao)
-    service_config.artist_store = avalon.cache.ArtistStore(dao)
-    service_config.genre_store = avalon.cache.GenreStore(dao)
+    service_config.track_store = avalon.cache.TrackStore(dao, interner=interner)
+    service_config.album_store = avalon.cache.AlbumStore(dao, interner=interner)
+    service_config.artist_store = avalon.cache.ArtistStore(dao, interner=interner)
+    service_config.genre_store = avalon.cache.GenreStore(dao, interner=interner)
     service_config.id_cache = id_cache
-
-    # pylint: disable=missing-docstring
-    def trie_factory():
-        return avalon.web.search.SearchTrie(avalon.web.search.TrieNode)
+    service_config.interner = interner
+    service_config.loader = avalon.cache.CollectionLoader(
+        dao, interner=interner, partition=new_shard_partition(config))
 
     service_config.search = avalon.web.search.AvalonTextSearch(
         service_config.album_store,
         service_config.artist_store,
         service_config.genre_store,
         service_config.track_store,
-        trie_factory)
+        new_trie_factory(config),
+        pool_factory=new_search_pool_factory(config),
+        fuzzy_budget=config.get(
+            'SEARCH_FUZZY_BUDGET', avalon.web.search.DEFAULT_FUZZY_BUDGET),
+        expand_cache_size=config.get(
+            'SEARCH_EXPAND_CACHE_SIZE', avalon.web.search.DEFAULT_EXPAND_CACHE_SIZE))
 
     service = avalon.web.services.AvalonMetadataService(service_config)
 
-    filters = [
+    return avalon.web.controller.AvalonController(
+        service, new_filters(), profiler=new_profiler(config),
+        admin_token=config.get('ADMIN_TOKEN'))
+
+
+def new_sharded_controller(config):
+    """Construct a new web request handler that sends requests to each
+    of the servers (shards) that the collection is split between based
+    on the given configuration.
+
+    :param flask.Config config: Application configuration
+    :return: Controller to be used as web API endpoints
+    :rtype: avalon.web.controller.AvalonController
+    """
+    timeout = config.get('SHARD_TIMEOUT', avalon.web.sharding.DEFAULT_SHARD_TIMEOUT)
+
+    service_config = avalon.web.sharding.ShardedMetadataServiceConfig()
+    service_config.shards = [
+        avalon.web.sharding.ShardClient(url, timeout=timeout)
+        for url in config['SHARD_URLS']]
+
+    service = avalon.web.sharding.ShardedMetadataService(service_config)
+    return avalon.web.controller.AvalonController(
+        service, new_filters(), profiler=new_profiler(config),
+        admin_token=config.get('ADMIN_TOKEN'))
+
+
+def new_profiler(config):
+    """Construct a new sampling profiler for the ``profile`` endpoint if
+    an admin token is configured, None otherwise.
+
+    :param flask.Config config: Application configuration
+    :return: New sampling profiler or None
+    :rtype: avalon.profiling.SamplingProfiler
+    """
+    if not config.get('ADMIN_TOKEN'):
+        return None
+    return avalon.profiling.SamplingProfiler()
+
+
+def new_filters():
+    """Construct the list of filters for sorting and limiting results.
+
+    :return: Filters to apply to results, in order
+    :rtype: list
+    """
+    return [
         # NOTE: Sort needs to come before limit
         avalon.web.filtering.sort_filter,
         avalon.web.filtering.limit_filter]
-
-    return avalon.web.controller.AvalonController(service, filters)
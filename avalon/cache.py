@@ -13,26 +13,117 @@
 from __future__ import absolute_import, unicode_literals
 import collections
 import logging
+import sys
+import threading
+from multiprocessing.pool import ThreadPool
 
 import avalon.log
+import avalon.metrics
 import avalon.util
 from avalon.elms import id_name_elm_from_model, track_elm_from_model
 
 
+class InternTable(object):
+    """Table of canonical instances of immutable values (UUIDs, names,
+    and years) shared between each of the in-memory stores.
+
+    Each store builds its elements from a separate query so without this
+    table the same album UUID or artist name would exist as a separate
+    object for every track, album, and name-to-ID mapping that refers to
+    it. Stores sharing a table get back the first instance seen of any
+    equal value instead.
+
+    The table is only meant to live for the duration of a reload of the
+    stores and should be cleared afterwards. Values already handed out are
+    referenced by the stores themselves and remain shared after clearing.
+
+    The table is threadsafe so that it may be used while reading multiple
+    tables from the database concurrently.
+    """
+
+    def __init__(self):
+        """Create an empty table."""
+        self._lock = threading.Lock()
+        self._values = {}
+        self._duplicates = 0
+        self._duplicate_bytes = 0
+
+    def __len__(self):
+        return len(self._values)
+
+    @property
+    def duplicates(self):
+        """Number of values replaced by an existing canonical instance
+        since the table was last cleared.
+        """
+        return self._duplicates
+
+    @property
+    def duplicate_bytes(self):
+        """Approximate number of bytes used by values replaced by an
+        existing canonical instance since the table was last cleared.
+        """
+        return self._duplicate_bytes
+
+    def intern(self, val):
+        """Get the canonical instance of the given value, storing it as
+        the canonical instance if an equal value hasn't been seen yet.
+
+        :param val: Hashable, immutable value or None
+        :return: Canonical instance equal to the given value or None
+        """
+        if val is None:
+            return None
+
+        with self._lock:
+            canonical = self._values.setdefault(val, val)
+            if canonical is not val:
+                self._duplicates += 1
+                self._duplicate_bytes += sys.getsizeof(val)
+        return canonical
+
+    def get_values(self):
+        """Get a :class:`frozenset` of all canonical values in the table.
+
+        :return: All canonical values
+        :rtype: frozenset
+        """
+        return frozenset(self._values)
+
+    def clear(self):
+        """Remove all values from the table and reset duplicate counts."""
+        with self._lock:
+            self._values = {}
+            self._duplicates = 0
+            self._duplicate_bytes = 0
+
+
+def _get_interner(table):
+    """Get the method to use for interning values for elements based
+    on an optional :class:`InternTable`.
+    """
+    if table is None:
+        return None
+    return table.intern
+
+
 class IdLookupCache(object):
     """Cache for looking up the primary key of albums, artists,
     and genres based on their name.
     """
     _logger = avalon.log.get_error_log()
 
-    def __init__(self, dao):
+    def __init__(self, dao, interner=None):
         """Set the DAO to use for looking up albums, artist, and
         genres but do not load anything yet.
 
         :param avalon.models.ReadOnlyDao dao: DAO for reading from
             the database
+        :param InternTable interner: Optional table for sharing UUIDs
+            and names with other stores
         """
         self._dao = dao
+        self._interner = _get_interner(interner)
         self._by_album = None
         self._by_artist = None
         self._by_genre = None
@@ -100,9 +191,25 @@ class IdLookupCache(object):
         """
         # Pass the session (might be None) to the DAO, let it decide
         # to either use it, or create a new session to use.
-        by_album = self._get_name_id_map(self._dao.get_all_albums(session=session))
-        by_artist = self._get_name_id_map(self._dao.get_all_artists(session=session))
-        by_genre = self._get_name_id_map(self._dao.get_all_genres(session=session))
+        return self.load(
+            self._get_elms(self._dao.get_all_albums(session=session)),
+            self._get_elms(self._dao.get_all_artists(session=session)),
+            self._get_elms(self._dao.get_all_genres(session=session)))
+
+    def load(self, albums, artists, genres):
+        """Safely populate various structures used for name to ID
+        mappings of albums, artists, and genres from already loaded
+        elements and return this object.
+
+        :param albums: Iterable of album :class:`avalon.elms.IdNameElm`
+        :param artists: Iterable of artist :class:`avalon.elms.IdNameElm`
+        :param genres: Iterable of genre :class:`avalon.elms.IdNameElm`
+        :return: This object
+        :rtype: IdLookupCache
+        """
+        by_album = self._get_name_id_map(albums)
+        by_artist = self._get_name_id_map(artists)
+        by_genre = self._get_name_id_map(genres)
 
         self._by_album = by_album
         self._by_artist = by_artist
@@ -118,16 +225,22 @@ class IdLookupCache(object):
 
         return self
 
-    @staticmethod
-    def _get_name_id_map(all_models):
+    def _get_elms(self, all_models):
+        """Get a generator of ID-name elements for the given models."""
+        return (id_name_elm_from_model(model, self._interner) for model in all_models)
+
+    def _get_name_id_map(self, all_elms):
         """Get the name to ID mappings for a particular type of entity,
         normalizing the case of the name value using a default dictionary
         configured to return None for missing entries.
         """
+        interner = self._interner
         mapping = collections.defaultdict(lambda: None)
-        for model in all_models:
-            elm = id_name_elm_from_model(model)
-            mapping[elm.name.lower()] = elm.id
+        for elm in all_elms:
+            key = elm.name.lower()
+            if interner is not None:
+                key = interner(key)
+            mapping[key] = elm.id
         return mapping
 
 
@@ -148,14 +261,17 @@ class TrackStore(object):
     """
     _logger = avalon.log.get_error_log()
 
-    def __init__(self, dao):
+    def __init__(self, dao, interner=None):
         """Set the DAO to use for populating various lookup structures
         but to not load anything yet.
 
         :param avalon.models.ReadOnlyDao dao: DAO for reading from
             the database
+        :param InternTable interner: Optional table for sharing UUIDs
+            and names with other stores
         """
         self._dao = dao
+        self._interner = _get_interner(interner)
         self._by_album = {}
         self._by_artist = {}
         self._by_genre = {}
@@ -174,15 +290,26 @@ class TrackStore(object):
         structures may be out of date. However, all structures
         will correctly formed and valid.
         """
-        all_models = self._dao.get_all_tracks()
+        return self.load(
+            track_elm_from_model(model, self._interner)
+            for model in self._dao.get_all_tracks())
+
+    def load(self, all_elms):
+        """Safely populate the various structures for looking up
+        track elements by their attributes from already loaded track
+        elements and return this object.
+
+        :param all_elms: Iterable of :class:`avalon.elms.TrackElm`
+        :return: This object
+        :rtype: TrackStore
+        """
         by_album = collections.defaultdict(set)
         by_artist = collections.defaultdict(set)
         by_genre = collections.defaultdict(set)
         by_id = collections.defaultdict(set)
         all_tracks = set()
 
-        for track in all_models:
-            elm = track_elm_from_model(track)
+        for elm in all_elms:
             by_album[elm.album_id].add(elm)
             by_artist[elm.artist_id].add(elm)
             by_genre[elm.genre_id].add(elm)
@@ -270,11 +397,13 @@ class _IdNameStore(object):
     """Base store for any ID and name element."""
     _logger = avalon.log.get_error_log()
 
-    def __init__(self, dao_method):
+    def __init__(self, dao_method, interner=None):
         """Set the method of the DAO to use for populating the
-        ID-name store but do not load anything yet.
+        ID-name store and optional table for sharing UUIDs and names
+        with other stores but do not load anything yet.
         """
         self._dao_method = dao_method
+        self._interner = _get_interner(interner)
         self._by_id = {}
         self._all = frozenset()
 
@@ -285,17 +414,26 @@ class _IdNameStore(object):
         """Populate all of the ID-name elements and return this
         object.
         """
-        all_models = self._dao_method()
+        return self.load(
+            id_name_elm_from_model(model, self._interner)
+            for model in self._dao_method())
+
+    def load(self, all_elms):
+        """Populate all of the ID-name elements from already loaded
+        elements and return this object.
+
+        :param all_elms: Iterable of :class:`avalon.elms.IdNameElm`
+        :return: This object
+        """
         by_id = collections.defaultdict(set)
-        all_elms = set()
+        elms = set()
 
-        for model in all_models:
-            elm = id_name_elm_from_model(model)
+        for elm in all_elms:
             by_id[elm.id].add(elm)
-            all_elms.add(elm)
+            elms.add(elm)
 
         self._by_id = get_frozen_mapping(by_id)
-        self._all = frozenset(all_elms)
+        self._all = frozenset(elms)
 
         # Check if DEBUG is enabled since getting memory usage is slow
         if self._logger.isEnabledFor(logging.DEBUG):
@@ -329,19 +467,94 @@ class _IdNameStore(object):
 class AlbumStore(_IdNameStore):
     """In-memory store for Album models using IdNameElm."""
 
-    def __init__(self, dao):
-        super(AlbumStore, self).__init__(dao.get_all_albums)
+    def __init__(self, dao, interner=None):
+        super(AlbumStore, self).__init__(dao.get_all_albums, interner=interner)
 
 
 class ArtistStore(_IdNameStore):
     """In-memory store for Artist models using IdNameElm."""
 
-    def __init__(self, dao):
-        super(ArtistStore, self).__init__(dao.get_all_artists)
+    def __init__(self, dao, interner=None):
+        super(ArtistStore, self).__init__(dao.get_all_artists, interner=interner)
 
 
 class GenreStore(_IdNameStore):
     """In-memory store for Genre models using IdNameElm."""
 
-    def __init__(self, dao):
-        super(GenreStore, self).__init__(dao.get_all_genres)
+    def __init__(self, dao, interner=None):
+        super(GenreStore, self).__init__(dao.get_all_genres, interner=interner)
+
+
+# Elements for an entire music collection, each type loaded from a
+# single read of the corresponding table.
+Collection = collections.namedtuple(
+    'Collection', ['albums', 'artists', 'genres', 'tracks'])
+
+
+class CollectionLoader(object):
+    """Loader that reads each table of the music collection exactly once
+    so that every in-memory store (and the name to ID lookup cache) can
+    be populated from the same elements.
+
+    Each table is read on a separate thread (and hence a separate session)
+    since much of the time spent reading is waiting on the database. The
+    time taken to read each table is recorded under ``reload.read.<table>``.
+    """
+
+    def __init__(self, dao, interner=None, pool_factory=None, partition=None):
+        """Set the DAO to use for reading each table, optional table for
+        sharing UUIDs and names between elements, optionally the thread
+        pool implementation to use (to allow for easier unit testing), and
+        optionally the portion of tracks to keep.
+
+        :param avalon.models.ReadOnlyDao dao: DAO for reading from
+            the database
+        :param InternTable interner: Optional table for sharing UUIDs
+            and names between elements
+        :param callable pool_factory: Callable that accepts a number of
+            workers and returns a pool with ``.map()``, ``.close()``, and
+            ``.join()`` methods (expected to behave like :class:`ThreadPool`)
+        :param callable partition: Callable that accepts a track element
+            and returns true if it should be kept (such as a
+            :class:`avalon.web.sharding.ShardPartition`). All tracks are
+            kept if not given.
+        """
+        if pool_factory is None:
+            pool_factory = ThreadPool
+
+        self._dao = dao
+        self._interner = _get_interner(interner)
+        self._pool_factory = pool_factory
+        self._partition = partition
+
+    def load(self):
+        """Read every album, artist, genre, and track from the database
+        and convert them to elements.
+
+        :return: All elements in the music collection
+        :rtype: Collection
+        """
+        readers = [
+            ('albums', self._dao.get_all_albums, id_name_elm_from_model, None),
+            ('artists', self._dao.get_all_artists, id_name_elm_from_model, None),
+            ('genres', self._dao.get_all_genres, id_name_elm_from_model, None),
+            ('tracks', self._dao.get_all_tracks, track_elm_from_model, self._partition)]
+
+        pool = self._pool_factory(len(readers))
+        try:
+            with avalon.metrics.timing('reload.read'):
+                return Collection(*pool.map(self._read, readers))
+        finally:
+            pool.close()
+            pool.join()
+
+    def _read(self, reader):
+        """Read all models of a single type and convert each of them
+        to an element as they are loaded.
+        """
+        name, dao_method, elm_factory, keep = reader
+        with avalon.metrics.timing('reload.read.' + name):
+            elms = (elm_factory(model, self._interner) for model in dao_method())
+            if keep is None:
+                return tuple(elms)
+            return tuple(elm for elm in elms if keep(elm))
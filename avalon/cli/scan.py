@@ -23,6 +23,7 @@ import avalon.compat
 import avalon.exc
 import avalon.ids
 import avalon.log
+import avalon.metrics
 import avalon.tags.crawl
 import avalon.tags.insert
 import avalon.tags.read
@@ -62,8 +63,9 @@ class AvalonCollectionScanner(object):
         """
         self._logger.info("Removing old metadata...")
         cleaner = avalon.tags.insert.Cleaner(session)
-        for cls in (Album, Artist, Genre, Track):
-            cleaner.clean_type(cls)
+        with avalon.metrics.timing('scan.clean'):
+            for cls in (Album, Artist, Genre, Track):
+                cleaner.clean_type(cls)
 
     def _insert_new_tags(self, session, tag_meta):
         """Insert new entries into the album, artist, genre, and track
@@ -79,20 +81,23 @@ class AvalonCollectionScanner(object):
         """
         self._logger.info("Inserting new tag metadata for associated attributes...")
         field_loader = avalon.tags.insert.TrackFieldLoader(session, tag_meta)
-        field_loader.insert(Album, avalon.ids.get_album_id, 'album')
-        field_loader.insert(Artist, avalon.ids.get_artist_id, 'artist')
-        field_loader.insert(Genre, avalon.ids.get_genre_id, 'genre')
+        with avalon.metrics.timing('scan.insert.fields'):
+            field_loader.insert(Album, avalon.ids.get_album_id, 'album')
+            field_loader.insert(Artist, avalon.ids.get_artist_id, 'artist')
+            field_loader.insert(Genre, avalon.ids.get_genre_id, 'genre')
 
         # Note that we're passing the current session to the reload
         # method of the ID cache. This makes sure that we're loading
         # the values inserted in the current session (transaction),
         # not old already committed ones.
         self._logger.info("Building ID-name lookup for associated attributes...")
-        self._id_cache.reload(session=session)
+        with avalon.metrics.timing('scan.reload_ids'):
+            self._id_cache.reload(session=session)
 
         self._logger.info("Inserting new tag metadata for songs...")
         track_loader = avalon.tags.insert.TrackLoader(session, tag_meta, self._id_cache)
-        track_loader.insert(Track, avalon.ids.get_track_id)
+        with avalon.metrics.timing('scan.insert.tracks'):
+            track_loader.insert(Track, avalon.ids.get_track_id)
 
     def scan_path(self, path):
         """Recursively scan the given path for files, attempt to read audio
@@ -113,9 +118,12 @@ class AvalonCollectionScanner(object):
 
         self._logger.info("Loaded metadata for %s songs", len(tag_meta))
 
-        with self._database.scoped_session(read_only=False) as session:
-            self._clean_existing_tags(session)
-            self._insert_new_tags(session, tag_meta)
+        # Time the whole transaction since committing it may take a
+        # significant amount of time for some databases
+        with avalon.metrics.timing('scan.write'):
+            with self._database.scoped_session(read_only=False) as session:
+                self._clean_existing_tags(session)
+                self._insert_new_tags(session, tag_meta)
 
 
 def get_opts(prog):
@@ -170,6 +178,12 @@ def main():
     logger = avalon.log.get_error_log()
     avalon.app.factory.configure_logger(logger, config)
 
+    # Record the time taken by each stage of the scan if a Statsd
+    # client is installed and configured. Metrics of the scan are never
+    # exposed to Prometheus since they'd be mixed in with those of the server.
+    avalon.metrics.bridge.client = avalon.app.factory.new_stats_client(
+        logger, config, prometheus=False)
+
     try:
         database = avalon.app.factory.new_db_engine(config)
         database.connect()
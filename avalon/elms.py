@@ -18,19 +18,30 @@ import collections
 IdNameElm = collections.namedtuple('IdNameElm', ['id', 'name'])
 
 
+def _identity(val):
+    """Return the given value unchanged."""
+    return val
+
+
 # Note that we're using a separate factory method here (instead of
 # a class method) since subclassing a named tuple breaks the __dict__
 # attribute somehow in Python 3.
-def id_name_elm_from_model(model):
+def id_name_elm_from_model(model, interner=None):
     """Construct a new ID name element from various types of models.
 
     :param model: Any ID-name type model
+    :param callable interner: Optional callable that returns a canonical
+        instance for each value (such as :meth:`avalon.cache.InternTable.intern`)
+        so that equal values are shared between elements
     :return: Immutable representation of the given model
     :rtype: IdNameElm
     """
+    if interner is None:
+        interner = _identity
+
     return IdNameElm(
-        id=model.id,
-        name=model.name)
+        id=interner(model.id),
+        name=interner(model.name))
 
 
 TrackElm = collections.namedtuple('TrackElm', [
@@ -50,23 +61,32 @@ TrackElm = collections.namedtuple('TrackElm', [
 # Note that we're using a separate factory method here (instead of
 # a class method) since subclassing a named tuple breaks the __dict__
 # attribute somehow in Python 3.
-def track_elm_from_model(model):
+def track_elm_from_model(model, interner=None):
     """Construct a new track element from a track model.
 
+    Note that the ID of the track itself is never passed to the
+    interner since it is unique to each track.
+
     :param avalon.models.TrackModel model: Model to construct
         an immutable representation of
+    :param callable interner: Optional callable that returns a canonical
+        instance for each value (such as :meth:`avalon.cache.InternTable.intern`)
+        so that equal values are shared between elements
     :return: Immutable representation of the given model
     :rtype: TrackElm
     """
+    if interner is None:
+        interner = _identity
+
     return TrackElm(
         id=model.id,
-        name=model.name,
-        length=model.length,
+        name=interner(model.name),
+        length=interner(model.length),
         track=model.track,
-        year=model.year,
-        album=model.album.name,
-        album_id=model.album_id,
-        artist=model.artist.name,
-        artist_id=model.artist_id,
-        genre=model.genre.name,
-        genre_id=model.genre_id)
+        year=interner(model.year),
+        album=interner(model.album.name),
+        album_id=interner(model.album_id),
+        artist=interner(model.artist.name),
+        artist_id=interner(model.artist_id),
+        genre=interner(model.genre.name),
+        genre_id=interner(model.genre_id))
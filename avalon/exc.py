@@ -100,6 +100,13 @@ class ServiceMisconfiguredError(ApiError):
     http_code = 503
 
 
+class PermissionDeniedError(ApiError):
+    """The client is not allowed to access the requested resource."""
+    code = 4
+    message_key = 'avalon.service.error.permission_denied'
+    http_code = 403
+
+
 class InvalidParameterNameError(ApiError):
     """A parameter does not correspond to any known parameters."""
     code = 100
@@ -13,10 +13,35 @@ The purpose of this module is to allow us to easily add timing
 information to method calls with a decorator but still be able to
 configure the stats client after the decorator has already been
 applied.
+
+Timed methods and blocks may contain spans (:func:`span`) that are
+timed under the key of the method or block they are nested in, such as
+``request.songs.search`` for searching within the ``request.songs``
+endpoint. Timings and counts may also be kept in-process in histograms
+(:class:`HistogramRegistry`) when there is no Statsd server to send
+them to, or aggregated in-process and sent to a Statsd server in
+batches (:class:`BatchingStatsClient`).
 """
 
 from __future__ import absolute_import, unicode_literals
+import atexit
+import contextlib
 import functools
+import gc
+import itertools
+import math
+import os
+import random
+import resource
+import socket
+import threading
+import weakref
+from timeit import default_timer
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
 
 
 class MetricsBridge(object):
@@ -31,10 +56,48 @@ class MetricsBridge(object):
     application bootstrap.
 
     :ivar statsd.StatsClient client: Statsd client instance
+    :ivar HistogramRegistry histograms: In-process histograms of each
+        timing and count or None
+    :ivar PhaseProfiler profiler: Profiler for blocks timed by
+        :func:`timing` or None
     """
 
     def __init__(self):
         self.client = None
+        self.histograms = None
+        self.profiler = None
+
+
+# Keys of the methods and blocks currently being timed by each thread
+_active = threading.local()
+
+
+def _get_active():
+    """Get the stack of keys being timed by the current thread."""
+    try:
+        return _active.keys
+    except AttributeError:
+        _active.keys = []
+        return _active.keys
+
+
+@contextlib.contextmanager
+def _activate(key):
+    """Make the key the parent of any spans within the block."""
+    keys = _get_active()
+    keys.append(key)
+    try:
+        yield
+    finally:
+        keys.pop()
+
+
+def _get_nested_key(name):
+    """Get the key for a span or count within the block currently being timed."""
+    keys = _get_active()
+    if not keys:
+        return name
+    return keys[-1] + '.' + name
 
 
 class MetricsTimer(object):
@@ -60,15 +123,25 @@ class MetricsTimer(object):
     def __call__(self, *args, **kwargs):
         """Return the results wrapped method and time its execution.
 
-        If there is no stats client available, return the results of
-        the wrapped method without timing its execution.
+        If there is no stats client or histograms available, return the
+        results of the wrapped method without timing its execution.
         """
         client = self._bridge.client
-        if client is None:
-            return self._func(*args, **kwargs)
+        histograms = self._bridge.histograms
+
+        with _activate(self._key):
+            if client is None and histograms is None:
+                return self._func(*args, **kwargs)
 
-        with client.timer(self._key):
-            return self._func(*args, **kwargs)
+            start = default_timer()
+            try:
+                if client is None:
+                    return self._func(*args, **kwargs)
+                with client.timer(self._key):
+                    return self._func(*args, **kwargs)
+            finally:
+                if histograms is not None:
+                    histograms.record(self._key, (default_timer() - start) * 1000.0)
 
 
 def timed(key):
@@ -99,4 +172,651 @@ def timed(key):
     return decorator
 
 
+class ElapsedTime(object):
+    """Holder for the execution time of a block timed by :func:`timing`.
+
+    :ivar float ms: Milliseconds taken to execute the block, None until
+        the block has finished executing
+    """
+
+    def __init__(self):
+        self.ms = None
+
+
+@contextlib.contextmanager
+def timing(key):
+    """Get a context manager for recording the execution time of a block.
+
+    The execution time will be recorded under ``key`` in Statsd in
+    milliseconds if the singleton `bridge` instance has a stats client
+    configured (and in its histograms if there are any). The context
+    manager yields an :class:`ElapsedTime` that will have the execution
+    time set once the block exits so that it may also be logged.
+
+    :param basestring key: Key to record timing results under
+    :return: Context manager for recording execution time
+    """
+    elapsed = ElapsedTime()
+    profiler = bridge.profiler
+    state = None if profiler is None else profiler.enter()
+    start = default_timer()
+
+    try:
+        with _activate(key):
+            yield elapsed
+    finally:
+        elapsed.ms = (default_timer() - start) * 1000.0
+        if profiler is not None:
+            profiler.exit(key, state, elapsed.ms)
+        client = bridge.client
+        if client is not None:
+            client.timing(key, elapsed.ms)
+        histograms = bridge.histograms
+        if histograms is not None:
+            histograms.record(key, elapsed.ms)
+
+
+def span(name):
+    """Get a context manager for recording the execution time of a part
+    of the method or block currently being timed.
+
+    The execution time will be recorded under the key of the method or
+    block followed by ``.<name>``, or just the name if nothing is being
+    timed, in the same way as :func:`timing`. For example, a span named
+    ``search`` within a method timed as ``request.songs`` is recorded
+    under ``request.songs.search``. Spans may be nested within each other.
+
+    :param basestring name: Name of the part of the method or block
+    :return: Context manager for recording execution time
+    """
+    return timing(_get_nested_key(name))
+
+
+def count(name, value=1):
+    """Record a count (such as the number of results returned) for the
+    method or block currently being timed.
+
+    The count will be recorded under the key of the method or block
+    followed by ``.<name>``, as with :func:`span`, as a Statsd counter
+    (incremented by the value) if the singleton `bridge` instance has
+    a stats client configured and in its histograms if there are any.
+
+    :param basestring name: Name of the value being counted
+    :param int value: Value to record
+    """
+    key = _get_nested_key(name)
+    client = bridge.client
+    if client is not None:
+        client.incr(key, value)
+    histograms = bridge.histograms
+    if histograms is not None:
+        histograms.record(key, value)
+
+
+def gauge(key, value):
+    """Record the current value of something (such as the number of
+    entries in a store) as a Statsd gauge if the singleton `bridge`
+    instance has a stats client configured.
+
+    :param basestring key: Key to record the value under
+    :param float value: Value to record
+    """
+    client = bridge.client
+    if client is not None:
+        client.gauge(key, value)
+
+
+# Number of buckets each power of two is divided into by histograms,
+# bounding the relative error of each percentile to about 3%
+HISTOGRAM_SUB_BUCKETS = 32
+
+
+class Histogram(object):
+    """Thread-safe histogram of positive values with a bounded relative
+    error, similar to an HDR histogram.
+
+    Values are counted in buckets that divide each power of two into an
+    equal number of parts so that the width of each bucket is proportional
+    to the values in it. Only buckets that have values are stored so any
+    range of values may be recorded in a small amount of memory. Zero and
+    negative values are counted in a bucket of their own.
+    """
+
+    def __init__(self, sub_buckets=HISTOGRAM_SUB_BUCKETS):
+        """Set the number of buckets to divide each power of two into.
+
+        :param int sub_buckets: Number of buckets for each power of two
+        """
+        self._sub_buckets = sub_buckets
+        self._buckets = {}
+        self._count = 0
+        self._total = 0.0
+        self._min = None
+        self._max = None
+        self._lock = threading.Lock()
+
+    def _get_bucket(self, value):
+        """Get the key of the bucket for a value."""
+        if value <= 0:
+            return None
+        mantissa, exponent = math.frexp(value)
+        return exponent, int((mantissa * 2 - 1) * self._sub_buckets)
+
+    def _get_upper_bound(self, bucket):
+        """Get the largest value that may be in a bucket."""
+        if bucket is None:
+            return 0
+        exponent, sub = bucket
+        return math.ldexp(1 + (sub + 1) / float(self._sub_buckets), exponent - 1)
+
+    def record(self, value):
+        """Add a value to the histogram.
+
+        :param float value: Value to add
+        """
+        bucket = self._get_bucket(value)
+        with self._lock:
+            self._buckets[bucket] = self._buckets.get(bucket, 0) + 1
+            self._count += 1
+            self._total += value
+            if self._min is None or value < self._min:
+                self._min = value
+            if self._max is None or value > self._max:
+                self._max = value
+
+    def get_percentiles(self, percentiles):
+        """Get the value below which each of the given percentages of
+        values fall, None for each if there are no values.
+
+        Values are the upper bound of the bucket containing the percentile,
+        capped by the largest value recorded.
+
+        :param list percentiles: Percentiles to get, between 0 and 100
+        :return: Value of each percentile
+        :rtype: list
+        """
+        with self._lock:
+            buckets = sorted(self._buckets.items(), key=lambda item: (item[0] is not None, item[0]))
+            count = self._count
+            largest = self._max
+
+        out = []
+        for pct in percentiles:
+            if not count:
+                out.append(None)
+                continue
+
+            rank = max(1, int(math.ceil(pct / 100.0 * count)))
+            seen = 0
+            for bucket, bucket_count in buckets:
+                seen += bucket_count
+                if seen >= rank:
+                    out.append(min(self._get_upper_bound(bucket), largest))
+                    break
+        return out
+
+    def get_summary(self):
+        """Get the number of values, their total, smallest and largest
+        values, and common percentiles.
+
+        :return: Dictionary of ``count``, ``total``, ``min``, ``max``,
+            ``p50``, ``p90``, ``p99``, and ``p999``
+        :rtype: dict
+        """
+        with self._lock:
+            out = {'count': self._count, 'total': self._total, 'min': self._min, 'max': self._max}
+        for name, val in zip(('p50', 'p90', 'p99', 'p999'), self.get_percentiles((50, 90, 99, 99.9))):
+            out[name] = val
+        return out
+
+
+class HistogramRegistry(object):
+    """Thread-safe collection of histograms for each timing and count
+    recorded, meant to be installed in the singleton `bridge` instance
+    for keeping metrics in-process.
+    """
+
+    def __init__(self, sub_buckets=HISTOGRAM_SUB_BUCKETS):
+        """Set the number of buckets to divide each power of two into
+        for each histogram.
+
+        :param int sub_buckets: Number of buckets for each power of two
+        """
+        self._sub_buckets = sub_buckets
+        self._histograms = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Get the histogram for a key, creating it if needed.
+
+        :param basestring key: Key of the timing or count
+        :return: Histogram for the key
+        :rtype: Histogram
+        """
+        histogram = self._histograms.get(key)
+        if histogram is not None:
+            return histogram
+
+        with self._lock:
+            return self._histograms.setdefault(key, Histogram(self._sub_buckets))
+
+    def record(self, key, value):
+        """Add a timing or count to the histogram for a key.
+
+        :param basestring key: Key of the timing or count
+        :param float value: Value to add
+        """
+        self.get(key).record(value)
+
+    def get_summary(self):
+        """Get a summary of each histogram, see :meth:`Histogram.get_summary`.
+
+        :return: Dictionary of key to the summary of its histogram
+        :rtype: dict
+        """
+        with self._lock:
+            histograms = list(self._histograms.items())
+        return dict((key, histogram.get_summary()) for key, histogram in histograms)
+
+
+def _get_cpu_ms():
+    """Get the CPU time (user and system) used by the process in milliseconds."""
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return (usage.ru_utime + usage.ru_stime) * 1000.0
+
+
+class PhaseProfiler(object):
+    """Profile of each block timed by :func:`timing` while installed in the
+    singleton `bridge` instance, meant for understanding where the time and
+    memory used while starting the server go.
+
+    The wall time, CPU time, memory allocated (if :mod:`tracemalloc` is
+    available), and change in the number of objects tracked by the garbage
+    collector are recorded for each phase. Memory allocated is the memory
+    still allocated at the end of a phase that was not at the start.
+
+    CPU time, memory, and objects are measured for the entire process so the
+    values for phases that run at the same time in multiple threads (such as
+    reading each table from the database) include the work of each other.
+    Phases that contain other phases include the work of those phases.
+
+    Counting objects requires visiting every object tracked by the garbage
+    collector at the start and end of each phase and tracing memory makes
+    allocations slower so this is not meant to be enabled all the time.
+    """
+
+    def __init__(self, trace_memory=True, count_objects=True):
+        """Set whether to trace memory allocations and count objects.
+
+        :param bool trace_memory: Record memory allocated by each phase
+            with :mod:`tracemalloc` if it is available
+        :param bool count_objects: Record the change in the number of
+            objects tracked by the garbage collector for each phase
+        """
+        self._trace_memory = trace_memory and tracemalloc is not None
+        self._count_objects = count_objects
+        self._started_tracing = False
+        self._sequence = itertools.count()
+        self._phases = []
+        self._lock = threading.Lock()
+
+    def start(self):
+        """Start tracing memory allocations if enabled and not already
+        being traced.
+        """
+        if self._trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracing = True
+
+    def stop(self):
+        """Stop tracing memory allocations if started by this profiler."""
+        if self._started_tracing:
+            tracemalloc.stop()
+            self._started_tracing = False
+
+    def _get_allocated(self):
+        """Get the bytes currently allocated if they are being traced."""
+        if not self._trace_memory or not tracemalloc.is_tracing():
+            return None
+        return tracemalloc.get_traced_memory()[0]
+
+    def _get_objects(self):
+        """Get the number of objects if they are being counted."""
+        if not self._count_objects:
+            return None
+        return len(gc.get_objects())
+
+    def enter(self):
+        """Record the state of the process at the start of a phase.
+
+        :return: Opaque state to pass to :meth:`exit` at the end of the phase
+        """
+        with self._lock:
+            seq = next(self._sequence)
+        return seq, _get_cpu_ms(), self._get_allocated(), self._get_objects()
+
+    def exit(self, key, state, wall_ms):
+        """Record the resources used by a phase that has finished.
+
+        :param basestring key: Name of the phase
+        :param state: State returned by :meth:`enter` at the start of the phase
+        :param float wall_ms: Milliseconds taken by the phase
+        """
+        seq, cpu_start, allocated_start, objects_start = state
+        phase = {
+            'name': key,
+            'wall_ms': round(wall_ms, 3),
+            'cpu_ms': round(_get_cpu_ms() - cpu_start, 3),
+        }
+
+        allocated = self._get_allocated()
+        if allocated is not None and allocated_start is not None:
+            phase['allocated_mb'] = round((allocated - allocated_start) / (1024.0 * 1024.0), 3)
+
+        objects = self._get_objects()
+        if objects is not None:
+            phase['objects'] = objects - objects_start
+
+        with self._lock:
+            self._phases.append((seq, phase))
+
+    def get_phases(self):
+        """Get the profile of each phase in the order they started.
+
+        :return: Dictionary of ``name``, ``wall_ms``, ``cpu_ms``, and if
+            enabled ``allocated_mb`` and ``objects`` for each phase
+        :rtype: list
+        """
+        with self._lock:
+            return [phase for _, phase in sorted(self._phases, key=lambda p: p[0])]
+
+    def send_gauges(self, client, prefix):
+        """Record each value of the profile of each phase as a gauge
+        named ``<prefix>.<phase>.<value>``.
+
+        :param statsd.StatsClient client: Statsd client instance
+        :param basestring prefix: Prefix for the name of each gauge
+        """
+        for phase in self.get_phases():
+            for field, val in sorted(phase.items()):
+                if field != 'name':
+                    client.gauge('{0}.{1}.{2}'.format(prefix, phase['name'], field), val)
+
+
 bridge = MetricsBridge()
+
+
+# Number of seconds between each batch of metrics sent to Statsd by default
+DEFAULT_BATCH_INTERVAL = 1.0
+
+# Maximum size of each packet of metrics sent to Statsd. Larger packets
+# may be fragmented or dropped when sent over the internet.
+DEFAULT_PACKET_SIZE = 512
+
+# Maximum number of timings of each key to send in each batch by default.
+# The rest are accounted for by sending the timings with a sample rate.
+DEFAULT_MAX_TIMINGS = 100
+
+
+class BatchingStatsClient(object):
+    """Statsd client with the same interface as :class:`statsd.StatsClient`
+    that aggregates metrics in-process and sends them from a background
+    thread in batches, instead of sending a packet for each metric from
+    the thread recording it.
+
+    Counters are summed and only the last value of each gauge is kept
+    between batches. At most a fixed number of timings of each key are
+    kept (chosen at random if there are more) and sent with a sample rate
+    so that Statsd can account for the rest. The cost of recording metrics
+    and the number of packets sent are bounded no matter how many metrics
+    are recorded.
+
+    The background thread is started by the first metric recorded in each
+    process so that the client may be created before worker processes are
+    forked. Metrics that haven't been sent are sent when the process exits.
+    """
+
+    def __init__(self, host='localhost', port=8125, prefix=None,
+                 interval=DEFAULT_BATCH_INTERVAL, packet_size=DEFAULT_PACKET_SIZE,
+                 max_timings=DEFAULT_MAX_TIMINGS, socket_factory=None):
+        """Set the address of the Statsd server, the prefix for each metric,
+        how often to send batches of metrics, the maximum size of each packet
+        and number of timings of each key to send, and optionally the function
+        used to create sockets (to allow for easier unit testing).
+
+        :param str host: Host of the Statsd server
+        :param int port: Port of the Statsd server
+        :param str prefix: Prefix for the key of each metric or None
+        :param float interval: Number of seconds between each batch
+        :param int packet_size: Maximum size of each packet in bytes
+        :param int max_timings: Maximum number of timings of each key to
+            send in each batch
+        :param callable socket_factory: Callable that accepts an address
+            family and socket type and returns a socket (expected to behave
+            like :class:`socket.socket`)
+        """
+        self._host = host
+        self._port = port
+        self._prefix = '{0}.'.format(prefix) if prefix else ''
+        self._interval = interval
+        self._packet_size = packet_size
+        self._max_timings = max_timings
+        self._socket_factory = socket_factory if socket_factory is not None else socket.socket
+        self._rand = random.Random()
+        self._lock = threading.Lock()
+        self._closed = threading.Event()
+        self._pid = None
+        self._thread = None
+        self._sock = None
+        self._addr = None
+        self._counters = {}
+        self._gauges = {}
+        self._timings = {}
+        self._send_lock = threading.Lock()
+        _batching_clients.add(self)
+
+    def _after_fork(self):
+        """Replace the lock in a newly forked process in case it was held
+        by another thread of the parent process when it was forked.
+        """
+        self._lock = threading.Lock()
+        self._send_lock = threading.Lock()
+
+    def _start(self):
+        """Start the background thread for sending metrics if it hasn't
+        been started by this process, discarding any metrics inherited
+        from the parent process. Must be called with the lock held.
+        """
+        pid = os.getpid()
+        if self._pid == pid:
+            return
+
+        self._pid = pid
+        self._sock = None
+        self._counters = {}
+        self._gauges = {}
+        self._timings = {}
+        self._thread = threading.Thread(target=self._run, name='avalon-statsd')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _run(self):
+        """Send batches of metrics until closed or replaced by a new thread."""
+        thread = threading.current_thread()
+        while not self._closed.wait(self._interval) and self._thread is thread:
+            self.flush()
+
+    def incr(self, stat, count=1, rate=1):
+        """Add to a counter.
+
+        :param str stat: Key of the counter
+        :param int count: Amount to add
+        :param float rate: Ignored, counters are always summed in-process
+        """
+        with self._lock:
+            self._start()
+            self._counters[stat] = self._counters.get(stat, 0) + count
+
+    def decr(self, stat, count=1, rate=1):
+        """Subtract from a counter.
+
+        :param str stat: Key of the counter
+        :param int count: Amount to subtract
+        :param float rate: Ignored, counters are always summed in-process
+        """
+        self.incr(stat, -count, rate)
+
+    def gauge(self, stat, value, rate=1, delta=False):
+        """Set (or change, if delta is true) the value of a gauge.
+
+        :param str stat: Key of the gauge
+        :param float value: Value of the gauge or amount to change it by
+        :param float rate: Ignored, only the last value of gauges is sent
+        :param bool delta: Change the gauge by the value instead of setting it
+        """
+        with self._lock:
+            self._start()
+            if delta:
+                current, is_delta = self._gauges.get(stat, (0, True))
+                self._gauges[stat] = (current + value, is_delta)
+            else:
+                self._gauges[stat] = (value, False)
+
+    def timing(self, stat, delta, rate=1):
+        """Record a timing in milliseconds.
+
+        :param str stat: Key of the timing
+        :param float delta: Timing in milliseconds
+        :param float rate: Ignored, the sample rate of timings is determined
+            by how many are recorded
+        """
+        with self._lock:
+            self._start()
+            entry = self._timings.get(stat)
+            if entry is None:
+                entry = self._timings[stat] = [0, []]
+
+            # Keep a uniform random sample of the timings (reservoir sampling)
+            entry[0] += 1
+            if len(entry[1]) < self._max_timings:
+                entry[1].append(delta)
+            else:
+                i = self._rand.randrange(entry[0])
+                if i < self._max_timings:
+                    entry[1][i] = delta
+
+    @contextlib.contextmanager
+    def timer(self, stat, rate=1):
+        """Get a context manager for recording the execution time of a block.
+
+        :param str stat: Key of the timing
+        :param float rate: Ignored, see :meth:`timing`
+        """
+        start = default_timer()
+        try:
+            yield
+        finally:
+            self.timing(stat, (default_timer() - start) * 1000.0, rate)
+
+    def _get_lines(self, counters, gauges, timings):
+        """Format metrics as lines of the Statsd protocol."""
+        prefix = self._prefix
+        lines = []
+
+        for stat, count in sorted(counters.items()):
+            lines.append('{0}{1}:{2}|c'.format(prefix, stat, count))
+
+        for stat, (value, is_delta) in sorted(gauges.items()):
+            if is_delta:
+                lines.append('{0}{1}:{2:+}|g'.format(prefix, stat, value))
+            elif value < 0:
+                # Negative values would be treated as a change, reset first
+                lines.append('{0}{1}:0|g'.format(prefix, stat))
+                lines.append('{0}{1}:{2}|g'.format(prefix, stat, value))
+            else:
+                lines.append('{0}{1}:{2}|g'.format(prefix, stat, value))
+
+        for stat, (seen, values) in sorted(timings.items()):
+            suffix = ''
+            if seen > len(values):
+                suffix = '|@{0:.6f}'.format(len(values) / float(seen))
+            for value in values:
+                lines.append('{0}{1}:{2:.3f}|ms{3}'.format(prefix, stat, value, suffix))
+
+        return lines
+
+    def _get_packets(self, lines):
+        """Combine lines into as few packets as possible without going over
+        the maximum packet size (unless a single line is larger).
+        """
+        packets = []
+        current = []
+        size = 0
+
+        for line in lines:
+            data = line.encode('utf-8')
+            if current and size + len(data) + 1 > self._packet_size:
+                packets.append(b'\n'.join(current))
+                current = []
+                size = 0
+            current.append(data)
+            size += len(data) + (1 if size else 0)
+
+        if current:
+            packets.append(b'\n'.join(current))
+        return packets
+
+    def _send(self, packets):
+        """Send each packet to the Statsd server, ignoring any errors like
+        :class:`statsd.StatsClient` does.
+        """
+        with self._send_lock:
+            try:
+                if self._sock is None:
+                    family, _, _, _, addr = socket.getaddrinfo(
+                        self._host, self._port, 0, socket.SOCK_DGRAM)[0]
+                    self._sock = self._socket_factory(family, socket.SOCK_DGRAM)
+                    self._addr = addr
+                for packet in packets:
+                    self._sock.sendto(packet, self._addr)
+            except socket.error:
+                pass
+
+    def flush(self):
+        """Send all metrics recorded since the last batch was sent."""
+        with self._lock:
+            counters, self._counters = self._counters, {}
+            gauges, self._gauges = self._gauges, {}
+            timings, self._timings = self._timings, {}
+
+        lines = self._get_lines(counters, gauges, timings)
+        if lines:
+            self._send(self._get_packets(lines))
+
+    def close(self):
+        """Send any remaining metrics and stop the background thread."""
+        self._closed.set()
+        self.flush()
+
+
+# Batching clients that haven't been garbage collected, for sending any
+# remaining metrics at exit and replacing locks after forking
+_batching_clients = weakref.WeakSet()
+
+
+def _close_batching_clients():
+    """Send any remaining metrics of each batching client."""
+    for client in list(_batching_clients):
+        client.close()
+
+
+def _reset_batching_clients():
+    """Replace the locks of each batching client after forking."""
+    for client in list(_batching_clients):
+        # pylint: disable=protected-access
+        client._after_fork()
+
+
+atexit.register(_close_batching_clients)
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_batching_clients)
@@ -150,7 +150,7 @@ class Genre(_Base):
     __tablename__ = 'genres'
 
 
-def get_engine(url, factory=None):
+def get_engine(url, factory=None, options=None):
     """Get a database engine for the given URL, mapping expected
     SQLAlchemy exceptions to our own.
 
@@ -159,22 +159,29 @@ def get_engine(url, factory=None):
         Engine instance. If not specified the :func:`create_engine`
         function will be used. This parameter should only be passed
         for unit testing.
+    :param dict options: Optional keyword arguments to pass to the
+        factory, such as the size of the connection pool
     :return: Database engine based on the connection string
     :rtype: sqlalchemy.engine.Engine
-    :raises avalon.exc.ConnectionError: If the URL is malformed or the
+    :raises avalon.exc.ConnectionError: If the URL is malformed, the
         specified database adapter is not available (meaning it could
-        not be imported).
+        not be imported), or the options are not supported by it.
     """
     if factory is None:
         factory = create_engine
+    if options is None:
+        options = {}
     try:
-        return factory(url)
+        return factory(url, **options)
     except ArgumentError as e:
         raise avalon.exc.ConnectionError(
             'Invalid connection URL: {0}'.format(e))
     except ImportError as e:
         raise avalon.exc.ConnectionError(
             'Invalid database adapter: {0}'.format(e))
+    except TypeError as e:
+        raise avalon.exc.ConnectionError(
+            'Invalid database options: {0}'.format(e))
 
 
 def get_metadata():
@@ -280,6 +287,13 @@ class SessionHandler(object):
                     'Could not initialize required schema: {0}'.format(e)),
                 sys.exc_info()[2])
 
+    def dispose(self):
+        """Close all connections held by the connection pool of the engine.
+
+        New connections will be opened the next time a session is used.
+        """
+        self._engine.dispose()
+
     def validate(self):
         """Ensure our database engine is valid by attempting a connection.
 
@@ -357,7 +371,7 @@ class ReadOnlyDao(object):
             session to use for fetching rows instead of using
             a new connection
         :return: Generator to get all albums in batches
-        :rtype: sqlalchemy.orm.Query
+        :rtype: generator
         """
         return self._get_all_cls(Album, session=session)
 
@@ -368,7 +382,7 @@ class ReadOnlyDao(object):
             session to use for fetching rows instead of using
             a new connection
         :return: Generator to get all artists in batches
-        :rtype: sqlalchemy.orm.Query
+        :rtype: generator
         """
         return self._get_all_cls(Artist, session=session)
 
@@ -379,7 +393,7 @@ class ReadOnlyDao(object):
             session to use for fetching rows instead of using
             a new connection
         :return: Generator to get all genres in batches
-        :rtype: sqlalchemy.orm.Query
+        :rtype: generator
         """
         return self._get_all_cls(Genre, session=session)
 
@@ -390,14 +404,25 @@ class ReadOnlyDao(object):
             session to use for fetching rows instead of using
             a new connection
         :return: Generator to get all tracks in batches
-        :rtype: sqlalchemy.orm.Query
+        :rtype: generator
         """
         return self._get_all_cls(Track, session=session)
 
     def _get_all_cls(self, cls, session=None):
-        """Get a generator to yield models of the given class in batches."""
+        """Get a generator to yield models of the given class in batches.
+
+        The session (a new one if not given) is kept open until every model
+        has been yielded or the generator is closed so that rows are streamed
+        from the database one batch at a time. Using ``yield_per`` means rows
+        are read with a server-side cursor when the database adapter supports
+        them (such as psycopg2 for PostgreSQL) and with ``fetchmany`` for
+        SQLite.
+        """
         if session is not None:
-            return session.query(cls).yield_per(self.read_batch_size)
+            for model in session.query(cls).yield_per(self.read_batch_size):
+                yield model
+            return
 
-        with self._session_handler.scoped_session() as session:
-            return session.query(cls).yield_per(self.read_batch_size)
+        with self._session_handler.scoped_session() as new_session:
+            for model in new_session.query(cls).yield_per(self.read_batch_size):
+                yield model
@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+#
+# Avalon Music Server
+#
+# Copyright 2012-2015 TSH Labs <projects@tshlabs.org>
+#
+# Available under the MIT license. See LICENSE for details.
+#
+
+
+"""Sampling profiler for finding where the threads of a running server
+spend their time.
+"""
+
+from __future__ import absolute_import, unicode_literals
+import collections
+import sys
+import threading
+import time
+from timeit import default_timer
+
+
+# Number of seconds between each sample of the stacks of every thread
+DEFAULT_SAMPLE_INTERVAL = 0.01
+
+# Maximum number of seconds a profile may be recorded for
+MAX_PROFILE_SECONDS = 60
+
+
+def _get_frame_name(frame):
+    """Get the name of a frame for a collapsed stack."""
+    code = frame.f_code
+    # Semicolons separate frames and spaces separate the stack from the count
+    return '{0}:{1}'.format(code.co_filename, code.co_name).replace(';', ':').replace(' ', '_')
+
+
+class SamplingProfiler(object):
+    """Profiler that periodically records the stack of every other thread
+    of the process, using :func:`sys._current_frames`.
+
+    Recording a profile has a low overhead since the threads being profiled
+    aren't traced, only sampled. The thread recording a profile is not
+    included in it.
+    """
+
+    def __init__(self, interval=DEFAULT_SAMPLE_INTERVAL, frames_impl=None,
+                 threads_impl=None, sleep_impl=None):
+        """Set the number of seconds between samples and optionally the
+        functions for getting the current frame of each thread, getting
+        the running threads, and sleeping (to allow for easier unit testing).
+
+        :param float interval: Number of seconds between each sample
+        :param callable frames_impl: Function to get the current frame of
+            each thread by ID (expected to behave like :func:`sys._current_frames`)
+        :param callable threads_impl: Function to get each running thread
+            (expected to behave like :func:`threading.enumerate`)
+        :param callable sleep_impl: Function to sleep for a number of
+            seconds (expected to behave like :func:`time.sleep`)
+        """
+        # pylint: disable=protected-access
+        self._interval = interval
+        self._frames = frames_impl if frames_impl is not None else sys._current_frames
+        self._threads = threads_impl if threads_impl is not None else threading.enumerate
+        self._sleep = sleep_impl if sleep_impl is not None else time.sleep
+
+    def sample(self, counts):
+        """Add the current stack of every other thread to the counts of
+        each stack.
+
+        :param collections.Counter counts: Number of times each stack has
+            been seen, keyed by a tuple of frame names starting with the
+            name of the thread and ending with the innermost frame
+        """
+        current = threading.current_thread().ident
+        names = dict((thread.ident, thread.name) for thread in self._threads())
+
+        for ident, frame in self._frames().items():
+            if ident == current:
+                continue
+
+            stack = []
+            while frame is not None:
+                stack.append(_get_frame_name(frame))
+                frame = frame.f_back
+
+            stack.append(names.get(ident, 'thread-{0}'.format(ident)).replace(' ', '_'))
+            stack.reverse()
+            counts[tuple(stack)] += 1
+
+    def profile(self, seconds):
+        """Sample the stacks of every other thread for the given number of
+        seconds and return the number of times each stack was seen.
+
+        :param float seconds: Number of seconds to record the profile for
+        :return: Number of times each stack was seen, see :meth:`sample`
+        :rtype: collections.Counter
+        """
+        counts = collections.Counter()
+        end = default_timer() + seconds
+
+        while True:
+            self.sample(counts)
+            remaining = end - default_timer()
+            if remaining <= 0:
+                break
+            self._sleep(min(self._interval, remaining))
+
+        return counts
+
+
+def to_collapsed(counts):
+    """Render the number of times each stack was seen in the collapsed
+    format used by tools for building flame graphs: one stack per line
+    with frames separated by semicolons, followed by a space and the
+    number of times it was seen.
+
+    :param collections.Counter counts: Number of times each stack was seen
+    :return: Collapsed stacks, most frequently seen first
+    :rtype: unicode
+    """
+    lines = ['{0} {1}\n'.format(';'.join(stack), count) for stack, count in
+             sorted(counts.items(), key=lambda item: (-item[1], item[0]))]
+    return ''.join(lines)
@@ -0,0 +1,548 @@
+# -*- coding: utf-8 -*-
+#
+# Avalon Music Server
+#
+# Copyright 2012-2015 TSH Labs <projects@tshlabs.org>
+#
+# Available under the MIT license. See LICENSE for details.
+#
+
+
+"""Metrics kept in-process and exposed in the text format scraped by
+Prometheus, combined across every worker process of a server.
+
+Each process keeps its own counters, gauges, and histograms and writes
+them to a file of its own in a directory shared by every process of the
+server. The metrics of each process are read from these files and
+combined when they are requested. The counters and histograms of processes
+that have exited are moved into a single file of totals so that the number
+of files doesn't grow as worker processes are replaced.
+"""
+
+from __future__ import absolute_import, unicode_literals
+import atexit
+import codecs
+import contextlib
+import errno
+import fcntl
+import re
+import tempfile
+import threading
+import weakref
+from timeit import default_timer
+
+import os
+import simplejson
+import avalon.log
+import avalon.util
+
+
+# Number of seconds between each time the metrics of a process are
+# written to its file by default
+DEFAULT_WRITE_INTERVAL = 1.0
+
+# Upper bound of each histogram bucket for timings, in seconds
+DEFAULT_BUCKETS = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Prefix for the name of each metric by default
+DEFAULT_NAMESPACE = 'avalon'
+
+# Content type of the text format for exposing metrics
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+_FILE_PREFIX = 'metrics.'
+
+_FILE_SUFFIX = '.json'
+
+# Counters and histograms of every process that has exited
+_AGGREGATE_NAME = 'metrics.aggregate.json'
+
+# Locked while reading or changing the totals of processes that have exited
+_LOCK_NAME = 'metrics.lock'
+
+_INVALID_NAME_CHARS = re.compile('[^a-zA-Z0-9_]')
+
+
+def _get_path(path, pid):
+    """Get the path of the metrics file for a process."""
+    return os.path.join(path, '{0}{1}{2}'.format(_FILE_PREFIX, pid, _FILE_SUFFIX))
+
+
+def _get_pids(path):
+    """Get the ID of each process that has a metrics file in the directory."""
+    pids = []
+    for name in os.listdir(path):
+        if not name.startswith(_FILE_PREFIX) or not name.endswith(_FILE_SUFFIX):
+            continue
+        try:
+            pids.append(int(name[len(_FILE_PREFIX):-len(_FILE_SUFFIX)]))
+        except ValueError:
+            pass
+    return sorted(pids)
+
+
+def _is_running(pid):
+    """Return true if there is a process with the given ID running."""
+    try:
+        os.kill(pid, 0)
+    except OSError as e:
+        return e.errno == errno.EPERM
+    return True
+
+
+def _unlink(path):
+    """Remove a file if it exists."""
+    try:
+        os.unlink(path)
+    except OSError as e:
+        if e.errno != errno.ENOENT:
+            raise
+
+
+@contextlib.contextmanager
+def _locked(path):
+    """Hold an exclusive lock of the metrics directory, shared by every
+    process of the server, for as long as the context manager is active.
+    """
+    with open(os.path.join(path, _LOCK_NAME), 'a') as handle:
+        fcntl.flock(handle, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(handle, fcntl.LOCK_UN)
+
+
+def _read(path):
+    """Read metrics written to a file, None if they couldn't be read."""
+    try:
+        with codecs.open(path, 'r', encoding='utf-8') as handle:
+            return simplejson.load(handle)
+    except (EnvironmentError, ValueError):
+        # The process may have exited and its file been removed
+        return None
+
+
+def _write(path, snapshot):
+    """Write metrics to a file, replacing the file all at once so that
+    it is never read partially written.
+    """
+    handle, tmp = tempfile.mkstemp(prefix='.metrics', dir=os.path.dirname(path))
+    with codecs.getwriter('utf-8')(os.fdopen(handle, 'wb')) as out:
+        simplejson.dump(snapshot, out)
+    os.rename(tmp, path)
+
+
+def _new_totals(buckets):
+    """Get empty totals of counters and histograms."""
+    return {'buckets': list(buckets), 'counters': {}, 'histograms': {}}
+
+
+def _add_totals(totals, snapshot):
+    """Add the counters and histograms of a snapshot to the totals, skipping
+    histograms written with different buckets that can't be combined.
+    """
+    counters = totals['counters']
+    for stat, val in snapshot['counters'].items():
+        counters[stat] = counters.get(stat, 0) + val
+
+    if snapshot['buckets'] != totals['buckets']:
+        return
+    histograms = totals['histograms']
+    for stat, hist in snapshot['histograms'].items():
+        entry = histograms.get(stat)
+        if entry is None:
+            entry = histograms[stat] = {
+                'buckets': [0] * len(hist['buckets']), 'sum': 0.0, 'count': 0}
+        entry['buckets'] = [a + b for a, b in zip(entry['buckets'], hist['buckets'])]
+        entry['sum'] += hist['sum']
+        entry['count'] += hist['count']
+
+
+def remove_stale(path):
+    """Remove the metrics files of processes that are no longer running
+    and the totals of processes that have exited, meant to be called when
+    the server starts so that metrics of a previous run of the server
+    aren't included.
+
+    Nothing is removed if any other process that is still running has a
+    metrics file since the server is already running (such as when each
+    worker process bootstraps the application itself) and removing the
+    totals would make counters go backwards. The files of processes that
+    exited are added to the totals when metrics are next collected instead.
+
+    :param str path: Directory containing metrics files
+    :return: ID of each process that had its file removed
+    :rtype: list
+    """
+    own = os.getpid()
+    with _locked(path):
+        pids = [pid for pid in _get_pids(path) if pid != own]
+        if any(_is_running(pid) for pid in pids):
+            return []
+
+        _unlink(os.path.join(path, _AGGREGATE_NAME))
+        for pid in pids:
+            _unlink(_get_path(path, pid))
+    return pids
+
+
+class PrometheusStatsClient(object):
+    """Stats client with the same interface as :class:`statsd.StatsClient`
+    that keeps metrics in-process to be exposed in the format scraped by
+    Prometheus, meant to be installed in the singleton bridge instance of
+    :mod:`avalon.metrics`.
+
+    Counters are summed, gauges keep their last value, and timings are
+    counted in histograms with fixed buckets. A background thread writes
+    the metrics of each process to its own file in a shared directory
+    so that they can be combined with those of every other process by
+    :meth:`collect`.
+
+    The background thread is started by the first metric recorded in each
+    process so that the client may be created before worker processes are
+    forked. Counters and histograms inherited from the parent process are
+    discarded (they are already counted by the parent) while gauges, which
+    describe the in-memory stores shared with the parent, are kept.
+
+    When a process exits, its counters and histograms are added to the
+    totals of every process that has exited and its file is removed. The
+    files of processes that exited without doing so (such as by being
+    killed) are added to the totals the next time metrics are collected.
+    """
+
+    _logger = avalon.log.get_error_log()
+
+    def __init__(self, path, namespace=DEFAULT_NAMESPACE, buckets=DEFAULT_BUCKETS,
+                 interval=DEFAULT_WRITE_INTERVAL):
+        """Set the directory to write metrics files to, the prefix for the
+        name of each metric, the upper bound of each histogram bucket, and
+        how often to write the metrics of this process.
+
+        :param str path: Directory shared by every process of the server
+        :param str namespace: Prefix for the name of each metric
+        :param tuple buckets: Upper bound of each histogram bucket in seconds
+        :param float interval: Number of seconds between each time metrics
+            are written
+        """
+        self._path = path
+        self._namespace = namespace
+        self._buckets = tuple(buckets)
+        self._interval = interval
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._closed = threading.Event()
+        self._pid = None
+        self._thread = None
+        self._counters = {}
+        self._gauges = {}
+        self._histograms = {}
+        _clients.add(self)
+
+    def _after_fork(self):
+        """Replace the locks in a newly forked process in case they were
+        held by another thread of the parent process when it was forked.
+        """
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+
+    def _start(self):
+        """Start the background thread for writing metrics if it hasn't
+        been started by this process, discarding any counters and histograms
+        inherited from the parent process. Must be called with the lock held.
+        """
+        pid = os.getpid()
+        if self._pid == pid:
+            return
+
+        if self._pid is not None:
+            self._counters = {}
+            self._histograms = {}
+        self._pid = pid
+        self._thread = threading.Thread(target=self._run, name='avalon-prometheus')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _run(self):
+        """Write metrics until closed or replaced by a new thread."""
+        thread = threading.current_thread()
+        while not self._closed.wait(self._interval) and self._thread is thread:
+            self.write()
+
+    def incr(self, stat, count=1, rate=1):
+        """Add to a counter.
+
+        :param str stat: Key of the counter
+        :param int count: Amount to add
+        :param float rate: Ignored, every count is recorded
+        """
+        with self._lock:
+            self._start()
+            self._counters[stat] = self._counters.get(stat, 0) + count
+
+    def decr(self, stat, count=1, rate=1):
+        """Subtract from a counter.
+
+        :param str stat: Key of the counter
+        :param int count: Amount to subtract
+        :param float rate: Ignored, every count is recorded
+        """
+        self.incr(stat, -count, rate)
+
+    def gauge(self, stat, value, rate=1, delta=False):
+        """Set (or change, if delta is true) the value of a gauge.
+
+        :param str stat: Key of the gauge
+        :param float value: Value of the gauge or amount to change it by
+        :param float rate: Ignored, every value is recorded
+        :param bool delta: Change the gauge by the value instead of setting it
+        """
+        with self._lock:
+            self._start()
+            if delta:
+                value += self._gauges.get(stat, 0)
+            self._gauges[stat] = value
+
+    def timing(self, stat, delta, rate=1):
+        """Add a timing in milliseconds to the histogram for a key.
+
+        :param str stat: Key of the timing
+        :param float delta: Timing in milliseconds
+        :param float rate: Ignored, every timing is recorded
+        """
+        seconds = delta / 1000.0
+        with self._lock:
+            self._start()
+            entry = self._histograms.get(stat)
+            if entry is None:
+                # Count in each bucket (the last for values above every
+                # bound), total, and number of values
+                entry = self._histograms[stat] = [[0] * (len(self._buckets) + 1), 0.0, 0]
+
+            for i, bound in enumerate(self._buckets):
+                if seconds <= bound:
+                    break
+            else:
+                i = len(self._buckets)
+            entry[0][i] += 1
+            entry[1] += seconds
+            entry[2] += 1
+
+    @contextlib.contextmanager
+    def timer(self, stat, rate=1):
+        """Get a context manager for recording the execution time of a block.
+
+        :param str stat: Key of the timing
+        :param float rate: Ignored, every timing is recorded
+        """
+        start = default_timer()
+        try:
+            yield
+        finally:
+            self.timing(stat, (default_timer() - start) * 1000.0, rate)
+
+    def get_snapshot(self):
+        """Get the metrics of this process along with its memory usage.
+
+        :return: Dictionary of ``pid``, ``buckets``, ``counters``, ``gauges``,
+            and ``histograms``
+        :rtype: dict
+        """
+        with self._lock:
+            counters = dict(self._counters)
+            gauges = dict(self._gauges)
+            histograms = dict(
+                (stat, {'buckets': list(counts), 'sum': total, 'count': num})
+                for stat, (counts, total, num) in self._histograms.items())
+
+        rss = avalon.util.get_rss_bytes()
+        if rss is not None:
+            gauges['process.resident_memory_bytes'] = rss
+        return {
+            'pid': os.getpid(),
+            'buckets': list(self._buckets),
+            'counters': counters,
+            'gauges': gauges,
+            'histograms': histograms,
+        }
+
+    def write(self):
+        """Write the metrics of this process to its file, replacing the
+        file all at once so that it is never read partially written.
+        Nothing is written once the client has been closed.
+        """
+        with self._write_lock:
+            if self._closed.is_set():
+                return
+            snapshot = self.get_snapshot()
+            try:
+                _write(_get_path(self._path, snapshot['pid']), snapshot)
+            except EnvironmentError as e:
+                self._logger.warning('Could not write metrics to %s: %s', self._path, e)
+
+    def _get_aggregate_path(self):
+        """Get the path of the totals of processes that have exited."""
+        return os.path.join(self._path, _AGGREGATE_NAME)
+
+    def collect(self):
+        """Combine the metrics of this process with those written by every
+        other process of the server.
+
+        Counters and histograms are summed across all processes, including
+        those that have exited since their totals are still part of the
+        totals of the server. The files of processes that have exited are
+        added to the totals of exited processes and removed. Gauges are kept
+        separately for each process that is still running.
+
+        :return: Dictionary of ``counters``, ``gauges`` keyed by process ID,
+            and ``histograms``
+        :rtype: dict
+        """
+        own = self.get_snapshot()
+        running = [own]
+
+        with _locked(self._path):
+            aggregate_path = self._get_aggregate_path()
+            aggregate = _read(aggregate_path) or _new_totals(self._buckets)
+            exited = []
+
+            for pid in _get_pids(self._path):
+                if pid == own['pid']:
+                    continue
+                snapshot = _read(_get_path(self._path, pid))
+                if _is_running(pid):
+                    if snapshot is not None:
+                        running.append(snapshot)
+                    continue
+                if snapshot is not None:
+                    _add_totals(aggregate, snapshot)
+                exited.append(pid)
+
+            if exited:
+                self._write_aggregate(aggregate_path, aggregate, exited)
+
+        totals = _new_totals(self._buckets)
+        _add_totals(totals, aggregate)
+        for snapshot in running:
+            _add_totals(totals, snapshot)
+
+        return {
+            'counters': totals['counters'],
+            'gauges': dict((snapshot['pid'], snapshot['gauges']) for snapshot in running),
+            'histograms': totals['histograms'],
+        }
+
+    def _write_aggregate(self, aggregate_path, aggregate, pids):
+        """Write the totals of processes that have exited and then remove
+        the files of the given processes since they are now included in
+        the totals. Must be called with the directory locked.
+        """
+        try:
+            _write(aggregate_path, aggregate)
+            for pid in pids:
+                _unlink(_get_path(self._path, pid))
+        except EnvironmentError as e:
+            self._logger.warning('Could not write metrics to %s: %s', self._path, e)
+
+    def _get_name(self, stat, suffix=''):
+        """Get the name of the metric for a key."""
+        name = _INVALID_NAME_CHARS.sub('_', '{0}_{1}{2}'.format(self._namespace, stat, suffix))
+        return name if not name[0].isdigit() else '_' + name
+
+    def render(self):
+        """Render the metrics of every process of the server in the text
+        format scraped by Prometheus.
+
+        Counters are named after their key with a ``_total`` suffix and
+        histograms of timings with a ``_seconds`` suffix. Gauges have a
+        ``pid`` label for the process they belong to.
+
+        :return: Metrics in the Prometheus text format
+        :rtype: unicode
+        """
+        metrics = self.collect()
+        lines = []
+
+        for stat, val in sorted(metrics['counters'].items()):
+            name = self._get_name(stat, '_total')
+            lines.append('# TYPE {0} counter'.format(name))
+            lines.append('{0} {1}'.format(name, val))
+
+        by_stat = {}
+        for pid, gauges in metrics['gauges'].items():
+            for stat, val in gauges.items():
+                by_stat.setdefault(stat, []).append((pid, val))
+
+        for stat, values in sorted(by_stat.items()):
+            name = self._get_name(stat)
+            lines.append('# TYPE {0} gauge'.format(name))
+            for pid, val in sorted(values):
+                lines.append('{0}{{pid="{1}"}} {2}'.format(name, pid, val))
+
+        bounds = ['{0!r}'.format(bound) for bound in self._buckets] + ['+Inf']
+        for stat, hist in sorted(metrics['histograms'].items()):
+            name = self._get_name(stat, '_seconds')
+            lines.append('# TYPE {0} histogram'.format(name))
+            cumulative = 0
+            for bound, val in zip(bounds, hist['buckets']):
+                cumulative += val
+                lines.append('{0}_bucket{{le="{1}"}} {2}'.format(name, bound, cumulative))
+            lines.append('{0}_sum {1!r}'.format(name, hist['sum']))
+            lines.append('{0}_count {1}'.format(name, hist['count']))
+
+        return ''.join(line + '\n' for line in lines)
+
+    def close(self):
+        """Stop the background thread and move the counters and histograms
+        of this process into the totals of processes that have exited,
+        removing the file of this process.
+        """
+        with self._write_lock:
+            self._closed.set()
+            if self._pid != os.getpid():
+                return
+
+            with self._lock:
+                snapshot = {
+                    'buckets': list(self._buckets),
+                    'counters': self._counters,
+                    'histograms': dict(
+                        (stat, {'buckets': list(counts), 'sum': total, 'count': num})
+                        for stat, (counts, total, num) in self._histograms.items()),
+                }
+                # Anything recorded after this is added to the totals by
+                # the next call to close (such as the one at exit)
+                self._counters = {}
+                self._histograms = {}
+
+            try:
+                with _locked(self._path):
+                    aggregate_path = self._get_aggregate_path()
+                    aggregate = _read(aggregate_path) or _new_totals(self._buckets)
+                    _add_totals(aggregate, snapshot)
+                    self._write_aggregate(aggregate_path, aggregate, [os.getpid()])
+            except EnvironmentError as e:
+                self._logger.warning('Could not write metrics to %s: %s', self._path, e)
+
+
+# Clients that haven't been garbage collected, for writing metrics at
+# exit and replacing locks after forking
+_clients = weakref.WeakSet()
+
+
+def _close_clients():
+    """Add the metrics of each client to the totals of exited processes."""
+    for client in list(_clients):
+        client.close()
+
+
+def _reset_clients():
+    """Replace the locks of each client after forking."""
+    for client in list(_clients):
+        # pylint: disable=protected-access
+        client._after_fork()
+
+
+atexit.register(_close_clients)
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_clients)
@@ -18,11 +18,48 @@ from os.path import join
 from avalon.log import DEFAULT_LOGGER_NAME
 
 
+# Token that must be sent as a bearer token in the 'Authorization' header
+# of requests to admin endpoints, such as the 'profile' endpoint for
+# recording where the threads of a worker spend their time. If None, admin
+# endpoints are disabled.
+ADMIN_TOKEN = None
+
+
+# Number of threads that handle requests in each worker process when the
+# server is run with an ASGI server (using 'avalon.app.asgi'). Connections
+# are handled by the event loop of the ASGI server so this only limits how
+# many requests are handled at once, not how many clients are connected.
+ASGI_THREADS = 8
+
+
 # Database connection string for storing or reading music metadata. By
 # default a local SQLite database is used.
 DATABASE_URL = 'sqlite:///' + join(gettempdir(), 'avalon.sqlite')
 
 
+# Optional connection string for a read replica of the database. When
+# set, the web application reads music metadata from the replica while
+# the scanner still writes to the database above. This keeps reloads of
+# many web application workers from adding load to the primary database.
+DATABASE_REPLICA_URL = None
+
+
+# Settings for the pool of connections kept for each database. Values of
+# None use the defaults of the database adapter. Note that the pool size
+# and max overflow are not supported by SQLite databases since they don't
+# use a pool of connections by default. If the null pool is enabled, each
+# connection will be closed after use instead of being kept in a pool,
+# which is the safest choice when web application workers are forked
+# after the application is loaded. If pre-ping is enabled, connections
+# will be tested before each use so that stale connections are replaced.
+# Connections older than the recycle number of seconds are replaced.
+DATABASE_NULL_POOL = False
+DATABASE_POOL_MAX_OVERFLOW = None
+DATABASE_POOL_PRE_PING = False
+DATABASE_POOL_RECYCLE = None
+DATABASE_POOL_SIZE = None
+
+
 # Flask will "pretty print" JSON output by default, we would rather it
 # didn't do that. You probably don't really want to change this.
 JSONIFY_PRETTYPRINT_REGULAR = False
@@ -64,6 +101,41 @@ LOG_PATH = None
 LOGGER_NAME = DEFAULT_LOGGER_NAME
 
 
+# Keep a histogram of each timing and count recorded (such as the time
+# taken by each endpoint and each part of it, and the number of results
+# returned) in each process, for environments without a Statsd server.
+# A summary of the histograms of a process is available from the 'stats'
+# endpoint when enabled.
+METRICS_HISTOGRAMS = False
+
+
+# Directory for keeping counters, gauges (such as the size of each store),
+# and histograms of timings to be scraped by Prometheus instead of sending
+# them to Statsd. Each process writes its metrics to a file in this directory
+# so it must be shared by every worker process of the server. The metrics of
+# every process are combined and returned by the 'metrics' endpoint when set.
+METRICS_PROMETHEUS_PATH = None
+
+
+# Record the wall time, CPU time, memory allocated, and number of objects
+# created by each phase of loading the music collection at startup (such
+# as connecting to the database, loading each store, and building each
+# search index). The profile is logged as a single line of JSON and sent
+# to Statsd as gauges under 'startup.'. This makes startup slower so it
+# should only be enabled while investigating startup time or memory use.
+PROFILE_STARTUP = False
+
+
+# Settings for staggering loading of the music collection from the database
+# when many servers start at once. Each server will wait a random number of
+# seconds up to the jitter before loading. If the concurrency is set, only
+# that many servers on the same machine will load at once, coordinated using
+# lock files in the lock directory (the system temporary directory if None).
+RELOAD_CONCURRENCY = None
+RELOAD_JITTER = 0
+RELOAD_LOCK_DIR = None
+
+
 # Base path to use for handling requests to the WSGI application. For
 # example, with a value of '/avalon' the heartbeat endpoint will be at
 # '/avalon/heartbeat'. With a value of '/' the heartbeat endpoint will
@@ -73,6 +145,36 @@ LOGGER_NAME = DEFAULT_LOGGER_NAME
 REQUEST_PATH = '/avalon'
 
 
+# Number of worker processes to use for normalizing and tokenizing the
+# names of albums, artists, genres, and songs when building the search
+# indexes at startup. This may speed up startup for large music collections
+# on machines with multiple CPUs. If set to None, names will be tokenized
+# in the main process without starting any worker processes.
+SEARCH_BUILD_PROCESSES = None
+
+
+# Maximum number of search index nodes to visit for each index when
+# looking for matches that allow for typos in a search term (requested
+# using the 'fuzzy' parameter). Lower values bound the time taken by
+# these searches at the cost of possibly missing some matches.
+SEARCH_FUZZY_BUDGET = 20000
+
+
+# Maximum total number of songs to keep in the cached results of recent
+# searches for albums, artists, and genres when searching for songs. This
+# makes popular broad searches faster at the cost of some memory. Cached
+# searches are repeated when collection data is reloaded to keep them fast.
+SEARCH_EXPAND_CACHE_SIZE = 200000
+
+
+# Type of index to use for searching names of albums, artists, genres,
+# and songs. The 'radix' index combines chains of characters that only
+# lead to a single term into a single node, using much less memory and
+# building faster than the 'trie' index which uses a node per character.
+# Both return the same results.
+SEARCH_INDEX_TYPE = 'radix'
+
+
 # Configuration for logging unexpected errors to a centralized
 # third-party error aggregation service. Enabling this logging
 # requires supplying a Sentry DSN configuration string below and
@@ -81,6 +183,32 @@ REQUEST_PATH = '/avalon'
 SENTRY_DSN = None
 
 
+# Number of servers (shards) to split the songs of the collection between
+# and the index of this server, from zero up to one less than the number
+# of shards. Each shard loads every album, artist, and genre but only the
+# songs that belong to it. If set to None, all songs will be loaded.
+SHARD_COUNT = None
+SHARD_INDEX = None
+
+
+# Base URLs (including the request path) of each of the servers (shards)
+# that the collection is split between. When set, this server doesn't read
+# from the database at all and instead sends requests to the shards and
+# combines the results. The timeout is the number of seconds to wait for a
+# response from each shard.
+SHARD_URLS = None
+SHARD_TIMEOUT = 10
+
+
+# Number of seconds between each batch of metrics sent to Statsd. If
+# set, metrics are aggregated in-process and sent in batches from a
+# background thread instead of a packet being sent for each metric as it
+# is recorded. This keeps the cost of metrics low under high request rates
+# and doesn't require a Statsd client to be installed. If None, metrics
+# are sent as they are recorded if a Statsd client is installed.
+STATSD_BATCH_INTERVAL = None
+
+
 # Hostname to write Statsd timers and counters to if there is a
 # client installed. The expected client will discard any errors
 # encountered when trying to write metrics so setting this value
@@ -15,6 +15,7 @@ import os
 
 import avalon.log
 import avalon.compat
+import avalon.metrics
 
 
 class TagCrawler(object):
@@ -63,10 +64,18 @@ class TagCrawler(object):
             root path that could be read
         :rtype: list
         """
-        files = self._get_files()
+        with avalon.metrics.timing('scan.walk'):
+            files = self._get_files()
         self._logger.info(
             "Attempting to load metadata for %s files...", len(files))
 
+        with avalon.metrics.timing('scan.read'):
+            return self._read_tags(files)
+
+    def _read_tags(self, files):
+        """Read metadata for each of the given files, skipping files that
+        could not be read.
+        """
         # Note that we're passing args[0] of each exception to the
         # calls to the logger. This is because the logger expects a
         # unicode object as a message and accessing args[0] directly
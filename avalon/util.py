@@ -19,10 +19,14 @@ except ImportError:
     def asizeof(*args, **kwargs):
         return 0
 
+import collections
 import errno
+import fcntl
 import grp
 import pwd
 import resource
+import threading
+import time
 
 import os
 
@@ -46,6 +50,24 @@ def get_mem_usage():
     return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
 
 
+def get_rss_bytes():
+    """Return the resident set size (memory currently in use) of the
+    process in bytes, None if it can't be determined.
+
+    Unlike :func:`get_mem_usage` this is the current size, not the peak.
+    It is only available on platforms with a ``/proc`` filesystem.
+
+    :return: Resident set size of the current process in bytes or None
+    :rtype: int
+    """
+    try:
+        with open('/proc/self/statm', 'rb') as handle:
+            pages = int(handle.read().split()[1])
+    except (EnvironmentError, ValueError, IndexError):
+        return None
+    return pages * resource.getpagesize()
+
+
 def is_perm_error(e):
     """Return true if this exception is file permission related.
 
@@ -93,3 +115,164 @@ def partition(input_list, size):
     """
     for i in range(0, len(input_list), size):
         yield input_list[i:i + size]
+
+
+class LRUCache(object):
+    """Thread-safe mapping of a bounded size that evicts the least
+    recently used entries once more than the maximum number of entries
+    have been added.
+
+    If a weigher is given, the maximum size is the maximum total weight
+    of the entries instead of the number of entries, the weight of each
+    entry being the result of calling the weigher with its value. Values
+    heavier than the maximum size are not cached at all.
+    """
+
+    def __init__(self, max_size, weigher=None):
+        """Set the maximum number (or weight) of entries to keep.
+
+        :param int max_size: Maximum number (or total weight) of entries
+            to keep
+        :param callable weigher: Optional function to get the weight of
+            a value
+        """
+        self._max_size = max_size
+        self._weigher = weigher
+        self._weight = 0
+        # Values are stored along with their weight
+        self._data = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        """Get the number of entries in the cache."""
+        with self._lock:
+            return len(self._data)
+
+    @property
+    def weight(self):
+        """Total weight of all entries in the cache (the number of entries
+        if there is no weigher).
+        """
+        with self._lock:
+            return self._weight
+
+    def keys(self):
+        """Get a list of the keys of all entries, least recently used first.
+
+        :return: Key of each entry
+        :rtype: list
+        """
+        with self._lock:
+            return list(self._data.keys())
+
+    def get(self, key, default=None):
+        """Get the value for the given key, marking it as the most recently
+        used entry, or the default if the key is not in the cache.
+
+        :param key: Key of the entry to get
+        :param default: Value to return if the key is not in the cache
+        :return: Value for the key or the default
+        """
+        with self._lock:
+            try:
+                entry = self._data.pop(key)
+            except KeyError:
+                return default
+            self._data[key] = entry
+            return entry[0]
+
+    def put(self, key, val):
+        """Set the value for the given key as the most recently used entry,
+        evicting the least recently used entries if the cache is full.
+
+        :param key: Key of the entry to set
+        :param val: Value of the entry to set
+        """
+        weight = 1 if self._weigher is None else self._weigher(val)
+
+        with self._lock:
+            old = self._data.pop(key, None)
+            if old is not None:
+                self._weight -= old[1]
+            if weight > self._max_size:
+                return
+
+            self._data[key] = (val, weight)
+            self._weight += weight
+            while self._weight > self._max_size:
+                _, (_, evicted) = self._data.popitem(last=False)
+                self._weight -= evicted
+
+    def clear(self):
+        """Remove all entries from the cache."""
+        with self._lock:
+            self._data.clear()
+            self._weight = 0
+
+
+class FileSemaphore(object):
+    """Semaphore shared between processes on the same machine that allows
+    a limited number of them to hold it at once.
+
+    Each slot of the semaphore is a lock file in the given directory that
+    is locked with :func:`fcntl.flock` while it is held. Locks are released
+    by the OS if a process exits without releasing them.
+    """
+
+    def __init__(self, path, name, slots, poll_interval=0.1):
+        """Set the directory and name of the lock files, the number of
+        processes that may hold the semaphore at once, and how often to
+        check for a free slot when they are all held.
+
+        :param str path: Directory to create the lock files in
+        :param str name: Prefix for the name of each lock file
+        :param int slots: Number of processes that may hold the semaphore
+        :param float poll_interval: Number of seconds to wait between
+            checking for a free slot
+        """
+        self._paths = [
+            os.path.join(path, '{0}.{1}.lock'.format(name, i)) for i in range(slots)]
+        self._poll_interval = poll_interval
+        self._held = None
+
+    def acquire(self, blocking=True):
+        """Acquire one of the slots of the semaphore, waiting for one to
+        be released if they are all held and blocking is true.
+
+        :param bool blocking: Wait for a slot to be free if true
+        :return: True if a slot was acquired, false otherwise
+        :rtype: bool
+        """
+        while True:
+            for path in self._paths:
+                handle = open(path, 'a')
+                try:
+                    fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except EnvironmentError as e:
+                    handle.close()
+                    if e.errno not in (errno.EAGAIN, errno.EACCES):
+                        raise
+                else:
+                    self._held = handle
+                    return True
+
+            if not blocking:
+                return False
+            time.sleep(self._poll_interval)
+
+    def release(self):
+        """Release the slot held by this process, if any."""
+        if self._held is None:
+            return
+        try:
+            fcntl.flock(self._held, fcntl.LOCK_UN)
+        finally:
+            self._held.close()
+            self._held = None
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.release()
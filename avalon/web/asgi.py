@@ -0,0 +1,191 @@
+# -*- coding: utf-8 -*-
+#
+# Avalon Music Server
+#
+# Copyright 2012-2015 TSH Labs <projects@tshlabs.org>
+#
+# Available under the MIT license. See LICENSE for details.
+#
+
+
+"""Adapter for serving a WSGI application from an ASGI server.
+
+Connections are handled by the event loop of the ASGI server while each
+request is handled by the WSGI application in a pool of threads. The
+entire response is rendered by a thread before any of it is sent so
+slow clients only cost the event loop a connection and a buffer instead
+of a thread or process each.
+
+Note that this module requires Python 3.5 or above.
+"""
+
+from __future__ import absolute_import, unicode_literals
+import asyncio
+import io
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+
+# Number of threads to handle requests with by default
+DEFAULT_ASGI_THREADS = 8
+
+
+def _to_wsgi_str(value):
+    """Convert text decoded as UTF-8 to text with each byte as a character,
+    as expected by WSGI applications.
+    """
+    return value.encode('utf-8').decode('latin-1')
+
+
+def get_environ(scope, body):
+    """Construct the WSGI environment for an ASGI HTTP request.
+
+    :param dict scope: Connection scope of the request
+    :param bytes body: Entire body of the request
+    :return: WSGI environment for the request
+    :rtype: dict
+    """
+    root_path = scope.get('root_path', '')
+    path = scope['path']
+    if root_path and path.startswith(root_path):
+        path = path[len(root_path):]
+
+    server = scope.get('server') or ('localhost', 80)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': _to_wsgi_str(root_path),
+        'PATH_INFO': _to_wsgi_str(path),
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': '{0}'.format(server[1]),
+        'SERVER_PROTOCOL': 'HTTP/{0}'.format(scope.get('http_version', '1.1')),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+
+    client = scope.get('client')
+    if client:
+        environ['REMOTE_ADDR'] = client[0]
+        environ['REMOTE_PORT'] = '{0}'.format(client[1])
+
+    for name, value in scope.get('headers', []):
+        name = name.decode('latin-1').upper().replace('-', '_')
+        value = value.decode('latin-1')
+        if name not in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+            name = 'HTTP_' + name
+        if name in environ:
+            value = environ[name] + ',' + value
+        environ[name] = value
+
+    if body and 'CONTENT_LENGTH' not in environ:
+        # The entire body has been read so its length is known even if the
+        # client sent it in chunks without a length
+        environ['CONTENT_LENGTH'] = '{0}'.format(len(body))
+    return environ
+
+
+class _WsgiResponse(object):
+    """Status, headers, and body of the response of a WSGI application."""
+
+    def __init__(self):
+        self.status = None
+        self.headers = []
+        self.body = []
+
+    def start_response(self, status, headers, exc_info=None):
+        """Set the status and headers of the response. Nothing has been
+        sent to the client yet so they may be replaced if there is an error.
+        """
+        self.status = int(status.split(' ', 1)[0])
+        self.headers = [(name.lower().encode('latin-1'), value.encode('latin-1'))
+                        for name, value in headers]
+        return self.body.append
+
+
+class AsgiAdapter(object):
+    """ASGI application that handles each HTTP request with a WSGI
+    application in a pool of threads.
+
+    The thread pool is shut down when the ASGI server sends the ``lifespan``
+    shutdown event (if it supports them).
+    """
+
+    def __init__(self, wsgi_app, threads=DEFAULT_ASGI_THREADS, executor=None):
+        """Set the WSGI application and the number of threads to handle
+        requests with or optionally the executor to use (to allow for easier
+        unit testing).
+
+        :param callable wsgi_app: WSGI application to handle requests with
+        :param int threads: Number of threads to handle requests with
+        :param concurrent.futures.Executor executor: Executor for handling
+            requests, a pool of ``threads`` threads if not set
+        """
+        if executor is None:
+            executor = ThreadPoolExecutor(threads)
+
+        self._wsgi_app = wsgi_app
+        self._executor = executor
+
+    async def __call__(self, scope, receive, send):
+        """Handle a connection from an ASGI server.
+
+        :param dict scope: Type and details of the connection
+        :param callable receive: Coroutine to get the next event
+        :param callable send: Coroutine to send an event
+        :raises ValueError: If the connection is not HTTP or lifespan events
+        """
+        if scope['type'] == 'http':
+            await self._handle_http(scope, receive, send)
+        elif scope['type'] == 'lifespan':
+            await self._handle_lifespan(receive, send)
+        else:
+            raise ValueError("Unsupported connection type {0}".format(scope['type']))
+
+    async def _handle_lifespan(self, receive, send):
+        """Acknowledge startup and shut down the thread pool at shutdown."""
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                self._executor.shutdown(wait=False)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def _handle_http(self, scope, receive, send):
+        """Read the body of the request, handle it with the WSGI application
+        in the thread pool, and send the response.
+        """
+        chunks = []
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                return
+            chunks.append(message.get('body', b''))
+            if not message.get('more_body', False):
+                break
+
+        environ = get_environ(scope, b''.join(chunks))
+        loop = asyncio.get_event_loop()
+        res = await loop.run_in_executor(self._executor, self._run_wsgi_app, environ)
+
+        await send({'type': 'http.response.start', 'status': res.status, 'headers': res.headers})
+        await send({'type': 'http.response.body', 'body': b''.join(res.body)})
+
+    def _run_wsgi_app(self, environ):
+        """Handle a request with the WSGI application and render the entire
+        response, in a thread of the pool.
+        """
+        res = _WsgiResponse()
+        iterable = self._wsgi_app(environ, res.start_response)
+        try:
+            res.body.extend(iterable)
+        finally:
+            if hasattr(iterable, 'close'):
+                iterable.close()
+        return res
@@ -16,16 +16,25 @@ web server and the rest of the application.
 
 from __future__ import absolute_import, unicode_literals
 import functools
+import hmac
+import threading
 
-from flask import request
+from flask import request, Response
 import avalon
+import avalon.compat
 import avalon.exc
 import avalon.log
 import avalon.metrics
+import avalon.profiling
+import avalon.prometheus
 import avalon.web.response
 import avalon.web.request
 
 
+# Endpoints that may be queried as part of a batch
+BATCH_ENDPOINTS = frozenset(['albums', 'artists', 'genres', 'songs', 'suggest'])
+
+
 def render_results(func):
     """Decorator to convert the results of a function into a dictionary
     and then "jsonify" it to be rendered by Flask.
@@ -34,15 +43,21 @@ def render_results(func):
     to render an error response. We do this because these are not really
     exceptional errors and don't merit any special logging or events being
     published (ala Flask signals).
+
+    The time taken to render the results is recorded as the ``render``
+    span of the endpoint.
     """
 
     @functools.wraps(func)
     def wrapper(self, *args, **kwargs):
         try:
-            return avalon.web.response.render(results=func(self, *args, **kwargs))
+            results = func(self, *args, **kwargs)
         except avalon.exc.ApiError as e:
             return avalon.web.response.render(error=e), e.http_code
 
+        with avalon.metrics.span('render'):
+            return avalon.web.response.render(results=results)
+
     return wrapper
 
 
@@ -64,22 +79,39 @@ class AvalonController(object):
 
     _logger = avalon.log.get_error_log()
 
-    def __init__(self, api_endpoints, filters):
-        """Set the endpoints and filters for the controller.
+    def __init__(self, api_endpoints, filters, profiler=None, admin_token=None):
+        """Set the endpoints and filters for the controller and optionally
+        the profiler and token required to use it.
 
         :param avalon.web.services.AvalonMetadataService api_endpoints: Service
             layer for fetching metadata by various criteria
         :param list filters: List of callable filters that will be used to limit
             or sort the results before being returned
+        :param avalon.profiling.SamplingProfiler profiler: Profiler for the
+            ``profile`` endpoint
+        :param unicode admin_token: Token that must be sent as a bearer token
+            in the ``Authorization`` header to use the ``profile`` endpoint. If
+            not set, the endpoint may not be used.
         """
         self._api = api_endpoints
         self._filters = list(filters)
+        self._profiler = profiler
+        self._admin_token = admin_token
+        self._profile_lock = threading.Lock()
 
     def _filter(self, results, params):
-        """Apply each of the filter callbacks to the results."""
-        out = list(results)
-        for out_filter in self._filters:
-            out = out_filter(out, params)
+        """Apply each of the filter callbacks to the results, recording
+        the number of results before (``matched``) and after (``results``)
+        filtering and the time taken as the ``filter`` span of the endpoint.
+        """
+        with avalon.metrics.span('filter'):
+            out = list(results)
+            matched = len(out)
+            for out_filter in self._filters:
+                out = out_filter(out, params)
+
+        avalon.metrics.count('matched', matched)
+        avalon.metrics.count('results', len(out))
         return out
 
     def reload(self):
@@ -99,6 +131,65 @@ class AvalonController(object):
         """Return the version of the currently running server."""
         return avalon.__version__
 
+    def _check_admin_token(self):
+        """Raise an error unless the request has the admin token."""
+        if not self._admin_token or self._profiler is None:
+            raise avalon.exc.PermissionDeniedError("Admin endpoints are not enabled")
+
+        expected = 'Bearer {0}'.format(self._admin_token).encode('utf-8')
+        actual = avalon.compat.to_text(request.headers.get('Authorization', '')).encode('utf-8')
+        if not hmac.compare_digest(expected, actual):
+            raise avalon.exc.PermissionDeniedError("Invalid or missing admin token")
+
+    def get_profile(self):
+        """Profile the other threads of this process for the number of
+        seconds given by the ``seconds`` parameter (1 by default) and return
+        their stacks in the collapsed format used for building flame graphs.
+
+        Only one profile may be recorded at a time by each process. Requests
+        must include the admin token.
+        """
+        try:
+            self._check_admin_token()
+            params = avalon.web.request.ProfileParameters(request)
+            seconds = params.get_int('seconds', 1)
+            if seconds < 1 or seconds > avalon.profiling.MAX_PROFILE_SECONDS:
+                raise avalon.exc.InvalidParameterValueError(
+                    "The value of seconds must be between 1 and {max}",
+                    field='seconds', value=seconds, max=avalon.profiling.MAX_PROFILE_SECONDS)
+
+            if not self._profile_lock.acquire(False):
+                raise avalon.exc.ServiceUnavailableError("A profile is already being recorded")
+            try:
+                self._logger.info('Recording profile for %s seconds', seconds)
+                counts = self._profiler.profile(seconds)
+            finally:
+                self._profile_lock.release()
+        except avalon.exc.ApiError as e:
+            return avalon.web.response.render(error=e), e.http_code
+
+        return Response(avalon.profiling.to_collapsed(counts), mimetype='text/plain')
+
+    def get_stats(self):
+        """Return a summary of the in-process histogram of each timing and
+        count recorded by this process, if histograms are enabled.
+        """
+        histograms = avalon.metrics.bridge.histograms
+        summary = {} if histograms is None else histograms.get_summary()
+        return avalon.web.response.render(results=summary)
+
+    def get_metrics(self):
+        """Return the counters, gauges, and histograms of timings of every
+        process of the server in the text format scraped by Prometheus, if
+        Prometheus metrics are enabled.
+        """
+        client = avalon.metrics.bridge.client
+        if not isinstance(client, avalon.prometheus.PrometheusStatsClient):
+            err = avalon.exc.ServiceMisconfiguredError("Prometheus metrics are not enabled")
+            return avalon.web.response.render(error=err), err.http_code
+
+        return Response(client.render(), content_type=avalon.prometheus.CONTENT_TYPE)
+
     @avalon.metrics.timed('request.albums')
     @render_results
     @convert_parameters
@@ -127,6 +218,53 @@ class AvalonController(object):
         """Songs metadata endpoint."""
         return self._filter(self._api.get_songs(params), params)
 
+    @avalon.metrics.timed('request.suggest')
+    @render_results
+    @convert_parameters
+    def get_suggestions(self, params):
+        """Suggestions (typeahead) endpoint.
+
+        Results are limited by the service and aren't passed through the
+        filters since they are grouped by type and already ordered.
+        """
+        return self._api.get_suggestions(params)
+
+    @avalon.metrics.timed('request.batch')
+    @render_results
+    def get_batch(self):
+        """Batch endpoint for querying the albums, artists, genres, songs, and
+        suggestions endpoints multiple times with a single request.
+
+        Each query is handled one after another by the same process and its
+        results or error are returned in the same order as the queries. The
+        time taken by each query is recorded as a span named after its endpoint.
+        """
+        queries = avalon.web.request.get_batch_queries(request.get_json(force=True, silent=True))
+        avalon.metrics.count('queries', len(queries))
+        return [self._get_batch_response(endpoint, params).to_dict()
+                for endpoint, params in queries]
+
+    def _get_batch_response(self, endpoint, params):
+        """Get the results of a single query of a batch, or the error if
+        the query or its parameters were not valid.
+        """
+        try:
+            if endpoint not in BATCH_ENDPOINTS:
+                raise avalon.exc.InvalidParameterValueError(
+                    "Unsupported value for {field}: '{value}'", field='endpoint', value=endpoint)
+
+            params = avalon.web.request.get_batch_params(params)
+
+            with avalon.metrics.span(endpoint):
+                if endpoint == 'suggest':
+                    results = self._api.get_suggestions(params)
+                else:
+                    results = self._filter(getattr(self._api, 'get_' + endpoint)(params), params)
+        except avalon.exc.ApiError as e:
+            return avalon.web.response.new_response(error=e)
+
+        return avalon.web.response.new_response(results=results)
+
     def handle_unknown_error(self, e):
         """Handle an unexpected :class:`Exception` raised during a request
         by logging it, rendering an error and returning and HTTP 500 status
@@ -17,6 +17,10 @@ import avalon.exc
 SORT_DESC = 'desc'
 SORT_ASC = 'asc'
 
+# Special value of the 'order' parameter for results of a search
+# that are already sorted with the most relevant results first
+ORDER_RELEVANCE = 'relevance'
+
 
 def sort_filter(elms, params):
     """Use query string parameters to sort the result set appropriately
@@ -24,14 +28,16 @@ def sort_filter(elms, params):
     the sorted list of elements.
 
     Both are optional, however invalid values for either will result in
-    exceptions being raised.
+    exceptions being raised. Ordering by ``relevance`` leaves the elements
+    in the order they are given (most relevant first) regardless of the
+    direction and is only valid along with the 'query' parameter.
 
     :param list elms: Elements to sort
     :param avalon.request.Parameters params: Caller request parameters
     :return: Elements sorted by requested parameters
     :rtype: list
     :raises avalon.exc.InvalidParameterValueError: If sort direction is
-        present and invalid
+        present and invalid or the order is ``relevance`` without a query
     :raises avalon.exc.InvalidParameterNameError: If order is present and
         does not correspond to a field in the results
     """
@@ -46,6 +52,15 @@ def sort_filter(elms, params):
             "Invalid sort direction '{direction}'",
             direction=direction)
 
+    if field == ORDER_RELEVANCE:
+        # Without a search there is nothing to rank results by and the
+        # elements would be in whatever order their sets iterate in.
+        if params.get('query') is None:
+            raise avalon.exc.InvalidParameterValueError(
+                "Results may only be ordered by {field} for a search",
+                field=ORDER_RELEVANCE)
+        return elms
+
     sort_key = lambda elm: getattr(elm, field)
     reverse = SORT_DESC == direction
 
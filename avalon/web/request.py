@@ -13,16 +13,24 @@
 from __future__ import absolute_import, unicode_literals
 import uuid
 
+from avalon.packages import six
 import avalon.exc
 
 
+# Maximum number of queries that may be sent in a single batch
+MAX_BATCH_QUERIES = 50
+
+
 class Parameters(object):
     """Logic for accessing query string parameters of interest."""
 
     valid = frozenset(
-        ['album', 'album_id', 'artist', 'artist_id', 'direction',
+        ['album', 'album_id', 'artist', 'artist_id', 'direction', 'fuzzy',
          'order', 'genre', 'genre_id', 'limit', 'offset', 'query'])
 
+    # Fields that may be given more than once
+    multiple = frozenset(['album_id', 'artist_id', 'genre_id'])
+
     def __init__(self, request):
         """Set the query string params to use based on the current request.
 
@@ -57,31 +65,53 @@ class Parameters(object):
                 "Invalid field value for integer field {field}: '{value}'",
                 field=field, value=val)
 
-    def get_uuid(self, field, default=None):
-        """Return the value of the field as a UUID, raising an error
-        if it isn't a valid field or cannot be converted to a UUID, and
-        returning None if the field isn't in the query string.
+    def get_uuid_list(self, field):
+        """Return every value of the field as a UUID, raising an error
+        if it isn't a field that may have multiple values or any of the
+        values cannot be converted to a UUID, and returning an empty list
+        if the field isn't in the query string.
 
-        :param unicode field: Field to get the value of
-        :param default: Default valid if the field is not present
-        :return: The valid of the field as a UUID or the default value
-        :rtype: uuid.UUID
-        :raises avalon.exc.InvalidParameterNameError: If the given field is
-            not a valid recognized field
-        :raises avalon.exc.InvalidParameterTypeError: If there is more than a
-            single value for the field or the given value cannot be converted
-            to a valid UUID
+        :param unicode field: Field to get the values of
+        :return: The value of each occurrence of the field as a UUID
+        :rtype: list
+        :raises KeyError: If the given field is not a valid recognized field
+            that may have multiple values
+        :raises avalon.exc.InvalidParameterTypeError: If any of the values
+            cannot be converted to a valid UUID
         """
-        val = self.get(field)
-        if val is None:
-            return default
+        out = []
+        for val in self.get_list(field):
+            try:
+                out.append(uuid.UUID(val))
+            except (ValueError, TypeError, AttributeError):
+                raise avalon.exc.InvalidParameterTypeError(
+                    "Invalid field value for UUID field {field}: '{value}'",
+                    field=field, value=val)
+        return out
 
-        try:
-            return uuid.UUID(val)
-        except ValueError:
-            raise avalon.exc.InvalidParameterTypeError(
-                "Invalid field value for UUID field {field}: '{value}'",
-                field=field, value=val)
+    def get_list(self, field):
+        """Return every value of the field, raising an error if it isn't
+        a field that may have multiple values, and returning an empty list
+        if the field isn't in the query string.
+
+        :param unicode field: Field to get the values of
+        :return: The value of each occurrence of the field
+        :rtype: list
+        :raises KeyError: If the given field is not a valid recognized field
+            that may have multiple values
+        """
+        if field not in self.multiple:
+            # Like .get(), this can only be triggered by bugs in Avalon
+            raise KeyError("Invalid multiple value field name '{0}'".format(field))
+
+        args = self._request.args
+        if field not in args:
+            return []
+        if hasattr(args, 'getlist'):
+            return args.getlist(field)
+
+        value = args[field]
+        return list(value) if isinstance(value, list) else [value]
 
     def get(self, field, default=None):
         """Return the value of the field, raising an error if it isn't
@@ -107,9 +137,120 @@ class Parameters(object):
 
         value = self._request.args[field]
 
-        # TODO: Support multiple values for each param
         if isinstance(value, list):
             raise avalon.exc.InvalidParameterTypeError(
                 "Multiple values for field '{field}' are not supported",
                 field=field)
         return value
+
+    def items(self):
+        """Return the name and value of each recognized field in the query
+        string, raising an error if there are multiple values for a field
+        that may only have one. The value of fields that may have multiple
+        values is a list of each value.
+
+        :return: Name and value of each field present, sorted by name
+        :rtype: list
+        :raises avalon.exc.InvalidParameterTypeError: If there is more than a
+            single value for a field that may only have one
+        """
+        return [(field, self.get_list(field) if field in self.multiple else self.get(field))
+                for field in sorted(self.valid) if field in self._request.args]
+
+
+class ProfileParameters(Parameters):
+    """Logic for accessing query string parameters of the admin
+    profile endpoint.
+    """
+
+    valid = frozenset(['seconds'])
+
+    multiple = frozenset()
+
+
+class QueryArgs(object):
+    """Stand-in for a request with the given query string parameters,
+    for getting the parameters of each query of a batch with
+    :class:`Parameters`.
+
+    :ivar dict args: Query string parameters of the query
+    """
+
+    def __init__(self, args):
+        self.args = args
+
+
+def _to_arg(field, value, nested=False):
+    """Convert a decoded JSON value to the text it would be in a query
+    string, leaving lists as they are so they are treated as multiple values.
+
+    :raises avalon.exc.InvalidParameterTypeError: If the value is null, an
+        object, or a list inside of a list
+    """
+    if isinstance(value, list) and not nested:
+        return [_to_arg(field, val, nested=True) for val in value]
+    if value is None or isinstance(value, (dict, list)):
+        raise avalon.exc.InvalidParameterTypeError(
+            "Invalid field value for field {field}: must be a string, number, "
+            "boolean, or list of them", field=field)
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    return six.text_type(value)
+
+
+def get_batch_params(params):
+    """Get the parameters of a single query of a batch from its decoded
+    JSON object of ``params``.
+
+    Values are treated the same as query string parameters with lists of
+    values treated as multiple values.
+
+    :param dict params: Decoded JSON parameters of the query
+    :return: Parameters of the query
+    :rtype: Parameters
+    :raises avalon.exc.InvalidParameterTypeError: If any of the values is
+        null, an object, or a list inside of a list
+    """
+    args = dict((key, _to_arg(key, val)) for key, val in params.items())
+    return Parameters(QueryArgs(args))
+
+
+def get_batch_queries(payload, max_queries=MAX_BATCH_QUERIES):
+    """Get the name of the endpoint and the parameters of each query of
+    a batch from its decoded JSON body.
+
+    The body is expected to be an object with a ``queries`` list of
+    objects, each with the name of an ``endpoint`` and an optional object
+    of ``params``. The parameters are left as they were decoded so that
+    invalid values only cause an error for their own query when converted
+    with :func:`get_batch_params`.
+
+    :param dict payload: Decoded JSON body of the batch request
+    :param int max_queries: Maximum number of queries in the batch
+    :return: Endpoint name and decoded parameters of each query
+    :rtype: list
+    :raises avalon.exc.InvalidParameterTypeError: If the body or any of
+        the queries are not in the expected format
+    :raises avalon.exc.InvalidParameterValueError: If there are more
+        than the maximum number of queries
+    """
+    queries = payload.get('queries') if isinstance(payload, dict) else None
+    if not isinstance(queries, list):
+        raise avalon.exc.InvalidParameterTypeError(
+            "Batch requests must be a JSON object with a list of {field}", field='queries')
+
+    if len(queries) > max_queries:
+        raise avalon.exc.InvalidParameterValueError(
+            "Batch requests may not have more than {max} {field}",
+            field='queries', value=len(queries), max=max_queries)
+
+    out = []
+    for query in queries:
+        endpoint = query.get('endpoint') if isinstance(query, dict) else None
+        params = query.get('params', {}) if isinstance(query, dict) else None
+        if not isinstance(endpoint, six.string_types) or not isinstance(params, dict):
+            raise avalon.exc.InvalidParameterTypeError(
+                "Each of the {field} must be an object with an endpoint and params",
+                field='queries')
+        out.append((endpoint, params))
+    return out
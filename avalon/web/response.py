@@ -52,6 +52,21 @@ def render(results=None, error=None):
     :rtype: flask.Response
     :raises ValueError: If both results and error are included
     """
+    return flask.jsonify(**new_response(results=results, error=error).to_dict())
+
+
+def new_response(results=None, error=None):
+    """Factory function for a ServiceResponse object with optional
+    error and success payload parameters.
+
+    :param results: Results to include as the success payload
+        or None
+    :param avalon.exc.ApiError: Exception to include as the error
+        payload or None
+    :return: The result payload or error
+    :rtype: ServiceResponse
+    :raises ValueError: If both results and error are included
+    """
     if results is not None and error is not None:
         raise ValueError("Only results or error can be specified")
 
@@ -60,7 +75,7 @@ def render(results=None, error=None):
         output.success = results
     if error is not None:
         output.errors = [ApiErrorCode.from_api_error(error)]
-    return flask.jsonify(**output.to_dict())
+    return output
 
 
 class ServiceResponse(object):
@@ -12,10 +12,19 @@
 
 from __future__ import absolute_import, unicode_literals
 from unicodedata import normalize, category
+import heapq
+import itertools
 import logging
 
+try:
+    from collections.abc import Set
+except ImportError:
+    # pylint: disable=no-name-in-module
+    from collections import Set
+
 import avalon.compat
 import avalon.log
+import avalon.metrics
 import avalon.util
 
 
@@ -30,8 +39,9 @@ def tokenize(text):
     * Each part: "this", "is", "giving", and "up"
     * Each trailing portion: "is giving up", "giving up"
 
-    Note that the input text is first normalized with the :func:`searchable`
-    function before being worked on.
+    Note that the input text is first normalized the same way as the
+    :func:`searchable` function before being worked on (without caching
+    the result since each name is only tokenized once).
 
     ``None`` text, blank strings, or text that is all whitespace will result
     in an empty set being returned.
@@ -44,7 +54,7 @@ def tokenize(text):
     if not text:
         return set()
 
-    term = searchable(text)
+    term = _normalize(avalon.compat.to_text(text))
     parts = term.split()
 
     if not parts:
@@ -59,12 +69,20 @@ def tokenize(text):
     return tokens
 
 
+# Normalized forms of recent search queries that contain non-ASCII
+# characters (and hence have to go through the slow path to remove
+# accents), keyed by the original query.
+_SEARCHABLE_CACHE = avalon.util.LRUCache(1024)
+
+
 def searchable(query):
     """Convert an input string to a consistent searchable form by
     removing accents, diaretics, converting it to lowercase, and
     removing leading and trailing whitespace.
 
-    None input will be converted to an empty string.
+    None input will be converted to an empty string. ASCII input is
+    only lowercased and stripped since it has no accents to remove and
+    the normalized form of recent non-ASCII input is cached.
 
     :param unicode query: Unicode string to convert to a searchable form
     :return: Normalized searchable unicode string
@@ -72,7 +90,34 @@ def searchable(query):
     """
     if query is None:
         return ''
-    return strip_accents(query).lower().strip()
+
+    query = avalon.compat.to_text(query)
+    if _is_ascii(query):
+        return query.lower().strip()
+
+    normalized = _SEARCHABLE_CACHE.get(query)
+    if normalized is None:
+        normalized = strip_accents(query).lower().strip()
+        _SEARCHABLE_CACHE.put(query, normalized)
+    return normalized
+
+
+def _normalize(text):
+    """Convert text to a searchable form without the cache used by
+    :func:`searchable`.
+    """
+    if _is_ascii(text):
+        return text.lower().strip()
+    return strip_accents(text).lower().strip()
+
+
+def _is_ascii(text):
+    """Return true if the text contains only ASCII characters."""
+    try:
+        text.encode('ascii')
+    except UnicodeError:
+        return False
+    return True
 
 
 def strip_accents(query):
@@ -93,6 +138,56 @@ def strip_accents(query):
     return ''.join(chars)
 
 
+class ElementsView(Set):
+    """Read-only, set-like view of the elements stored at a node in a
+    search trie that does not copy the underlying elements.
+
+    Operators that produce new sets (``&``, ``|``, ``-``) return a new
+    :class:`frozenset` and never modify the view or the node.
+    """
+
+    __slots__ = ('_elements',)
+
+    def __init__(self, elements):
+        """Set the underlying collection of elements.
+
+        :param elements: Collection of elements to provide a view of
+        """
+        self._elements = elements
+
+    @classmethod
+    def _from_iterable(cls, it):
+        return frozenset(it)
+
+    def __contains__(self, elm):
+        return elm in self._elements
+
+    def __iter__(self):
+        return iter(self._elements)
+
+    def __len__(self):
+        return len(self._elements)
+
+    def __repr__(self):
+        return '{0}({1!r})'.format(self.__class__.__name__, self._elements)
+
+    def union(self, *others):
+        """Get a new :class:`frozenset` of the elements in this view and
+        each of the given iterables.
+        """
+        return frozenset(self._elements).union(*others)
+
+    def intersection(self, *others):
+        """Get a new :class:`frozenset` of the elements in this view that
+        are also in each of the given iterables.
+        """
+        return frozenset(self._elements).intersection(*others)
+
+
+# Empty result shared by all searches that don't match anything
+_NO_ELEMENTS = ElementsView(frozenset())
+
+
 # Individual node in the search trie. This object is more complicated than
 # it could be in order to save on memory. For example we use the __slots__
 # functionality to avoid an extra dictionary per instance (about 280 bytes).
@@ -143,16 +238,19 @@ class TrieNode(object):
             self._elements.add(elm)
 
     def get_elements(self):
-        """Get the set of all elements at this node.
+        """Get a read-only view of all elements at this node.
+
+        The elements are not copied so the view will reflect any elements
+        added to this node afterwards.
 
         :return: All elements that are considered to match this node
-        :rtype: set
+        :rtype: ElementsView
         """
         if self._element is not None:
-            return set([self._element])
+            return ElementsView((self._element,))
         if self._elements is not None:
-            return set(self._elements)
-        return set()
+            return ElementsView(self._elements)
+        return _NO_ELEMENTS
 
     def add_child(self, char, node):
         """Add a child node to this node indexed by the given character.
@@ -175,6 +273,20 @@ class TrieNode(object):
                 self._child_key = self._child_val = None
             self._children[char] = node
 
+    def get_child(self, char):
+        """Get the child node indexed by the given character without
+        building a dictionary of all children.
+
+        :param unicode char: Character that represents the path to the child
+        :return: Child node for the character or None if there isn't one
+        :rtype: TrieNode
+        """
+        if self._children is not None:
+            return self._children.get(char)
+        if self._child_key == char:
+            return self._child_val
+        return None
+
     def get_children(self):
         """Get a dictionary of the child nodes indexed by a character.
 
@@ -199,8 +311,8 @@ class SearchTrie(object):
     is expected to be done by the caller.
 
     The SearchTrie is not inherently threadsafe. However, if none of the
-    mutator methods are called [.add()] the read methods [.search(), .size()]
-    are safe to be called by multiple threads.
+    mutator methods are called [.add(), .rank()] the read methods [.search(),
+    .search_ranked(), .size()] are safe to be called by multiple threads.
     """
 
     def __init__(self, node_factory):
@@ -210,6 +322,12 @@ class SearchTrie(object):
         self._node_factory = node_factory
         self._size = 0
         self._root = self._new_node()
+        # Position of each element (by identity) when ranked by name,
+        # elements indexed under their entire name, and the precomputed
+        # top ranked elements of large nodes. Set by .rank()
+        self._order = {}
+        self._exact = {}
+        self._top = {}
 
     def _new_node(self):
         """Create a new node and increment the node counter."""
@@ -229,65 +347,404 @@ class SearchTrie(object):
         :param unicode term: Search term to index the given element under.
         :param element: Element to add to the trie under the given term.
         """
-        self._add(self._root, term, 0, element)
+        node = self._root
+        for char in term:
+            # Every node except the root is considered a match for the
+            # current prefix of the term so add the element to each one
+            node = self._get_or_add_child(node, char)
+            node.add_element(element)
+
+    def add_sorted(self, pairs):
+        """Add metadata elements to the trie each indexed using a term from
+        an iterable of ``(term, element)`` pairs sorted by term.
+
+        This is equivalent to calling :meth:`add` for each pair in order.
+        It exists so that every type of trie can be built the same way,
+        :class:`RadixTrie` reuses the path to the previous term instead.
 
-    def _add(self, node, term, i, element):
-        """Recursively construct nodes in a trie for the given term and metadata
-        element, adding the element to every intermediate node along the way.
+        :param pairs: Iterable of ``(term, element)`` tuples sorted by term,
+            terms normalized the same way as for :meth:`add`.
         """
-        if i > 0:
-            # If this isn't the root node add the element to the
-            # node since it will be considered a match for the
-            # current prefix
-            node.add_element(element)
-        if i == len(term):
-            return
+        add = self.add
+        for term, element in pairs:
+            add(term, element)
 
-        char = term[i]
-        children = node.get_children()
-        if char not in children:
+    def _get_or_add_child(self, node, char):
+        """Get the child of the node for the given character, creating it
+        if it doesn't exist yet.
+        """
+        child = node.get_child(char)
+        if child is None:
             child = self._new_node()
             node.add_child(char, child)
-        else:
-            child = children[char]
-        self._add(child, term, i + 1, element)
+        return child
 
     def search(self, term):
         """Search for metadata elements that match the given term, returning a
-        set of matching elements, and an empty set if there are no matches.
+        read-only set of matching elements, and an empty set if there are no
+        matches.
 
         The term is expected to be normalized using the same method that was
         used to build the trie.
 
         :param unicode term: Search term to use to find matching elements.
         :return: Set of all elements in the trie matching the term.
-        :rtype: set
+        :rtype: ElementsView
+        """
+        node = self._find(term)
+        if node is None:
+            return _NO_ELEMENTS
+        return node.get_elements()
+
+    def rank(self, names, top_size):
+        """Compute the order that elements are returned in by
+        :meth:`search_ranked`, precomputing the most relevant elements for
+        each node with more than the given number of elements.
+
+        :param names: Iterable of ``(name, element)`` tuples sorted by name
+            where the name is the entire normalized name of the element.
+            Ties are ranked in the order they are given.
+        :param int top_size: Number of elements to precompute for large nodes
+        """
+        # Elements are tracked by identity since hashing elements with a
+        # lot of fields (like tracks) is slow and the trie keeps a reference
+        # to each element so their IDs won't be reused.
+        order = {}
+        exact = {}
+        for i, (name, element) in enumerate(names):
+            order[id(element)] = i
+            exact.setdefault(name, []).append(element)
+
+        self._order = order
+        self._exact = dict((name, tuple(elms)) for name, elms in exact.items())
+        self._top = {}
+
+        # The elements of a node are a subset of the elements of its
+        # parent so there's no need to visit anything below a small node.
+        # Exact matches aren't included in the precomputed elements since
+        # the term may not be the entire path to the node it ends at (when
+        # path compression is used).
+        pending = [self._root]
+        while pending:
+            node = pending.pop()
+            elements = node.get_elements()
+            if node is not self._root:
+                if len(elements) <= top_size:
+                    continue
+                self._top[node] = tuple(
+                    heapq.nsmallest(top_size, elements, key=self._get_order))
+
+            pending.extend(node.get_children().values())
+
+    def search_ranked(self, term):
+        """Generate metadata elements that match the given term, most
+        relevant first.
+
+        Elements indexed under their entire name equal to the term are the
+        most relevant, followed by the rest in order of their name (see
+        :meth:`rank`). Precomputed results for large nodes are used first
+        so only consuming the first few elements is fast no matter how
+        many elements match.
+
+        The term is expected to be normalized using the same method that was
+        used to build the trie.
+
+        :param unicode term: Search term to use to find matching elements.
+        :return: Generator of elements in the trie matching the term
+        """
+        node = self._find(term)
+        if node is None:
+            return
+
+        elements = node.get_elements()
+        seen = set()
+
+        for elm in itertools.chain(
+                self._exact.get(term, ()), self._top.get(node, ())):
+            if id(elm) not in seen:
+                seen.add(id(elm))
+                yield elm
+
+        if len(seen) < len(elements):
+            rest = [elm for elm in elements if id(elm) not in seen]
+            for elm in sorted(rest, key=self._get_order):
+                yield elm
+
+    def search_fuzzy(self, term, max_edits, visit_budget):
+        """Search for metadata elements indexed under a term that starts
+        with something within the given number of edits (insertions,
+        deletions, or substitutions of a single character) of the given
+        term, returning a read-only set of matching elements.
+
+        Nodes are visited depth-first while keeping track of the edit
+        distance between the term and the path to each node (one character
+        of the path at a time for nodes with multi-character paths). Paths that
+        can no longer be within the maximum number of edits of the term
+        are skipped and no more than the visit budget number of nodes are
+        visited, so the results may be incomplete for large tries.
+
+        The term is expected to be normalized using the same method that was
+        used to build the trie.
+
+        :param unicode term: Search term to use to find matching elements.
+        :param int max_edits: Maximum edit distance between the term and
+            the start of the terms elements are indexed under
+        :param int visit_budget: Maximum number of nodes to visit
+        :return: Set of all elements found matching the term.
+        :rtype: frozenset
+        """
+        if not term:
+            return frozenset()
+
+        out = set()
+        visits = 0
+        # Each pending node is paired with the row of the edit distance
+        # table for the path to it: the distance between the path and the
+        # first i characters of the term for each i.
+        pending = [(self._root, list(range(len(term) + 1)))]
+
+        while pending and visits < visit_budget:
+            node, row = pending.pop()
+
+            for label, child in node.get_children().items():
+                if visits >= visit_budget:
+                    break
+
+                visits += 1
+                child_row = row
+                for char in label:
+                    child_row = _next_edit_row(term, char, child_row)
+                    if child_row[-1] <= max_edits or min(child_row) > max_edits:
+                        break
+
+                if child_row[-1] <= max_edits:
+                    # The path to this node is close enough to the term, any
+                    # element below it has already been added to this node.
+                    out.update(child.get_elements())
+                elif min(child_row) <= max_edits:
+                    pending.append((child, child_row))
+
+        return frozenset(out)
+
+    def _get_order(self, element):
+        """Get the position of an element when ranked by name, elements
+        missing from the ranking sorting after everything else.
         """
-        return self._search(self._root, term, 0)
+        return self._order.get(id(element), len(self._order))
 
-    def _search(self, node, term, i):
-        """Recursively search down from the given node for the next
-        node based on the position i being examined in the given term.
+    def _find(self, term):
+        """Walk down from the root to the node for the given term, returning
+        None if there is no search term or no node for it.
         """
         if not term:
             # No search term, no results
-            return set()
+            return None
 
-        if i == len(term):
-            # We hit the end of the search term, everything at
-            # the current node is a match for the term
-            return node.get_elements()
+        node = self._root
+        for char in term:
+            node = node.get_child(char)
+            if node is None:
+                # None of the children of the current node match
+                # the next character of the term, no results
+                return None
+        return node
 
-        char = term[i]
-        children = node.get_children()
-        if char not in children:
-            # We're not at a leaf node or the end of the search
-            # term but none of the children of the current node
-            # match, no results
-            return set()
 
-        # Otherwise, continue searching at the next node
-        return self._search(children[char], term, i + 1)
+class RadixNode(TrieNode):
+    """Node in a path compressed trie that represents a particular path
+    through the trie.
+
+    Unlike a :class:`TrieNode`, the path from the parent of a node to it
+    (its label) may be more than a single character. Children are still
+    indexed by the first character of their label.
+    """
+
+    __slots__ = ('label',)
+
+    def __init__(self):
+        """Set initial values for the label, elements, and child nodes."""
+        super(RadixNode, self).__init__()
+        self.label = ''
+
+    def replace_child(self, char, node):
+        """Replace the child node indexed by the given character.
+
+        :param unicode char: First character of the label of the child
+        :param RadixNode node: New child node
+        """
+        if self._children is not None:
+            self._children[char] = node
+        else:
+            self._child_val = node
+
+    def get_children(self):
+        """Get a dictionary of the child nodes indexed by their label.
+
+        :return: Child nodes indexed by the path from this node to each
+        :rtype: dict
+        """
+        return dict((child.label, child) for child in
+                    super(RadixNode, self).get_children().values())
+
+
+class RadixTrie(SearchTrie):
+    """Search trie that collapses chains of nodes with a single child
+    into a single node (a radix tree).
+
+    Most nodes of a :class:`SearchTrie` only have a single child so this
+    greatly reduces the number of nodes in the trie and the memory used
+    by them. Nodes only exist where paths branch or
+    where a term ends, so a search ending part way along the label of a
+    node has the same matches as that node.
+
+    The node factory is expected to return nodes with the same interface
+    as the :class:`RadixNode` class.
+    """
+
+    def add(self, term, element):
+        """Add a metadata element to the trie indexed using the given term.
+
+        The term is expected to be normalized using the same method that will
+        be used for searches against the trie.
+
+        :param unicode term: Search term to index the given element under.
+        :param element: Element to add to the trie under the given term.
+        """
+        self._add_from(self._root, 0, term, element, [])
+
+    def add_sorted(self, pairs):
+        """Add metadata elements to the trie each indexed using a term from
+        an iterable of ``(term, element)`` pairs sorted by term.
+
+        The result is the same as calling :meth:`add` for each pair. Since
+        each term shares a prefix with the one before it, the nodes along
+        the path to the previous term are kept and only the rest of each
+        term is looked up, starting from the deepest node they share.
+
+        :param pairs: Iterable of ``(term, element)`` tuples sorted by term,
+            terms normalized the same way as for :meth:`add`.
+        """
+        # Nodes along the path to the previous term, each with the length
+        # of the prefix of the term that ends at it
+        path = [(self._root, 0)]
+        prev = ''
+
+        for term, element in pairs:
+            common = _common_prefix_len(prev, term, 0)
+            while path[-1][1] > common:
+                path.pop()
+
+            for node, _ in path[1:]:
+                node.add_element(element)
+
+            node, depth = path[-1]
+            self._add_from(node, depth, term, element, path)
+            prev = term
+
+    def _add_from(self, node, i, term, element, path):
+        """Add the element to every node along the path for the rest of
+        the term from the given node and position in the term, splitting
+        nodes where the term leaves their label and appending each node
+        (and the length of the prefix ending at it) to the path.
+        """
+        while i < len(term):
+            child = node.get_child(term[i])
+            if child is None:
+                child = self._new_node()
+                child.label = term[i:]
+                child.add_element(element)
+                node.add_child(term[i], child)
+                path.append((child, len(term)))
+                return
+
+            label = child.label
+            common = _common_prefix_len(label, term, i)
+            if common < len(label):
+                child = self._split(node, child, common)
+
+            child.add_element(element)
+            node = child
+            i += common
+            path.append((node, i))
+
+    def _split(self, parent, child, length):
+        """Split the label of the child node after the given number of
+        characters, inserting a new node for the first part between the
+        parent and child.
+        """
+        label = child.label
+        middle = self._new_node()
+        middle.label = label[:length]
+        # Every element of the child was added along the entire path
+        # to it, including the part that is now the new middle node.
+        for elm in child.get_elements():
+            middle.add_element(elm)
+
+        child.label = label[length:]
+        middle.add_child(child.label[0], child)
+        parent.replace_child(label[0], middle)
+        return middle
+
+    def _find(self, term):
+        """Walk down from the root to the node for the given term (possibly
+        ending part way along its label), returning None if there is no
+        search term or no node for it.
+        """
+        if not term:
+            return None
+
+        node = self._root
+        i = 0
+
+        while i < len(term):
+            node = node.get_child(term[i])
+            if node is None:
+                return None
+
+            label = node.label
+            if term.startswith(label, i):
+                i += len(label)
+            elif label.startswith(term[i:]):
+                # The term ends somewhere along the label
+                return node
+            else:
+                return None
+        return node
+
+
+def _common_prefix_len(label, term, start):
+    """Get the length of the common prefix of the label and the term
+    starting at the given position.
+    """
+    limit = min(len(label), len(term) - start)
+    i = 0
+    while i < limit and label[i] == term[start + i]:
+        i += 1
+    return i
+
+
+# Types of search index that may be used: a trie with a node for each
+# character of each term or a path compressed trie (radix tree)
+INDEX_TYPE_TRIE = 'trie'
+INDEX_TYPE_RADIX = 'radix'
+
+# Number of the most relevant results precomputed for each search term
+# that matches more elements than this by default
+DEFAULT_TOP_SIZE = 100
+
+# Maximum number of typos that may be allowed in a search term and the
+# number of trie nodes that may be visited looking for matches allowing
+# for them by default
+MAX_FUZZY = 2
+DEFAULT_FUZZY_BUDGET = 20000
+
+# Number of distinct prefixes (and number of suggestions) to keep the
+# suggestions for by default
+DEFAULT_SUGGEST_CACHE_SIZE = 1024
+
+# Total number of tracks in the cached sets of tracks belonging to the
+# albums, artists, and genres matching recent search terms by default
+DEFAULT_EXPAND_CACHE_SIZE = 200000
 
 
 class AvalonTextSearch(object):
@@ -302,7 +759,10 @@ class AvalonTextSearch(object):
     _logger = avalon.log.get_error_log()
 
     def __init__(self, album_store, artist_store, genre_store,
-                 track_store, trie_factory):
+                 track_store, trie_factory, pool_factory=None,
+                 top_size=DEFAULT_TOP_SIZE, fuzzy_budget=DEFAULT_FUZZY_BUDGET,
+                 suggest_cache_size=DEFAULT_SUGGEST_CACHE_SIZE,
+                 expand_cache_size=DEFAULT_EXPAND_CACHE_SIZE):
         """Set the backing stores and new search trie factory for
         searching and use them to build a search index for the music
         collection.
@@ -312,6 +772,31 @@ class AvalonTextSearch(object):
         instances may be mutable but will not be modified after they
         are constructed in the .reload() method.
 
+        The pool factory, if given, is expected to return a process pool
+        with the same interface as :class:`multiprocessing.Pool` that
+        will be used for normalizing and tokenizing the names of elements
+        while the search indexes are built. If not given, names are
+        tokenized in the current process.
+
+        The top size is the number of the most relevant results to
+        precompute for search terms that match more elements than that.
+        Ranked searches that only need that many results don't have to
+        sort every matching element.
+
+        The fuzzy budget is the maximum number of nodes of each search trie
+        to visit when looking for matches that allow for typos in the needle,
+        bounding the time taken by those searches.
+
+        The suggest cache size is the number of recently requested prefixes
+        to keep suggestions for, the cache is cleared each time the search
+        indexes are rebuilt.
+
+        The expand cache size is the maximum total number of tracks in the
+        cached sets of tracks belonging to the albums, artists, and genres
+        matching recent search terms. Terms in the cache are looked up again
+        each time the search indexes are rebuilt so that popular searches
+        stay fast.
+
         Note that metadata from each of the stores will be loaded and
         the tries will be constructed immediately upon instantiation of
         this class.
@@ -321,6 +806,11 @@ class AvalonTextSearch(object):
         self._genre_store = genre_store
         self._track_store = track_store
         self._trie_factory = trie_factory
+        self._pool_factory = pool_factory
+        self._top_size = top_size
+        self._fuzzy_budget = fuzzy_budget
+        self._suggestions = avalon.util.LRUCache(suggest_cache_size)
+        self._expansions = avalon.util.LRUCache(expand_cache_size, weigher=len)
 
         self._album_search = None
         self._artist_search = None
@@ -334,21 +824,29 @@ class AvalonTextSearch(object):
                len(self._track_search)
 
     def reload(self):
-        """Rebuild the search indexes for the collection and return this object."""
-        album_search = self._trie_factory()
-        artist_search = self._trie_factory()
-        genre_search = self._trie_factory()
-        track_search = self._trie_factory()
+        """Rebuild the search indexes for the collection and return this object.
 
-        self._add_all_to_tree(self._album_store.get_all(), album_search)
-        self._add_all_to_tree(self._artist_store.get_all(), artist_search)
-        self._add_all_to_tree(self._genre_store.get_all(), genre_search)
-        self._add_all_to_tree(self._track_store.get_all(), track_search)
+        The time taken to build each index is recorded under
+        ``reload.search.<index>`` and logged at DEBUG.
+        """
+        pool = None if self._pool_factory is None else self._pool_factory()
+
+        try:
+            album_search = self._build_index('albums', self._album_store.get_all(), pool)
+            artist_search = self._build_index('artists', self._artist_store.get_all(), pool)
+            genre_search = self._build_index('genres', self._genre_store.get_all(), pool)
+            track_search = self._build_index('tracks', self._track_store.get_all(), pool)
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
 
         self._album_search = album_search
         self._artist_search = artist_search
         self._genre_search = genre_search
         self._track_search = track_search
+        self._suggestions.clear()
+        self._warm_expansions()
 
         # Check if DEBUG is enabled since getting memory usage is slow
         if self._logger.isEnabledFor(logging.DEBUG):
@@ -363,59 +861,333 @@ class AvalonTextSearch(object):
 
         return self
 
+    def _warm_expansions(self):
+        """Replace the cached tracks for recent search terms with the tracks
+        matching them in the newly built indexes, recording the time taken.
+        """
+        with avalon.metrics.timing('reload.search.warm') as elapsed:
+            # Keys are least recently used first so the most recent terms
+            # end up being the most recently used again
+            hot = self._expansions.keys()
+            self._expansions.clear()
+            for term, fuzzy in hot:
+                self._get_field_matches(term, fuzzy)
+
+        self._logger.debug(
+            'Warmed %s cached search terms in %s ms', len(hot), elapsed.ms)
+
+    def _build_index(self, name, elms, pool):
+        """Build a new search trie with each of the given elements indexed
+        under the tokens of its name, recording the time taken.
+        """
+        with avalon.metrics.timing('reload.search.' + name) as elapsed:
+            trie = self._trie_factory()
+            elms = list(elms)
+            trie.add_sorted(
+                (token, elms[i]) for token, i in self._get_sorted_tokens(elms, pool))
+            trie.rank(self._get_sorted_names(elms), self._top_size)
+
+        self._logger.debug('Built %s search index in %s ms', name, elapsed.ms)
+        return trie
+
+    @staticmethod
+    def _get_sorted_tokens(elms, pool):
+        """Get a sorted list of ``(token, ordinal)`` pairs for the normalized
+        tokens of the name of each element, tokenizing names using the pool
+        if there is one. The ordinal is the position of the element the token
+        belongs to in the given list.
+        """
+        names = [elm.name for elm in elms]
+        if pool is None:
+            all_tokens = [tokenize(elm_name) for elm_name in names]
+        else:
+            all_tokens = pool.map(tokenize, names)
+
+        pairs = [(token, i) for i, tokens in enumerate(all_tokens) for token in tokens]
+        pairs.sort()
+        return pairs
+
     @staticmethod
-    def _add_all_to_tree(elms, trie):
-        """Add a normalized version of the name of each of the given
-        elements to the search trie.
+    def _get_sorted_names(elms):
+        """Get a list of ``(name, element)`` pairs for the normalized name
+        of each element sorted by name (and ID for equal names).
         """
-        for elm in elms:
-            tokens = tokenize(elm.name)
-            for token in tokens:
-                trie.add(token, elm)
+        keys = [(_normalize(avalon.compat.to_text(elm.name)), elm.id, i)
+                for i, elm in enumerate(elms)]
+        keys.sort()
+        return [(name, elms[i]) for name, _, i in keys]
 
-    def search_albums(self, needle):
+    def search_albums(self, needle, fuzzy=0):
         """Search albums by name (case insensitive).
 
         :param unicode needle: Needle to search album names for
-        :return: Set of albums :class:`avalon.elms.IdNameElm` that match
-        :rtype: set
+        :param int fuzzy: Maximum number of typos to allow in the needle
+        :return: Read-only set of albums :class:`avalon.elms.IdNameElm` that match
+        :rtype: ElementsView
         """
-        return self._album_search.search(searchable(needle))
+        return self._search_index(self._album_search, searchable(needle), fuzzy)
 
-    def search_artists(self, needle):
+    def search_artists(self, needle, fuzzy=0):
         """Search artists by name (case insensitive).
 
-        :param unicode needle: Needle to search album names for
-        :return: Set of artist :class:`avalon.elms.IdNameElm` that match
-        :rtype: set
+        :param unicode needle: Needle to search artist names for
+        :param int fuzzy: Maximum number of typos to allow in the needle
+        :return: Read-only set of artist :class:`avalon.elms.IdNameElm` that match
+        :rtype: ElementsView
         """
-        return self._artist_search.search(searchable(needle))
+        return self._search_index(self._artist_search, searchable(needle), fuzzy)
 
-    def search_genres(self, needle):
+    def search_genres(self, needle, fuzzy=0):
         """Search genres by name (case insensitive).
 
         :param unicode needle: Needle to search genre names for
-        :return: Set of genre :class:`avalon.elms.IdNameElm` that match
-        :rtype: set
+        :param int fuzzy: Maximum number of typos to allow in the needle
+        :return: Read-only set of genre :class:`avalon.elms.IdNameElm` that match
+        :rtype: ElementsView
         """
-        return self._genre_search.search(searchable(needle))
+        return self._search_index(self._genre_search, searchable(needle), fuzzy)
 
-    def search_tracks(self, needle):
+    def search_tracks(self, needle, fuzzy=0):
         """Search for tracks that have an album, artist, genre,
         or name or containing the given needle (case insensitive).
 
+        If the needle contains multiple words, tracks that match each of
+        the words in any of these fields are also included. For example,
+        "radiohead kid" matches tracks by the artist Radiohead on the album
+        Kid A.
+
         :param unicode needle: Needle to search for in track names,
             album names, artist names, and genre names
+        :param int fuzzy: Maximum number of typos to allow in the needle
         :return: Set of track :class:`avalon.elms.TrackElm` that match
-        :rtype: set
+        :rtype: frozenset
+        """
+        # Normalize the needle once and use it for each of the indexes
+        term = searchable(needle)
+        out = self._get_field_matches(term, fuzzy).union(
+            self._search_index(self._track_search, term, fuzzy))
+
+        terms = term.split()
+        if len(terms) > 1:
+            out = out.union(self._get_all_terms_matches(terms, fuzzy))
+        return out
+
+    def search_albums_ranked(self, needle, fuzzy=0):
+        """Search albums by name (case insensitive), most relevant first.
+
+        :param unicode needle: Needle to search album names for
+        :param int fuzzy: Maximum number of typos to allow in the needle
+        :return: Generator of album :class:`avalon.elms.IdNameElm` that match
+        """
+        return self._search_index_ranked(self._album_search, searchable(needle), fuzzy)
+
+    def search_artists_ranked(self, needle, fuzzy=0):
+        """Search artists by name (case insensitive), most relevant first.
+
+        :param unicode needle: Needle to search artist names for
+        :param int fuzzy: Maximum number of typos to allow in the needle
+        :return: Generator of artist :class:`avalon.elms.IdNameElm` that match
         """
-        # Search for the needle in albums, artists, and genres separately
+        return self._search_index_ranked(self._artist_search, searchable(needle), fuzzy)
+
+    def search_genres_ranked(self, needle, fuzzy=0):
+        """Search genres by name (case insensitive), most relevant first.
+
+        :param unicode needle: Needle to search genre names for
+        :param int fuzzy: Maximum number of typos to allow in the needle
+        :return: Generator of genre :class:`avalon.elms.IdNameElm` that match
+        """
+        return self._search_index_ranked(self._genre_search, searchable(needle), fuzzy)
+
+    def search_tracks_ranked(self, needle, fuzzy=0):
+        """Search for tracks the same way as :meth:`search_tracks`, most
+        relevant first.
+
+        Tracks with a name equal to the needle are the most relevant,
+        followed by tracks with a word in their name starting with the
+        needle, followed by tracks with an album, artist, or genre matching
+        the needle, followed by tracks that only match when allowing for
+        typos, followed by tracks that match each word of the needle in
+        different fields. Tracks are ordered by name within each of these
+        groups.
+
+        Matches are generated lazily so if only the first few are consumed,
+        album, artist, and genre matches are never looked up when there are
+        enough tracks with a matching name.
+
+        :param unicode needle: Needle to search for in track names,
+            album names, artist names, and genre names
+        :param int fuzzy: Maximum number of typos to allow in the needle
+        :return: Generator of track :class:`avalon.elms.TrackElm` that match
+        """
+        term = searchable(needle)
+        track_search = self._track_search
+
+        for track in track_search.search_ranked(term):
+            yield track
+
+        names = track_search.search(term)
+        fields = self._get_field_matches(term) - names
+        for track in _sort_by_name(fields):
+            yield track
+
+        typos = set()
+        if _get_max_edits(term, fuzzy):
+            typos = set(self._get_field_matches(term, fuzzy))
+            typos.update(self._search_index(track_search, term, fuzzy))
+            typos.difference_update(names)
+            typos.difference_update(fields)
+            for track in _sort_by_name(typos):
+                yield track
+
+        terms = term.split()
+        if len(terms) > 1:
+            rest = self._get_all_terms_matches(terms, fuzzy)
+            rest.difference_update(names)
+            rest.difference_update(fields)
+            rest.difference_update(typos)
+            for track in _sort_by_name(rest):
+                yield track
+
+    def suggest(self, needle, limit):
+        """Get the most relevant albums, artists, genres, and tracks with
+        a name matching the needle for suggesting to users as they type.
+
+        Unlike :meth:`search_tracks`, tracks are only matched by name. The
+        suggestions for recently used needles are cached until the search
+        indexes are rebuilt.
+
+        :param unicode needle: Needle (usually a prefix) to get suggestions for
+        :param int limit: Maximum number of suggestions of each type
+        :return: Dictionary of ``albums``, ``artists``, ``genres``, and
+            ``songs`` to tuples of suggestions, most relevant first
+        :rtype: dict
+        """
+        term = searchable(needle)
+        key = (term, limit)
+
+        out = self._suggestions.get(key)
+        if out is None:
+            out = {
+                'albums': self._take(self._album_search, term, limit),
+                'artists': self._take(self._artist_search, term, limit),
+                'genres': self._take(self._genre_search, term, limit),
+                'songs': self._take(self._track_search, term, limit),
+            }
+            self._suggestions.put(key, out)
+        return out
+
+    @staticmethod
+    def _take(trie, term, limit):
+        """Get a tuple of the most relevant matches from the index."""
+        return tuple(itertools.islice(trie.search_ranked(term), limit))
+
+    def _search_index(self, trie, term, fuzzy):
+        """Search the index for the normalized term, allowing for typos
+        if the term is long enough.
+        """
+        max_edits = _get_max_edits(term, fuzzy)
+        if not max_edits:
+            return trie.search(term)
+
+        # Exact matches are always included even if the visit budget
+        # runs out before they would have been found.
+        return trie.search(term) | trie.search_fuzzy(
+            term, max_edits, self._fuzzy_budget)
+
+    def _search_index_ranked(self, trie, term, fuzzy):
+        """Search the index for the normalized term, most relevant first,
+        followed by matches that are only found when allowing for typos.
+        """
+        for elm in trie.search_ranked(term):
+            yield elm
+
+        if _get_max_edits(term, fuzzy):
+            rest = self._search_index(trie, term, fuzzy) - trie.search(term)
+            for elm in _sort_by_name(rest):
+                yield elm
+
+    def _get_all_terms_matches(self, terms, fuzzy):
+        """Get the set of tracks that match every one of the normalized
+        terms by name, album, artist, or genre.
+
+        Only the tracks matching the term with the fewest matches are
+        collected. Those are then checked against the matches for each of
+        the other terms in order of their number of matches so that the
+        work done doesn't grow with the number of tracks matching the
+        other (more common) terms.
+        """
+        matches = [self._get_term_matches(term, fuzzy) for term in set(terms)]
+        matches.sort(key=self._estimate_matches)
+
+        tracks, albums, artists, genres = matches[0]
+        out = self._get_tracks_for(albums, artists, genres)
+        out.update(tracks)
+
+        for tracks, albums, artists, genres in matches[1:]:
+            if not out:
+                break
+
+            album_ids = frozenset(album.id for album in albums)
+            artist_ids = frozenset(artist.id for artist in artists)
+            genre_ids = frozenset(genre.id for genre in genres)
+            out = set(
+                track for track in out
+                if track.album_id in album_ids or
+                track.artist_id in artist_ids or
+                track.genre_id in genre_ids or
+                track in tracks)
+        return out
+
+    def _get_term_matches(self, term, fuzzy):
+        """Get the tracks, albums, artists, and genres that match a single
+        normalized term by name.
+        """
+        return (
+            self._search_index(self._track_search, term, fuzzy),
+            self._search_index(self._album_search, term, fuzzy),
+            self._search_index(self._artist_search, term, fuzzy),
+            self._search_index(self._genre_search, term, fuzzy))
+
+    def _estimate_matches(self, matches):
+        """Get the maximum number of tracks matching a term without
+        finding the distinct tracks.
+        """
+        tracks, albums, artists, genres = matches
+        store = self._track_store
+        return len(tracks) + \
+            sum(len(store.get_by_album(album.id)) for album in albums) + \
+            sum(len(store.get_by_artist(artist.id)) for artist in artists) + \
+            sum(len(store.get_by_genre(genre.id)) for genre in genres)
+
+    def _get_field_matches(self, term, fuzzy=0):
+        """Get the set of tracks with an album, artist, or genre matching
+        the normalized term, cached for recent terms since combining the
+        tracks for each match is expensive for broad terms.
+        """
+        # Use the number of typos actually allowed so that requests for
+        # more typos than short terms allow share the same entry
+        fuzzy = _get_max_edits(term, fuzzy)
+        key = (term, fuzzy)
+        out = self._expansions.get(key)
+        if out is not None:
+            return out
+
+        # Search for the term in albums, artists, and genres separately
         # so that we only check the name of an element for matches no matter
         # what type it is.
-        albums = self.search_albums(needle)
-        artists = self.search_artists(needle)
-        genres = self.search_genres(needle)
+        albums = self._search_index(self._album_search, term, fuzzy)
+        artists = self._search_index(self._artist_search, term, fuzzy)
+        genres = self._search_index(self._genre_search, term, fuzzy)
+
+        out = frozenset(self._get_tracks_for(albums, artists, genres))
+        self._expansions.put(key, out)
+        return out
 
+    def _get_tracks_for(self, albums, artists, genres):
+        """Get the set of tracks belonging to any of the albums, artists,
+        or genres.
+        """
         out = set()
 
         for album in albums:
@@ -425,4 +1197,33 @@ class AvalonTextSearch(object):
         for genre in genres:
             out.update(self._track_store.get_by_genre(genre.id))
 
-        return out.union(self._track_search.search(searchable(needle)))
+        return out
+
+
+def _next_edit_row(term, char, row):
+    """Get the row of the edit distance table for a path one character
+    longer than the path for the given row.
+    """
+    out = [row[0] + 1]
+    for i in range(1, len(row)):
+        out.append(min(
+            out[i - 1] + 1,
+            row[i] + 1,
+            row[i - 1] + (term[i - 1] != char)))
+    return out
+
+
+def _get_max_edits(term, fuzzy):
+    """Get the number of typos to allow in a normalized search term,
+    reducing the requested amount for short terms that would otherwise
+    match nearly everything.
+    """
+    if not fuzzy:
+        return 0
+    return min(fuzzy, MAX_FUZZY, (len(term) - 1) // 2)
+
+
+def _sort_by_name(elms):
+    """Sort elements by their normalized name (and ID for equal names)."""
+    return sorted(elms, key=lambda elm: (
+        _normalize(avalon.compat.to_text(elm.name)), elm.id))
@@ -12,8 +12,15 @@
 
 from __future__ import absolute_import, unicode_literals
 import functools
+import itertools
+import logging
 
+import avalon.exc
 import avalon.log
+import avalon.metrics
+import avalon.util
+import avalon.web.filtering
+import avalon.web.search
 
 
 # Disable warning about constant that's really a function
@@ -31,6 +38,70 @@ def intersection(sets):
         [res_set for res_set in sets if res_set is not None])
 
 
+def union(sets):
+    """Find the union of all of the given sets in a single pass over each
+    of them, instead of one pair at a time, so that the cost is proportional
+    to the size of the result.
+    """
+    if len(sets) == 1:
+        return sets[0]
+    return frozenset().union(*sets)
+
+
+def is_ranked(params):
+    """Return true if the results of a search should be ordered by relevance."""
+    return params.get('order') == avalon.web.filtering.ORDER_RELEVANCE
+
+
+def get_ranked_limit(params):
+    """Get the number of the most relevant search results needed to satisfy
+    the 'limit' and 'offset' parameters, None if all results are needed.
+
+    Invalid values result in None here, they will be rejected when the
+    results are limited.
+    """
+    try:
+        limit = params.get_int('limit')
+        offset = params.get_int('offset', 0)
+    except avalon.exc.ApiError:
+        return None
+
+    if limit is None or limit < 0 or offset < 0:
+        return None
+    return offset + limit
+
+
+# Number of suggestions of each type to return by default and at most
+DEFAULT_SUGGEST_LIMIT = 5
+MAX_SUGGEST_LIMIT = 50
+
+
+def get_fuzzy(params):
+    """Get the maximum number of typos to allow in a search term.
+
+    :raises avalon.exc.InvalidParameterTypeError: If the value is not
+        an integer
+    :raises avalon.exc.InvalidParameterValueError: If the value is negative
+        or more than the maximum supported
+    """
+    fuzzy = params.get_int('fuzzy', 0)
+    if fuzzy < 0 or fuzzy > avalon.web.search.MAX_FUZZY:
+        raise avalon.exc.InvalidParameterValueError(
+            "The value of fuzzy must be between 0 and {max}",
+            field='fuzzy', value=fuzzy, max=avalon.web.search.MAX_FUZZY)
+    return fuzzy
+
+
+def take_ranked(results, params, allowed=None):
+    """Consume only as many of the generated ranked search results as are
+    needed for the request, skipping any that aren't in the allowed set
+    (if given).
+    """
+    if allowed is not None:
+        results = (res for res in results if res in allowed)
+    return list(itertools.islice(results, get_ranked_limit(params)))
+
+
 class AvalonMetadataServiceConfig(object):
     """Configuration for the metadata endpoints.
 
@@ -48,6 +119,13 @@ class AvalonMetadataServiceConfig(object):
     :ivar avalon.cache.IdNameStore id_cache: In-memory store for
         looking up the UUID of tracks, albums, artists, or genres
         by their name.
+    :ivar avalon.cache.InternTable interner: Optional table used by
+        each of the stores for sharing UUIDs and names that will be
+        cleared after each reload.
+    :ivar avalon.cache.CollectionLoader loader: Optional loader for
+        reading each table once and populating every store from the
+        same elements. If not set, each store will read from the
+        database independently.
     """
 
     def __init__(self):
@@ -57,6 +135,8 @@ class AvalonMetadataServiceConfig(object):
         self.genre_store = None
         self.search = None
         self.id_cache = None
+        self.interner = None
+        self.loader = None
 
 
 class AvalonMetadataService(object):
@@ -72,19 +152,31 @@ class AvalonMetadataService(object):
         self._genres = config.genre_store
         self._search = config.search
         self._id_cache = config.id_cache
+        self._interner = config.interner
+        self._loader = config.loader
+        self._generation = 0
 
     def reload(self):
         """Reload in-memory stores from the database.
 
+        If a collection loader is configured, each table will be read
+        once and used to populate every store. Otherwise, each store
+        will read from the database independently.
+
+        The size of each store, number of search trie nodes, and number
+        of times the stores have been loaded (``reload.generation``) are
+        recorded as gauges.
+
         :return: This object
         :rtype: AvalonApiEndpoints
         """
-        self._tracks.reload()
-        self._albums.reload()
-        self._artists.reload()
-        self._genres.reload()
-        self._search.reload()
-        self._id_cache.reload()
+        try:
+            if self._loader is None:
+                self._reload_each()
+            else:
+                self._reload_from(self._loader.load())
+        finally:
+            self._release_interned()
 
         self._logger.info('Loaded %s tracks', len(self._tracks))
         self._logger.info('Loaded %s albums', len(self._albums))
@@ -92,8 +184,64 @@ class AvalonMetadataService(object):
         self._logger.info('Loaded %s genres', len(self._genres))
         self._logger.info('Using %s trie nodes', len(self._search))
 
+        self._generation += 1
+        avalon.metrics.gauge('store.tracks', len(self._tracks))
+        avalon.metrics.gauge('store.albums', len(self._albums))
+        avalon.metrics.gauge('store.artists', len(self._artists))
+        avalon.metrics.gauge('store.genres', len(self._genres))
+        avalon.metrics.gauge('search.nodes', len(self._search))
+        avalon.metrics.gauge('reload.generation', self._generation)
+
         return self
 
+    def _reload_each(self):
+        """Reload each store, having each read from the database."""
+        self._tracks.reload()
+        self._albums.reload()
+        self._artists.reload()
+        self._genres.reload()
+        self._search.reload()
+        self._id_cache.reload()
+
+    def _reload_from(self, collection):
+        """Populate each store from elements read in a single pass over
+        each table, recording the time taken for each store.
+        """
+        with avalon.metrics.timing('reload.tracks'):
+            self._tracks.load(collection.tracks)
+        with avalon.metrics.timing('reload.albums'):
+            self._albums.load(collection.albums)
+        with avalon.metrics.timing('reload.artists'):
+            self._artists.load(collection.artists)
+        with avalon.metrics.timing('reload.genres'):
+            self._genres.load(collection.genres)
+        with avalon.metrics.timing('reload.id_cache'):
+            self._id_cache.load(
+                collection.albums, collection.artists, collection.genres)
+        # The search indexes are built from the contents of each of the
+        # stores so they must be populated first.
+        with avalon.metrics.timing('reload.search'):
+            self._search.reload()
+
+    def _release_interned(self):
+        """Clear the table of interned values shared by the stores (if
+        there is one) since it's only needed while the stores are being
+        reloaded.
+        """
+        if self._interner is None:
+            return
+
+        # Check if DEBUG is enabled since getting memory usage is slow
+        if self._logger.isEnabledFor(logging.DEBUG):
+            after = avalon.util.get_size_in_mb(self._interner.get_values())
+            before = after + self._interner.duplicate_bytes / (1024.0 * 1024.0)
+            self._logger.debug(
+                'Interned %s distinct values replacing %s duplicates, '
+                'using %s mb before interning and %s mb after',
+                len(self._interner), self._interner.duplicates, before, after)
+
+        self._interner.clear()
+
     def get_albums(self, params=None):
         """Return album results based on the given query string
         parameters, all albums if there are no parameters.
@@ -101,15 +249,23 @@ class AvalonMetadataService(object):
         Supported parameters are:
 
         * ``query`` -- Search term
+        * ``fuzzy`` -- Maximum number of typos to allow in the search term
+        * ``order`` -- ``relevance`` to get the search results ordered by
+          relevance, only fetching as many as needed for ``limit``
 
         :param avalon.web.request.Parameters params: Request parameters
             to filter albums by or None
         :return: All albums that match the given parameters
-        :rtype: frozenset
+        :rtype: frozenset or list
         """
         if params is None or params.get('query') is None:
             return self._albums.get_all()
-        return self._search.search_albums(params.get('query'))
+        fuzzy = get_fuzzy(params)
+        with avalon.metrics.span('search'):
+            if is_ranked(params):
+                return take_ranked(
+                    self._search.search_albums_ranked(params.get('query'), fuzzy=fuzzy), params)
+            return self._search.search_albums(params.get('query'), fuzzy=fuzzy)
 
     def get_artists(self, params=None):
         """Return artist results based on the given query string
@@ -118,15 +274,23 @@ class AvalonMetadataService(object):
         Supported parameters are:
 
         * ``query`` -- Search term
+        * ``fuzzy`` -- Maximum number of typos to allow in the search term
+        * ``order`` -- ``relevance`` to get the search results ordered by
+          relevance, only fetching as many as needed for ``limit``
 
         :param avalon.web.request.Parameters params: Request parameters
             to filter artists by or None
         :return: All albums that match the given parameters
-        :rtype: frozenset
+        :rtype: frozenset or list
         """
         if params is None or params.get('query') is None:
             return self._artists.get_all()
-        return self._search.search_artists(params.get('query'))
+        fuzzy = get_fuzzy(params)
+        with avalon.metrics.span('search'):
+            if is_ranked(params):
+                return take_ranked(
+                    self._search.search_artists_ranked(params.get('query'), fuzzy=fuzzy), params)
+            return self._search.search_artists(params.get('query'), fuzzy=fuzzy)
 
     def get_genres(self, params=None):
         """Return genre results based on the given query string
@@ -135,15 +299,23 @@ class AvalonMetadataService(object):
         Supported parameters are:
 
         * ``query`` -- Search term
+        * ``fuzzy`` -- Maximum number of typos to allow in the search term
+        * ``order`` -- ``relevance`` to get the search results ordered by
+          relevance, only fetching as many as needed for ``limit``
 
         :param avalon.web.request.Parameters params: Request parameters
             to filter genres by or None
         :return: All genres that match the given parameters
-        :rtype: frozenset
+        :rtype: frozenset or list
         """
         if params is None or params.get('query') is None:
             return self._genres.get_all()
-        return self._search.search_genres(params.get('query'))
+        fuzzy = get_fuzzy(params)
+        with avalon.metrics.span('search'):
+            if is_ranked(params):
+                return take_ranked(
+                    self._search.search_genres_ranked(params.get('query'), fuzzy=fuzzy), params)
+            return self._search.search_genres(params.get('query'), fuzzy=fuzzy)
 
     def get_songs(self, params=None):
         """Return song results based on the given query string
@@ -152,55 +324,99 @@ class AvalonMetadataService(object):
         Supported parameters are:
 
         * ``query`` -- Search term
+        * ``fuzzy`` -- Maximum number of typos to allow in the search term
         * ``album`` -- Album name
         * ``artist`` -- Artist name
         * ``genre`` -- Genre name
-        * ``album_id`` -- Album UUID
-        * ``artist_id`` -- Artist UUID
-        * ``genre_id`` -- Genre UUID
+        * ``album_id`` -- Album UUID, may be given more than once
+        * ``artist_id`` -- Artist UUID, may be given more than once
+        * ``genre_id`` -- Genre UUID, may be given more than once
+        * ``order`` -- ``relevance`` to get the results of a search
+          ordered by relevance, only fetching as many as needed for ``limit``
 
         :param avalon.web.request.Parameters params: Request parameters
             to filter tracks by or None
         :return: All tracks that match the given parameters
-        :rtype: frozenset
+        :rtype: frozenset or list
         """
         if params is None:
             return self._tracks.get_all()
 
         sets = []
         query = params.get('query')
+        fuzzy = get_fuzzy(params)
         album = params.get('album')
         artist = params.get('artist')
         genre = params.get('genre')
-        album_id = params.get_uuid('album_id')
-        artist_id = params.get_uuid('artist_id')
-        genre_id = params.get_uuid('genre_id')
-
-        if query is not None:
-            sets.append(
-                self._search.search_tracks(query))
-        if album is not None:
-            sets.append(
-                self._tracks.get_by_album(
-                    self._id_cache.get_album_id(album)))
-        if artist is not None:
-            sets.append(
-                self._tracks.get_by_artist(
-                    self._id_cache.get_artist_id(artist)))
-        if genre is not None:
-            sets.append(
-                self._tracks.get_by_genre(
-                    self._id_cache.get_genre_id(genre)))
-        if album_id is not None:
-            sets.append(self._tracks.get_by_album(album_id))
-        if artist_id is not None:
-            sets.append(self._tracks.get_by_artist(artist_id))
-        if genre_id is not None:
-            sets.append(self._tracks.get_by_genre(genre_id))
+        album_ids = params.get_uuid_list('album_id')
+        artist_ids = params.get_uuid_list('artist_id')
+        genre_ids = params.get_uuid_list('genre_id')
+
+        if query is not None and not is_ranked(params):
+            with avalon.metrics.span('search'):
+                sets.append(
+                    self._search.search_tracks(query, fuzzy=fuzzy))
+
+        with avalon.metrics.span('lookup'):
+            if album is not None:
+                sets.append(
+                    self._tracks.get_by_album(
+                        self._id_cache.get_album_id(album)))
+            if artist is not None:
+                sets.append(
+                    self._tracks.get_by_artist(
+                        self._id_cache.get_artist_id(artist)))
+            if genre is not None:
+                sets.append(
+                    self._tracks.get_by_genre(
+                        self._id_cache.get_genre_id(genre)))
+            # Songs matching any of the IDs given for a field
+            if album_ids:
+                sets.append(union([self._tracks.get_by_album(val) for val in set(album_ids)]))
+            if artist_ids:
+                sets.append(union([self._tracks.get_by_artist(val) for val in set(artist_ids)]))
+            if genre_ids:
+                sets.append(union([self._tracks.get_by_genre(val) for val in set(genre_ids)]))
+
+        allowed = None
+        if sets:
+            # Find the intersection of any non-None sets
+            with avalon.metrics.span('intersect'):
+                allowed = intersection(sets)
+
+        if query is not None and is_ranked(params):
+            # Only keep the most relevant search results that match
+            # all of the other criteria
+            with avalon.metrics.span('search'):
+                return take_ranked(
+                    self._search.search_tracks_ranked(query, fuzzy=fuzzy), params,
+                    allowed=allowed)
 
         if sets:
-            # Return the intersection of any non-None sets
-            return intersection(sets)
+            return allowed
 
         # There were no parameters to filter songs by any criteria
         return self._tracks.get_all()
+
+    def get_suggestions(self, params):
+        """Return the most relevant albums, artists, genres, and songs with
+        a name matching the search term for suggesting to users as they type.
+
+        Supported parameters are:
+
+        * ``query`` -- Search term
+        * ``limit`` -- Maximum number of suggestions of each type
+
+        :param avalon.web.request.Parameters params: Request parameters
+        :return: Dictionary of ``albums``, ``artists``, ``genres``, and
+            ``songs`` to suggestions of each, most relevant first
+        :rtype: dict
+        :raises avalon.exc.InvalidParameterValueError: If the limit is not
+            between one and the maximum number of suggestions allowed
+        """
+        limit = params.get_int('limit', DEFAULT_SUGGEST_LIMIT)
+        if limit < 1 or limit > MAX_SUGGEST_LIMIT:
+            raise avalon.exc.InvalidParameterValueError(
+                "The value of limit must be between 1 and {max}",
+                field='limit', value=limit, max=MAX_SUGGEST_LIMIT)
+        return self._search.suggest(params.get('query'), limit)
@@ -0,0 +1,431 @@
+# -*- coding: utf-8 -*-
+#
+# Avalon Music Server
+#
+# Copyright 2012-2015 TSH Labs <projects@tshlabs.org>
+#
+# Available under the MIT license. See LICENSE for details.
+#
+
+
+"""Support for splitting a music collection between multiple Avalon
+servers (shards) and combining the results of requests to each of them.
+
+Each shard has every album, artist, and genre but only the tracks with
+an ID that belongs to the shard. A coordinating server sends requests
+for tracks to every shard and merges the results, while requests for
+albums, artists, and genres only need to be sent to a single shard.
+"""
+
+from __future__ import absolute_import, unicode_literals
+import heapq
+import itertools
+import socket
+import threading
+import uuid
+from multiprocessing.pool import ThreadPool
+
+import os
+import simplejson
+from avalon.packages import six
+from avalon.packages.six.moves.urllib.error import HTTPError
+from avalon.packages.six.moves.urllib.parse import urlencode
+from avalon.packages.six.moves.urllib.request import urlopen
+
+import avalon.compat
+import avalon.elms
+import avalon.exc
+import avalon.log
+import avalon.web.search
+import avalon.web.services
+
+
+# Number of seconds to wait for a response from a shard by default
+DEFAULT_SHARD_TIMEOUT = 10
+
+# Number of threads to use for sending requests to each shard so that
+# multiple requests being handled at once don't wait on each other
+THREADS_PER_SHARD = 4
+
+# Errors that may be returned by a shard, indexed by their code
+_API_ERRORS = dict((cls.code, cls) for cls in (
+    avalon.exc.ServiceUnknownError,
+    avalon.exc.ServiceUnavailableError,
+    avalon.exc.ServiceMisconfiguredError,
+    avalon.exc.PermissionDeniedError,
+    avalon.exc.InvalidParameterNameError,
+    avalon.exc.InvalidParameterTypeError,
+    avalon.exc.InvalidParameterValueError))
+
+
+def get_shard(track_id, count):
+    """Get the index of the shard that a track belongs to.
+
+    :param uuid.UUID track_id: ID of the track
+    :param int count: Total number of shards
+    :return: Index of the shard for the track, from zero up to the count
+    :rtype: int
+    """
+    return track_id.int % count
+
+
+class ShardPartition(object):
+    """Callable that determines which tracks belong to a single shard."""
+
+    def __init__(self, index, count):
+        """Set the index of this shard and the total number of shards.
+
+        :param int index: Index of this shard, from zero up to the count
+        :param int count: Total number of shards
+        :raises ValueError: If the index is not valid for the number of shards
+        """
+        if count < 1 or index < 0 or index >= count:
+            raise ValueError(
+                "Invalid shard index {0} for {1} shards".format(index, count))
+        self.index = index
+        self.count = count
+
+    def __call__(self, elm):
+        """Return true if the given track element belongs to this shard.
+
+        :param avalon.elms.TrackElm elm: Track to check
+        :return: True if the track belongs to this shard, false otherwise
+        :rtype: bool
+        """
+        return get_shard(elm.id, self.count) == self.index
+
+
+class ShardClient(object):
+    """Client for making requests to the API of a single shard."""
+
+    def __init__(self, url, timeout=DEFAULT_SHARD_TIMEOUT, opener=None):
+        """Set the base URL of the shard, timeout for requests, and
+        optionally the function used to make requests (to allow for
+        easier unit testing).
+
+        :param unicode url: Base URL of the shard (including any request
+            path such as ``/avalon``)
+        :param float timeout: Number of seconds to wait for a response
+        :param callable opener: Callable that accepts a URL and timeout
+            and returns a file-like response (expected to behave like
+            :func:`urllib.request.urlopen`)
+        """
+        if opener is None:
+            opener = urlopen
+
+        self.url = url.rstrip('/')
+        self._timeout = timeout
+        self._opener = opener
+
+    def get(self, endpoint, args):
+        """Make a request to an endpoint of the shard and return the
+        results, raising the error returned by the shard if there was one.
+
+        :param unicode endpoint: Name of the endpoint (such as ``songs``)
+        :param dict args: Query string parameters for the request, the value
+            of parameters given more than once being a list of each value
+        :return: Decoded results of the request
+        :raises avalon.exc.ApiError: If the shard returned an error
+        :raises avalon.exc.ServiceUnavailableError: If the shard could not
+            be reached or did not return a valid response
+        """
+        pairs = []
+        for key, val in args.items():
+            # Fields with multiple values are repeated in the query string
+            for item in (val if isinstance(val, list) else [val]):
+                pairs.append((key, six.text_type(item).encode('utf-8')))
+        query = urlencode(sorted(pairs))
+        url = '{0}/{1}?{2}'.format(self.url, endpoint, query)
+
+        try:
+            res = self._opener(url, timeout=self._timeout)
+            body = res.read()
+        except HTTPError as e:
+            # Errors from the API are rendered as JSON like any other response
+            body = e.read()
+        except (EnvironmentError, socket.error) as e:
+            raise avalon.exc.ServiceUnavailableError(
+                "Shard at {url} is unavailable: {error}", url=self.url, error=str(e))
+
+        try:
+            payload = simplejson.loads(avalon.compat.to_text(body))
+        except ValueError:
+            raise avalon.exc.ServiceUnavailableError(
+                "Shard at {url} returned an invalid response", url=self.url)
+
+        if payload.get('errors'):
+            raise _new_api_error(payload['errors'][0])
+        return payload.get('success')
+
+
+def _new_api_error(err):
+    """Construct an API error equivalent to the one rendered by a shard."""
+    cls = _API_ERRORS.get(err.get('code'), avalon.exc.ServiceUnknownError)
+    # The message has already been formatted, make sure it stays the same
+    message = (err.get('message') or '').replace('{', '{{').replace('}', '}}')
+    return cls(message, **(err.get('payload') or {}))
+
+
+def _to_uuid(val):
+    """Convert a UUID rendered as a string back to a UUID."""
+    return uuid.UUID(avalon.compat.to_uuid_input(val))
+
+
+def _to_id_name_elm(res):
+    """Convert an album, artist, or genre result back to an element."""
+    return avalon.elms.IdNameElm(id=_to_uuid(res['id']), name=res['name'])
+
+
+def _to_track_elm(res):
+    """Convert a track result back to an element."""
+    fields = dict((field, res.get(field)) for field in avalon.elms.TrackElm._fields)
+    for field in ('id', 'album_id', 'artist_id', 'genre_id'):
+        fields[field] = _to_uuid(fields[field])
+    return avalon.elms.TrackElm(**fields)
+
+
+def _matches(text, term):
+    """Return true if any token of the text starts with the normalized term
+    (the same way a search trie matches it).
+    """
+    return any(token.startswith(term) for token in avalon.web.search.tokenize(text))
+
+
+def _get_rank_key(elm, term, position):
+    """Get a key for ordering a track returned by a shard for the normalized
+    search term the same way tracks are ranked by a single server.
+
+    Tracks with a name equal to the term come first, followed by tracks with
+    a name matching the term, followed by tracks with an album, artist, or
+    genre matching the term, each group ordered by name and ID. Tracks that
+    only match with typos or by each word in different fields can't be told
+    apart using the track alone so they're kept in the order of the shard
+    that returned them.
+    """
+    name = avalon.web.search.searchable(elm.name)
+    if name == term:
+        return 0, name, elm.id
+    if _matches(elm.name, term):
+        return 1, name, elm.id
+    if any(_matches(field, term) for field in (elm.album, elm.artist, elm.genre)):
+        return 2, name, elm.id
+    return 3, position, name, elm.id
+
+
+def _merge_ranked(results, query):
+    """Merge lists of tracks from each shard that are ordered by relevance
+    to the search query into a single list ordered by relevance.
+
+    :param list results: List of tracks from each shard, most relevant first
+    :param unicode query: Search query the tracks were ranked by
+    :return: Tracks from every shard, most relevant first
+    :rtype: list
+    """
+    term = avalon.web.search.searchable(query)
+    # Keys are decorated instead of using the key argument of heapq.merge
+    # which isn't supported by Python 2. The index of the shard ensures
+    # tracks themselves are never compared. Each shard's results are sorted
+    # by the key first since heapq.merge requires sorted input and shards
+    # only return a handful of results.
+    decorated = [
+        sorted((_get_rank_key(elm, term, position), i, elm)
+               for position, elm in enumerate(shard_res))
+        for i, shard_res in enumerate(results)]
+    return [elm for _, _, elm in heapq.merge(*decorated)]
+
+
+class ShardedMetadataServiceConfig(object):
+    """Configuration for the sharded metadata endpoints.
+
+    :ivar list shards: :class:`ShardClient` instances for each shard
+    :ivar callable pool_factory: Callable that accepts a number of
+        workers and returns a pool with a ``.map()`` method (expected
+        to behave like :class:`ThreadPool`)
+    """
+
+    def __init__(self):
+        self.shards = []
+        self.pool_factory = None
+
+
+class ShardedMetadataService(object):
+    """Methods for querying the metadata of a music collection split
+    between multiple shards, with the same interface as
+    :class:`avalon.web.services.AvalonMetadataService`.
+
+    Requests for songs are sent to every shard at the same time and the
+    results merged. When a ``limit`` is given, each shard only returns
+    as many songs as needed for the ``limit`` and ``offset`` of the
+    entire result set ordered by the requested field, since the results
+    that will be returned must be among the first of one of the shards.
+    They are sorted and limited by the regular filters afterwards.
+
+    Results ordered by ``relevance`` are merged by taking the most relevant
+    song from each shard, then the next most relevant, and so on.
+    """
+
+    _logger = avalon.log.get_error_log()
+
+    def __init__(self, config):
+        """Set the shards to send requests to and the factory for the pool
+        of threads for sending them.
+
+        The pool is created by the first request sent to every shard in
+        each process. Worker processes forked after the service is built
+        (such as by Gunicorn with ``preload_app``) would otherwise inherit
+        a pool without any threads.
+        """
+        pool_factory = config.pool_factory
+        if pool_factory is None:
+            pool_factory = ThreadPool
+
+        self._shards = list(config.shards)
+        self._pool_factory = pool_factory
+        self._lock = threading.Lock()
+        self._pool = None
+        self._pid = None
+
+    def reload(self):
+        """Do nothing since the shards load the music collection themselves.
+
+        :return: This object
+        :rtype: ShardedMetadataService
+        """
+        for shard in self._shards:
+            self._logger.info('Using shard at %s', shard.url)
+        return self
+
+    def _get_any(self, endpoint, args):
+        """Get results from the first shard that is available."""
+        err = None
+        for shard in self._shards:
+            try:
+                return shard.get(endpoint, args)
+            except avalon.exc.ServiceUnavailableError as e:
+                self._logger.warning('%s', e)
+                err = e
+        raise err
+
+    def _get_all(self, endpoint, args):
+        """Get results from every shard, raising an error if any of them
+        could not be reached since the results would be incomplete.
+        """
+        return self._get_pool().map(lambda shard: shard.get(endpoint, args), self._shards)
+
+    def _get_pool(self):
+        """Get the pool of threads for this process, creating it if this
+        process hasn't created one yet.
+        """
+        pid = os.getpid()
+        if self._pid != pid:
+            with self._lock:
+                if self._pid != pid:
+                    # The pool of the parent process (if there was one) is
+                    # not closed since its threads don't exist in this one
+                    self._pool = self._pool_factory(len(self._shards) * THREADS_PER_SHARD)
+                    self._pid = pid
+        return self._pool
+
+    def _get_id_name_elms(self, endpoint, params):
+        """Get albums, artists, or genres from any shard (since each of them
+        has all of these) and convert them back to elements.
+        """
+        return [_to_id_name_elm(res) for res in
+                self._get_any(endpoint, _get_paged_args(params))]
+
+    def get_albums(self, params=None):
+        """Return album results based on the given query string
+        parameters, all albums if there are no parameters.
+
+        :param avalon.web.request.Parameters params: Request parameters
+            to filter albums by or None
+        :return: All albums that match the given parameters
+        :rtype: list
+        """
+        return self._get_id_name_elms('albums', params)
+
+    def get_artists(self, params=None):
+        """Return artist results based on the given query string
+        parameters, all artists if there are no parameters.
+
+        :param avalon.web.request.Parameters params: Request parameters
+            to filter artists by or None
+        :return: All artists that match the given parameters
+        :rtype: list
+        """
+        return self._get_id_name_elms('artists', params)
+
+    def get_genres(self, params=None):
+        """Return genre results based on the given query string
+        parameters, all genres if there are no parameters.
+
+        :param avalon.web.request.Parameters params: Request parameters
+            to filter genres by or None
+        :return: All genres that match the given parameters
+        :rtype: list
+        """
+        return self._get_id_name_elms('genres', params)
+
+    def get_songs(self, params=None):
+        """Return song results from every shard based on the given query
+        string parameters, all songs if there are no parameters.
+
+        :param avalon.web.request.Parameters params: Request parameters
+            to filter tracks by or None
+        :return: All tracks that match the given parameters
+        :rtype: list
+        """
+        results = [[_to_track_elm(res) for res in shard_res]
+                   for shard_res in self._get_all('songs', _get_paged_args(params))]
+
+        if params is not None and avalon.web.services.is_ranked(params):
+            return _merge_ranked(results, params.get('query'))
+        return list(itertools.chain.from_iterable(results))
+
+    def get_suggestions(self, params):
+        """Return the most relevant albums, artists, genres, and songs with
+        a name matching the search term from every shard.
+
+        :param avalon.web.request.Parameters params: Request parameters
+        :return: Dictionary of ``albums``, ``artists``, ``genres``, and
+            ``songs`` to suggestions of each, most relevant first
+        :rtype: dict
+        """
+        limit = params.get_int('limit', avalon.web.services.DEFAULT_SUGGEST_LIMIT)
+        results = self._get_all('suggest', _get_args(params))
+        # Every shard has the same albums, artists, and genres
+        first = results[0]
+        songs = _merge_ranked(
+            [[_to_track_elm(res) for res in shard_res['songs']] for shard_res in results],
+            params.get('query'))
+
+        return {
+            'albums': tuple(_to_id_name_elm(res) for res in first['albums']),
+            'artists': tuple(_to_id_name_elm(res) for res in first['artists']),
+            'genres': tuple(_to_id_name_elm(res) for res in first['genres']),
+            'songs': tuple(songs[:limit]),
+        }
+
+
+def _get_args(params):
+    """Get a dictionary of the query string parameters to send to shards."""
+    if params is None:
+        return {}
+    return dict(params.items())
+
+
+def _get_paged_args(params):
+    """Get a dictionary of the query string parameters to send to shards
+    for results that will be sorted and limited again once they have been
+    returned.
+
+    The offset is applied after the results from each shard have been
+    combined so each shard is asked for enough results to satisfy both
+    the offset and the limit.
+    """
+    args = _get_args(params)
+    limit = None if params is None else avalon.web.services.get_ranked_limit(params)
+    if limit is not None:
+        args['limit'] = limit
+        args['offset'] = 0
+    return args
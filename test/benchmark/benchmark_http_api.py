@@ -0,0 +1,260 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Measure latency and throughput of the HTTP API using a generated music collection"""
+
+from __future__ import unicode_literals, print_function, division
+import argparse
+import codecs
+import collections
+import gc
+import json
+import random
+import shutil
+import sys
+import tempfile
+import timeit
+
+import os
+from avalon.packages.six.moves.urllib.parse import urlencode
+import avalon.app.bootstrap
+import avalon.util
+
+import generate_meta_data
+from benchmark_search_trie import get_name
+
+CONFIG_ENV_VAR = 'AVALON_BENCHMARK_CONFIG'
+
+# Relative weight of each kind of request in the replayed traffic, roughly
+# what a client browsing and searching a collection would send
+REQUEST_MIX = [
+    ('albums_all', 2),
+    ('albums_page', 4),
+    ('albums_search', 6),
+    ('artists_all', 2),
+    ('artists_search', 6),
+    ('genres_all', 2),
+    ('songs_by_album', 10),
+    ('songs_by_artist', 8),
+    ('songs_by_genre', 2),
+    ('songs_page', 6),
+    ('songs_search', 20),
+    ('songs_search_ranked', 12),
+]
+
+
+def get_opts(prog):
+    parser = argparse.ArgumentParser(
+        prog=prog,
+        description=__doc__)
+
+    parser.add_argument(
+        '-t',
+        '--tracks',
+        type=int,
+        default=10000,
+        help='Approximate number of tracks to generate (default: %(default)s)')
+
+    parser.add_argument(
+        '-r',
+        '--requests',
+        type=int,
+        default=5000,
+        help='Number of requests to replay (default: %(default)s)')
+
+    parser.add_argument(
+        '-w',
+        '--warmup',
+        type=int,
+        default=200,
+        help='Number of requests to make before measuring (default: %(default)s)')
+
+    parser.add_argument(
+        '-s',
+        '--seed',
+        type=int,
+        default=0,
+        help='Seed for the random number generator (default: %(default)s)')
+
+    parser.add_argument(
+        '-o',
+        '--output',
+        help='Path to write the JSON results to, in addition to printing them')
+
+    return parser.parse_args()
+
+
+def build_collection(rand, tracks, database):
+    # Use the same split of names between albums, artists, genres, and tracks
+    # as the generate_meta_data script so collections have a realistic shape
+    total = int(tracks / generate_meta_data.RATIO_TRACKS)
+    names = list(set(get_name(rand) for _ in range(total)))
+    rand.shuffle(names)
+
+    partitioner = generate_meta_data.Partitioner(names)
+    albums = partitioner.take(generate_meta_data.RATIO_ALBUMS * total)
+    artists = partitioner.take(generate_meta_data.RATIO_ARTISTS * total)
+    genres = partitioner.take(generate_meta_data.RATIO_GENRES * total)
+    songs = partitioner.take(generate_meta_data.RATIO_TRACKS * total)
+
+    builder = generate_meta_data.MetadataBuilder(songs, albums, artists, genres)
+    tags = builder.get_metadata()
+    generate_meta_data.insert_metadata('sqlite:///{0}'.format(database), tags)
+    return tags
+
+
+def write_config(path, database):
+    with codecs.open(path, 'w', encoding='utf-8') as handle:
+        handle.write('import logging\n')
+        handle.write('DATABASE_URL = {0!r}\n'.format('sqlite:///' + database))
+        handle.write('LOG_LEVEL = logging.WARNING\n')
+
+
+def get_search_term(rand, names):
+    word = rand.choice(rand.choice(names).split())
+    return word[:rand.randint(2, max(2, len(word)))]
+
+
+def get_requests(rand, tags, count):
+    names = {
+        'album': sorted(set(tag.album for tag in tags)),
+        'artist': sorted(set(tag.artist for tag in tags)),
+        'genre': sorted(set(tag.genre for tag in tags)),
+        'title': sorted(set(tag.title for tag in tags)),
+    }
+
+    kinds = [kind for kind, weight in REQUEST_MIX for _ in range(weight)]
+    out = []
+
+    for _ in range(count):
+        kind = rand.choice(kinds)
+        offset = rand.randint(0, 20) * 25
+
+        if kind == 'albums_all':
+            endpoint, args = 'albums', {'order': 'name'}
+        elif kind == 'albums_page':
+            endpoint, args = 'albums', {'order': 'name', 'limit': 25, 'offset': offset}
+        elif kind == 'albums_search':
+            endpoint, args = 'albums', {'query': get_search_term(rand, names['album'])}
+        elif kind == 'artists_all':
+            endpoint, args = 'artists', {'order': 'name'}
+        elif kind == 'artists_search':
+            endpoint, args = 'artists', {'query': get_search_term(rand, names['artist'])}
+        elif kind == 'genres_all':
+            endpoint, args = 'genres', {}
+        elif kind == 'songs_by_album':
+            endpoint, args = 'songs', {'album': rand.choice(names['album']), 'order': 'track'}
+        elif kind == 'songs_by_artist':
+            endpoint, args = 'songs', {
+                'artist': rand.choice(names['artist']), 'order': 'year', 'direction': 'desc'}
+        elif kind == 'songs_by_genre':
+            endpoint, args = 'songs', {
+                'genre': rand.choice(names['genre']), 'order': 'name', 'limit': 50}
+        elif kind == 'songs_page':
+            endpoint, args = 'songs', {'order': 'name', 'limit': 25, 'offset': offset}
+        elif kind == 'songs_search':
+            endpoint, args = 'songs', {
+                'query': get_search_term(rand, names['title']), 'order': 'name', 'limit': 50}
+        else:
+            endpoint, args = 'songs', {
+                'query': get_search_term(rand, names['title']), 'order': 'relevance', 'limit': 20}
+
+        query = urlencode(sorted((key, '{0}'.format(val).encode('utf-8')) for key, val in args.items()))
+        out.append((kind, '/avalon/{0}?{1}'.format(endpoint, query)))
+    return out
+
+
+def replay(client, requests):
+    timer = timeit.default_timer
+    latencies = collections.defaultdict(list)
+    errors = 0
+
+    for kind, url in requests:
+        start = timer()
+        res = client.get(url)
+        latencies[kind].append(timer() - start)
+        if res.status_code != 200:
+            errors += 1
+
+    return latencies, errors
+
+
+def percentile(values, pct):
+    # Nearest-rank percentile of the sorted values
+    rank = max(0, int(round(pct / 100 * len(values) + 0.5)) - 1)
+    return values[min(rank, len(values) - 1)]
+
+
+def summarize(latencies):
+    values = sorted(latencies)
+    return {
+        'count': len(values),
+        'p50_ms': round(percentile(values, 50) * 1000, 3),
+        'p95_ms': round(percentile(values, 95) * 1000, 3),
+        'p99_ms': round(percentile(values, 99) * 1000, 3),
+        'max_ms': round(values[-1] * 1000, 3),
+    }
+
+
+def main():
+    prog = os.path.basename(sys.argv[0])
+    args = get_opts(prog)
+    rand = random.Random(args.seed)
+    # The metadata builder uses the module level random functions
+    random.seed(args.seed)
+
+    work_dir = tempfile.mkdtemp(prefix='avalon-benchmark-')
+    database = os.path.join(work_dir, 'avalon.sqlite')
+    config = os.path.join(work_dir, 'config.py')
+
+    try:
+        start = timeit.default_timer()
+        tags = build_collection(rand, args.tracks, database)
+        generate_time = timeit.default_timer() - start
+        print('Generated {0} tracks in {1:.3f}s'.format(len(tags), generate_time), file=sys.stderr)
+
+        write_config(config, database)
+        os.environ[CONFIG_ENV_VAR] = config
+
+        start = timeit.default_timer()
+        app = avalon.app.bootstrap.bootstrap(CONFIG_ENV_VAR)
+        startup_time = timeit.default_timer() - start
+        print('Started application in {0:.3f}s'.format(startup_time), file=sys.stderr)
+
+        client = app.test_client()
+        replay(client, get_requests(rand, tags, args.warmup))
+
+        requests = get_requests(rand, tags, args.requests)
+        gc.collect()
+        start = timeit.default_timer()
+        latencies, errors = replay(client, requests)
+        elapsed = timeit.default_timer() - start
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    results = {
+        'tracks': len(tags),
+        'requests': len(requests),
+        'errors': errors,
+        'seed': args.seed,
+        'startup_s': round(startup_time, 3),
+        'elapsed_s': round(elapsed, 3),
+        'throughput_rps': round(len(requests) / elapsed, 1),
+        'peak_rss_mb': round(avalon.util.get_mem_usage(), 1),
+        'latency': summarize([val for vals in latencies.values() for val in vals]),
+        'latency_by_request': dict(
+            (kind, summarize(vals)) for kind, vals in sorted(latencies.items())),
+    }
+
+    rendered = json.dumps(results, indent=2, sort_keys=True)
+    print(rendered)
+
+    if args.output:
+        with codecs.open(args.output, 'w', encoding='utf-8') as handle:
+            handle.write(rendered + '\n')
+
+    return 0 if errors == 0 else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
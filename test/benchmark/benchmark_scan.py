@@ -0,0 +1,317 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Measure each stage of scanning a generated collection of MP3, FLAC, and Ogg files"""
+
+from __future__ import unicode_literals, print_function, division
+import argparse
+import codecs
+import contextlib
+import gc
+import json
+import random
+import shutil
+import struct
+import sys
+import tempfile
+import timeit
+
+import os
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+import mutagen
+import mutagen.ogg
+import avalon.app.bootstrap
+import avalon.app.factory
+import avalon.cli.scan
+import avalon.metrics
+import avalon.util
+
+from benchmark_search_trie import get_name
+
+SAMPLE_RATE = 44100
+
+# Stages of a scan in the order they run, as recorded by the scanner
+STAGES = [
+    'scan.walk',
+    'scan.read',
+    'scan.clean',
+    'scan.insert.fields',
+    'scan.reload_ids',
+    'scan.insert.tracks',
+    'scan.write',
+]
+
+
+def get_opts(prog):
+    parser = argparse.ArgumentParser(
+        prog=prog,
+        description=__doc__)
+
+    parser.add_argument(
+        '-f',
+        '--files',
+        type=int,
+        default=2000,
+        help='Number of audio files to generate (default: %(default)s)')
+
+    parser.add_argument(
+        '-d',
+        '--database-url',
+        action='append',
+        dest='database_urls',
+        metavar='URL',
+        help='Database URL to scan the collection into, may be given more '
+             'than once to compare databases such as a local PostgreSQL '
+             'server (default: a temporary SQLite database)')
+
+    parser.add_argument(
+        '-r',
+        '--runs',
+        type=int,
+        default=2,
+        help='Number of scans to run against each database, runs after the '
+             'first replace existing metadata (default: %(default)s)')
+
+    parser.add_argument(
+        '-m',
+        '--trace-memory',
+        action='store_true',
+        help='Record the peak memory allocated by each stage with tracemalloc, '
+             'which makes each stage much slower (Python 3.9 and above)')
+
+    parser.add_argument(
+        '-s',
+        '--seed',
+        type=int,
+        default=0,
+        help='Seed for the random number generator (default: %(default)s)')
+
+    parser.add_argument(
+        '-o',
+        '--output',
+        help='Path to write the JSON results to, in addition to printing them')
+
+    return parser.parse_args()
+
+
+def write_mp3(path, seconds):
+    # MPEG 1 layer 3 frames of silence, 128kbps at 44.1kHz. The length is
+    # not used since a realistic number of frames makes the files too big.
+    frame = b'\xff\xfb\x90\x64' + b'\x00' * 413
+    with open(path, 'wb') as handle:
+        handle.write(frame * 8)
+
+
+def write_flac(path, seconds):
+    # A FLAC stream with only a STREAMINFO block: 16 bit stereo with
+    # the number of samples for the given length and no audio frames
+    packed = (SAMPLE_RATE << 44) | (1 << 41) | (15 << 36) | (SAMPLE_RATE * seconds)
+    info = struct.pack('>HH', 4096, 4096) + b'\x00' * 6 + struct.pack('>Q', packed) + b'\x00' * 16
+    with open(path, 'wb') as handle:
+        handle.write(b'fLaC\x80' + struct.pack('>I', len(info))[1:] + info)
+
+
+def write_ogg(path, seconds):
+    # Ogg Vorbis identification, comment, and setup headers followed by
+    # a page with the position of the last sample for the given length
+    ident = b'\x01vorbis' + struct.pack('<IBIiii', 0, 2, SAMPLE_RATE, 0, 128000, 0) + b'\xb8\x01'
+    comment = b'\x03vorbis' + struct.pack('<I', 6) + b'avalon' + struct.pack('<I', 0) + b'\x01'
+    setup = b'\x05vorbis\x00'
+
+    pages = []
+    for i, (packets, position) in enumerate((
+            ([ident], 0), ([comment, setup], 0), ([b'\x00' * 16], SAMPLE_RATE * seconds))):
+        page = mutagen.ogg.OggPage()
+        page.packets = packets
+        page.serial = 1
+        page.sequence = i
+        page.position = position
+        pages.append(page)
+    pages[0].first = True
+    pages[-1].last = True
+
+    with open(path, 'wb') as handle:
+        for page in pages:
+            handle.write(page.write())
+
+
+WRITERS = {
+    'mp3': write_mp3,
+    'flac': write_flac,
+    'ogg': write_ogg,
+}
+
+
+def build_collection(rand, root, count):
+    # Shape the collection like a real one: a directory per artist and
+    # album with some albums in each of a few genres and formats
+    artists = [get_name(rand) for _ in range(max(1, count // 50))]
+    genres = [get_name(rand) for _ in range(max(1, count // 500))]
+    exts = sorted(WRITERS)
+    written = 0
+
+    while written < count:
+        artist = rand.choice(artists)
+        album = get_name(rand)
+        genre = rand.choice(genres)
+        year = rand.randint(1960, 2015)
+        ext = rand.choice(exts)
+
+        album_dir = os.path.join(root, artist, album)
+        if not os.path.isdir(album_dir):
+            os.makedirs(album_dir)
+
+        for track in range(1, min(rand.randint(6, 14), count - written) + 1):
+            path = os.path.join(album_dir, '{0:02d}.{1}'.format(track, ext))
+            WRITERS[ext](path, rand.randint(60, 480))
+
+            audio = mutagen.File(path, easy=True)
+            if audio.tags is None:
+                audio.add_tags()
+            audio['artist'] = artist
+            audio['album'] = album
+            audio['genre'] = genre
+            audio['title'] = get_name(rand)
+            audio['tracknumber'] = '{0}'.format(track)
+            audio['date'] = '{0}'.format(year)
+            audio.save()
+            written += 1
+
+    return written
+
+
+class StageRecorder(object):
+    """Stats client that records the time taken by each stage of a scan
+    along with the peak memory usage of the process once it finished and,
+    if tracing memory allocations, the peak memory allocated since the
+    previous stage finished.
+    """
+
+    def __init__(self, trace_memory):
+        self.stages = {}
+        self._trace_memory = trace_memory
+
+    def timing(self, key, ms):
+        allocated = None
+        if self._trace_memory:
+            allocated = tracemalloc.get_traced_memory()[1] / (1024.0 * 1024.0)
+            tracemalloc.reset_peak()
+        self.stages[key] = (ms, avalon.util.get_mem_usage(), allocated)
+
+    @contextlib.contextmanager
+    def timer(self, key):
+        start = timeit.default_timer()
+        yield
+        self.timing(key, (timeit.default_timer() - start) * 1000.0)
+
+
+def run_scan(url, root, trace_memory):
+    config = avalon.app.bootstrap.build_config()
+    config['DATABASE_URL'] = url
+
+    database = avalon.app.factory.new_db_engine(config)
+    database.connect()
+    try:
+        dao = avalon.app.factory.new_dao(database)
+        id_cache = avalon.app.factory.new_id_cache(dao)
+        scanner = avalon.cli.scan.AvalonCollectionScanner(database, id_cache)
+
+        recorder = StageRecorder(trace_memory)
+        avalon.metrics.bridge.client = recorder
+        gc.collect()
+        if trace_memory:
+            tracemalloc.start()
+        rss_before = avalon.util.get_mem_usage()
+        start = timeit.default_timer()
+
+        try:
+            scanner.scan_path(root)
+        finally:
+            avalon.metrics.bridge.client = None
+            if trace_memory:
+                tracemalloc.stop()
+        elapsed = timeit.default_timer() - start
+    finally:
+        database.dispose()
+
+    return recorder.stages, rss_before, elapsed
+
+
+def summarize(files, stages, rss_before, elapsed):
+    out = {
+        'elapsed_s': round(elapsed, 3),
+        'files_per_s': round(files / elapsed, 1),
+        'stages': {},
+    }
+
+    rss_prev = rss_before
+    for key in STAGES:
+        if key not in stages:
+            continue
+        ms, rss, allocated = stages[key]
+        if key == 'scan.write' and allocated is not None:
+            # Writes contain every stage from cleaning to inserting tracks
+            allocated = max(stages[k][2] for k in STAGES[2:-1] if k in stages)
+
+        out['stages'][key] = {
+            'elapsed_ms': round(ms, 1),
+            'files_per_s': round(files / (ms / 1000.0), 1) if ms else None,
+            'peak_rss_mb': round(rss, 1),
+            # Growth of the peak memory usage of the process during this
+            # stage, zero if it stayed under the peak of a previous stage
+            'peak_rss_growth_mb': round(rss - rss_prev, 1),
+        }
+        if allocated is not None:
+            out['stages'][key]['peak_allocated_mb'] = round(allocated, 1)
+        if key != 'scan.write':
+            rss_prev = rss
+    return out
+
+
+def main():
+    prog = os.path.basename(sys.argv[0])
+    args = get_opts(prog)
+    rand = random.Random(args.seed)
+
+    if args.trace_memory and not hasattr(tracemalloc, 'reset_peak'):
+        print('{0}: Tracing memory requires Python 3.9 or above'.format(prog), file=sys.stderr)
+        return 1
+
+    work_dir = tempfile.mkdtemp(prefix='avalon-benchmark-')
+    root = os.path.join(work_dir, 'music')
+    urls = args.database_urls or ['sqlite:///' + os.path.join(work_dir, 'avalon.sqlite')]
+    results = {'seed': args.seed, 'databases': {}}
+
+    try:
+        start = timeit.default_timer()
+        files = build_collection(rand, root, args.files)
+        print('Generated {0} files in {1:.3f}s'.format(
+            files, timeit.default_timer() - start), file=sys.stderr)
+        results['files'] = files
+
+        for url in urls:
+            runs = []
+            for i in range(args.runs):
+                stages, rss_before, elapsed = run_scan(url, root, args.trace_memory)
+                print('Scan {0} of {1}: {2:.3f}s'.format(i + 1, url, elapsed), file=sys.stderr)
+                runs.append(summarize(files, stages, rss_before, elapsed))
+            results['databases'][url] = runs
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    rendered = json.dumps(results, indent=2, sort_keys=True)
+    print(rendered)
+
+    if args.output:
+        with codecs.open(args.output, 'w', encoding='utf-8') as handle:
+            handle.write(rendered + '\n')
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
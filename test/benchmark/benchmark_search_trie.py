@@ -0,0 +1,138 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Measure insert and lookup throughput of the search trie using a generated music collection"""
+
+from __future__ import unicode_literals, print_function, division
+import argparse
+import gc
+import random
+import sys
+import timeit
+
+import os
+import avalon.web.search
+
+
+SYLLABLES = [
+    'ka', 'lo', 'mi', 'ra', 'ne', 'to', 'su', 'vi', 'da', 're', 'po', 'li',
+    'ga', 'mo', 'shi', 'ze', 'an', 'or', 'el', 'ü', 'é', 'ñ', 'ø', 'the']
+
+INDEX_TYPES = {
+    avalon.web.search.INDEX_TYPE_TRIE: (avalon.web.search.SearchTrie, avalon.web.search.TrieNode),
+    avalon.web.search.INDEX_TYPE_RADIX: (avalon.web.search.RadixTrie, avalon.web.search.RadixNode),
+}
+
+
+def get_opts(prog):
+    parser = argparse.ArgumentParser(
+        prog=prog,
+        description=__doc__)
+
+    parser.add_argument(
+        '-t',
+        '--tracks',
+        type=int,
+        default=10000,
+        help='Number of track names to generate and index (default: %(default)s)')
+
+    parser.add_argument(
+        '-q',
+        '--queries',
+        type=int,
+        default=100000,
+        help='Number of prefix lookups to perform (default: %(default)s)')
+
+    parser.add_argument(
+        '-s',
+        '--seed',
+        type=int,
+        default=0,
+        help='Seed for the random number generator (default: %(default)s)')
+
+    parser.add_argument(
+        '-i',
+        '--index',
+        choices=sorted(INDEX_TYPES),
+        default=avalon.web.search.INDEX_TYPE_RADIX,
+        help='Type of search index to benchmark (default: %(default)s)')
+
+    return parser.parse_args()
+
+
+def get_word(rand):
+    return ''.join(rand.choice(SYLLABLES) for _ in range(rand.randint(1, 4)))
+
+
+def get_name(rand):
+    return ' '.join(get_word(rand) for _ in range(rand.randint(1, 5))).title()
+
+
+def get_queries(rand, tokens, count):
+    out = []
+    for _ in range(count):
+        token = rand.choice(tokens)
+        out.append(token[:rand.randint(1, min(8, len(token)))])
+    return out
+
+
+def timed(func, *args):
+    # Don't charge collection of garbage from previous runs to this one
+    gc.collect()
+    start = timeit.default_timer()
+    result = func(*args)
+    return result, timeit.default_timer() - start
+
+
+def build_with_add(trie_cls, node_cls, pairs):
+    trie = trie_cls(node_cls)
+    for token, elm in pairs:
+        trie.add(token, elm)
+    return trie
+
+
+def build_with_add_sorted(trie_cls, node_cls, pairs):
+    trie = trie_cls(node_cls)
+    trie.add_sorted(pairs)
+    return trie
+
+
+def run_lookups(trie, queries):
+    found = 0
+    for query in queries:
+        found += len(trie.search(query))
+    return found
+
+
+def main():
+    prog = os.path.basename(sys.argv[0])
+    args = get_opts(prog)
+    rand = random.Random(args.seed)
+
+    names = [get_name(rand) for _ in range(args.tracks)]
+    pairs = sorted(
+        (token, i) for i, name in enumerate(names)
+        for token in avalon.web.search.tokenize(name))
+    tokens = [token for token, _ in pairs]
+    queries = get_queries(rand, tokens, args.queries)
+
+    trie_cls, node_cls = INDEX_TYPES[args.index]
+
+    print('Indexing {0} names under {1} tokens using a {2} index'.format(
+        len(names), len(pairs), args.index))
+
+    for label, builder in (('add', build_with_add), ('add_sorted', build_with_add_sorted)):
+        trie = None
+        trie, elapsed = timed(builder, trie_cls, node_cls, pairs)
+        print('Insert ({0}): {1:.3f}s, {2:.0f} tokens/s, {3} nodes'.format(
+            label, elapsed, len(pairs) / elapsed, len(trie)))
+
+    found, elapsed = timed(run_lookups, trie, queries)
+    print('Lookup: {0:.3f}s, {1:.0f} lookups/s, {2:.1f} results per lookup'.format(
+        elapsed, len(queries) / elapsed, found / len(queries)))
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -82,33 +82,9 @@ class MetadataBuilder(object):
             length=random.randint(10, 500))
 
 
-def main():
-    prog = os.path.basename(sys.argv[0])
-    args = get_opts(prog)
-
-    lines = []
-
-    try:
-        with codecs.open(args.word_list, encoding='utf-8') as handle:
-            for line in handle:
-                lines.append(line.strip())
-    except IOError as e:
-        print('{0}: Could not open word list: {1}'.format(prog, e), file=sys.stderr)
-        return 1
-
-    total_lines = len(lines)
-    random.shuffle(lines)
-    partitioner = Partitioner(lines)
-    albums = partitioner.take(RATIO_ALBUMS * total_lines)
-    artists = partitioner.take(RATIO_ARTISTS * total_lines)
-    genres = partitioner.take(RATIO_GENRES * total_lines)
-    tracks = partitioner.take(RATIO_TRACKS * total_lines)
-
-    builder = MetadataBuilder(tracks, albums, artists, genres)
-    tags = builder.get_metadata()
-
+def insert_metadata(url, tags):
     session_config = avalon.models.SessionHandlerConfig()
-    session_config.engine = avalon.models.get_engine('sqlite:///{0}'.format(args.database))
+    session_config.engine = avalon.models.get_engine(url)
     session_config.metadata = avalon.models.get_metadata()
     session_config.session_factory = avalon.models.get_session_factory()
 
@@ -134,6 +110,32 @@ def main():
         track_loader = avalon.tags.insert.TrackLoader(session, tags, id_cache)
         track_loader.insert(avalon.models.Track, avalon.ids.get_track_id)
 
+
+def main():
+    prog = os.path.basename(sys.argv[0])
+    args = get_opts(prog)
+
+    lines = []
+
+    try:
+        with codecs.open(args.word_list, encoding='utf-8') as handle:
+            for line in handle:
+                lines.append(line.strip())
+    except IOError as e:
+        print('{0}: Could not open word list: {1}'.format(prog, e), file=sys.stderr)
+        return 1
+
+    total_lines = len(lines)
+    random.shuffle(lines)
+    partitioner = Partitioner(lines)
+    albums = partitioner.take(RATIO_ALBUMS * total_lines)
+    artists = partitioner.take(RATIO_ARTISTS * total_lines)
+    genres = partitioner.take(RATIO_GENRES * total_lines)
+    tracks = partitioner.take(RATIO_TRACKS * total_lines)
+
+    builder = MetadataBuilder(tracks, albums, artists, genres)
+    insert_metadata('sqlite:///{0}'.format(args.database), builder.get_metadata())
+
     return 0
 
 
@@ -3,9 +3,14 @@
 
 from __future__ import absolute_import, unicode_literals
 
+import logging
+
+import mock
 import pytest
 from flask import Config
 import avalon.app.bootstrap
+import avalon.util
+import avalon.web.controller
 
 
 def test_build_config():
@@ -15,6 +20,23 @@ def test_build_config():
     assert 'avalon.error' == config['LOGGER_NAME'], "Did not get expected config value"
 
 
+def test_reload_controller_releases_slot(tmpdir):
+    """Ensure that the controller is reloaded while holding a slot for
+    loading and that the slot is released afterwards.
+    """
+    other = avalon.util.FileSemaphore(str(tmpdir), 'avalon-reload', 1)
+    controller = mock.Mock(spec=avalon.web.controller.AvalonController)
+    controller.reload.side_effect = lambda: acquired.append(other.acquire(blocking=False))
+    acquired = []
+
+    config = {'RELOAD_CONCURRENCY': 1, 'RELOAD_LOCK_DIR': str(tmpdir), 'RELOAD_JITTER': 0}
+    avalon.app.bootstrap._reload_controller(controller, config, logging.getLogger(__name__))
+
+    assert [False] == acquired
+    assert other.acquire(blocking=False)
+    other.release()
+
+
 class TestEndpointPathResolver(object):
     def test_call_base_not_start_with_slash(self):
         resolver = avalon.app.bootstrap._EndpointPathResolver("avalon")
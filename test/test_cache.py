@@ -22,6 +22,83 @@ def test_get_frozen_mapping():
         frozen['foo'].add('blah')
 
 
+class TestInternTable(object):
+    def test_intern_returns_first_instance(self):
+        """Test that equal values are replaced by the first instance seen."""
+        table = avalon.cache.InternTable()
+        first = uuid.UUID("2d24515c-a459-552a-b022-e85d1621425a")
+        second = uuid.UUID("2d24515c-a459-552a-b022-e85d1621425a")
+
+        assert first is table.intern(first)
+        assert first is table.intern(second)
+        assert 1 == len(table)
+        assert 1 == table.duplicates
+
+    def test_intern_none(self):
+        """Test that None values are not stored in the table."""
+        table = avalon.cache.InternTable()
+
+        assert None is table.intern(None)
+        assert 0 == len(table)
+
+    def test_clear(self):
+        """Test that clearing the table removes values and resets counts."""
+        table = avalon.cache.InternTable()
+        table.intern('Dookie')
+        table.intern(''.join(['Doo', 'kie']))
+        table.clear()
+
+        assert 0 == len(table)
+        assert 0 == table.duplicates
+        assert 0 == table.duplicate_bytes
+
+    def test_shared_between_stores(self):
+        """Test that stores sharing a table share equal UUIDs and names."""
+        album = avalon.models.Album()
+        album.id = uuid.UUID("350c49d9-fa38-585a-a0d9-7343c8b910ed")
+        album.name = 'Ruiner'
+
+        track_album = avalon.models.Album()
+        track_album.id = uuid.UUID("350c49d9-fa38-585a-a0d9-7343c8b910ed")
+        track_album.name = ''.join(['Rui', 'ner'])
+
+        artist = avalon.models.Artist()
+        artist.id = uuid.UUID("aa143f55-65e3-59f3-a1d8-36eac7024e86")
+        artist.name = 'A Wilhelm Scream'
+
+        genre = avalon.models.Genre()
+        genre.id = uuid.UUID("8794d7b7-fff3-50bb-b1f1-438659e05fe5")
+        genre.name = 'Punk'
+
+        song = avalon.models.Track()
+        song.id = uuid.UUID("ca2e8303-69d7-53ec-907e-2f111103ba29")
+        song.name = 'The Pool'
+        song.album_id = uuid.UUID("350c49d9-fa38-585a-a0d9-7343c8b910ed")
+        song.artist_id = artist.id
+        song.genre_id = genre.id
+        song.album = track_album
+        song.artist = artist
+        song.genre = genre
+
+        dao = mock.Mock(spec=avalon.models.ReadOnlyDao)
+        dao.get_all_albums.return_value = [album]
+        dao.get_all_artists.return_value = []
+        dao.get_all_genres.return_value = []
+        dao.get_all_tracks.return_value = [song]
+
+        table = avalon.cache.InternTable()
+        albums = avalon.cache.AlbumStore(dao, interner=table).reload()
+        tracks = avalon.cache.TrackStore(dao, interner=table).reload()
+        id_cache = avalon.cache.IdLookupCache(dao, interner=table).reload()
+
+        album_elm = list(albums.get_all())[0]
+        track_elm = list(tracks.get_all())[0]
+
+        assert album_elm.id is track_elm.album_id
+        assert album_elm.name is track_elm.album
+        assert album_elm.id is id_cache.get_album_id('ruiner')
+
+
 class TestIdLookupCache(object):
     def test_get_album_id_exists(self):
         """Test that we can translate an album name to ID"""
@@ -306,3 +383,128 @@ class TestTrackStore(object):
         cache = avalon.cache.TrackStore(dao).reload()
         songs = cache.get_by_id(uuid.UUID('72e2e340-fabc-4712-aa26-8a8f122999e8'))
         assert 0 == len(songs)
+
+
+class DummyPool(object):
+    def __init__(self, workers):
+        self.workers = workers
+
+    def map(self, func, iterable):
+        return [func(val) for val in iterable]
+
+    def close(self):
+        pass
+
+    def join(self):
+        pass
+
+
+class TestCollectionLoader(object):
+    def test_load_reads_each_table_once(self):
+        """Test that each table is read once and converted to elements."""
+        album = avalon.models.Album()
+        album.id = uuid.UUID("350c49d9-fa38-585a-a0d9-7343c8b910ed")
+        album.name = 'Ruiner'
+
+        artist = avalon.models.Artist()
+        artist.id = uuid.UUID("aa143f55-65e3-59f3-a1d8-36eac7024e86")
+        artist.name = 'A Wilhelm Scream'
+
+        genre = avalon.models.Genre()
+        genre.id = uuid.UUID("8794d7b7-fff3-50bb-b1f1-438659e05fe5")
+        genre.name = 'Punk'
+
+        song = avalon.models.Track()
+        song.id = uuid.UUID("ca2e8303-69d7-53ec-907e-2f111103ba29")
+        song.name = 'The Pool'
+        song.album_id = album.id
+        song.artist_id = artist.id
+        song.genre_id = genre.id
+        song.album = album
+        song.artist = artist
+        song.genre = genre
+
+        dao = mock.Mock(spec=avalon.models.ReadOnlyDao)
+        dao.get_all_albums.return_value = [album]
+        dao.get_all_artists.return_value = [artist]
+        dao.get_all_genres.return_value = [genre]
+        dao.get_all_tracks.return_value = [song]
+
+        loader = avalon.cache.CollectionLoader(dao, pool_factory=DummyPool)
+        collection = loader.load()
+
+        assert 1 == dao.get_all_albums.call_count
+        assert 1 == dao.get_all_artists.call_count
+        assert 1 == dao.get_all_genres.call_count
+        assert 1 == dao.get_all_tracks.call_count
+
+        assert 'Ruiner' == collection.albums[0].name
+        assert 'A Wilhelm Scream' == collection.artists[0].name
+        assert 'Punk' == collection.genres[0].name
+        assert 'The Pool' == collection.tracks[0].name
+        assert 'Ruiner' == collection.tracks[0].album
+
+    def test_load_populates_stores(self):
+        """Test that stores and the ID cache can be populated from the
+        loaded collection without reading from the database again.
+        """
+        album = avalon.models.Album()
+        album.id = uuid.UUID("2d24515c-a459-552a-b022-e85d1621425a")
+        album.name = 'Dookie'
+
+        dao = mock.Mock(spec=avalon.models.ReadOnlyDao)
+        dao.get_all_albums.return_value = [album]
+        dao.get_all_artists.return_value = []
+        dao.get_all_genres.return_value = []
+        dao.get_all_tracks.return_value = []
+
+        collection = avalon.cache.CollectionLoader(dao, pool_factory=DummyPool).load()
+        albums = avalon.cache.AlbumStore(dao).load(collection.albums)
+        id_cache = avalon.cache.IdLookupCache(dao).load(
+            collection.albums, collection.artists, collection.genres)
+
+        assert 1 == dao.get_all_albums.call_count
+        assert 1 == len(albums.get_by_id(album.id))
+        assert album.id == id_cache.get_album_id('dookie')
+
+    def test_load_keeps_partition_of_tracks(self):
+        """Test that only tracks in the partition are kept when one is
+        given but that every album is kept.
+        """
+        album = avalon.models.Album()
+        album.id = uuid.UUID("350c49d9-fa38-585a-a0d9-7343c8b910ed")
+        album.name = 'Ruiner'
+
+        artist = avalon.models.Artist()
+        artist.id = uuid.UUID("aa143f55-65e3-59f3-a1d8-36eac7024e86")
+        artist.name = 'A Wilhelm Scream'
+
+        genre = avalon.models.Genre()
+        genre.id = uuid.UUID("8794d7b7-fff3-50bb-b1f1-438659e05fe5")
+        genre.name = 'Punk'
+
+        songs = []
+        for name, track_id in (('The Pool', "ca2e8303-69d7-53ec-907e-2f111103ba29"),
+                               ('Mute Print', "5ba7e9b8-7ab1-5b29-8e1a-9a6c12f8e2ac")):
+            song = avalon.models.Track()
+            song.id = uuid.UUID(track_id)
+            song.name = name
+            song.album_id = album.id
+            song.artist_id = artist.id
+            song.genre_id = genre.id
+            song.album = album
+            song.artist = artist
+            song.genre = genre
+            songs.append(song)
+
+        dao = mock.Mock(spec=avalon.models.ReadOnlyDao)
+        dao.get_all_albums.return_value = [album]
+        dao.get_all_artists.return_value = []
+        dao.get_all_genres.return_value = []
+        dao.get_all_tracks.return_value = songs
+
+        collection = avalon.cache.CollectionLoader(
+            dao, pool_factory=DummyPool, partition=lambda elm: elm.name == 'Mute Print').load()
+
+        assert 1 == len(collection.albums)
+        assert ['Mute Print'] == [elm.name for elm in collection.tracks]
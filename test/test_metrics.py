@@ -2,6 +2,9 @@
 #
 
 from __future__ import absolute_import, unicode_literals
+import gc
+import socket
+
 import mock
 
 import pytest
@@ -53,3 +56,295 @@ def test_timed_client_called(monkeypatch, client):
 
     assert 579 == res, "Did not get expected output from wrapped method"
     client.timer.assert_called_with('some.method')
+
+
+def test_timing_no_client(monkeypatch):
+    """Test that the block is executed even with no client configured."""
+    monkeypatch.setattr(avalon.metrics.bridge, 'client', None)
+    executed = []
+
+    with avalon.metrics.timing('some.block'):
+        executed.append(True)
+
+    assert [True] == executed
+
+
+def test_timing_client_called(monkeypatch, client):
+    """Test that the block is timed when there is a client configured."""
+    monkeypatch.setattr(avalon.metrics.bridge, 'client', client)
+
+    with avalon.metrics.timing('some.block') as elapsed:
+        pass
+
+    assert elapsed.ms is not None
+    client.timing.assert_called_with('some.block', elapsed.ms)
+
+
+def test_timing_profiler_called(monkeypatch):
+    """Test that the block is profiled when there is a profiler installed."""
+    profiler = mock.Mock(spec=avalon.metrics.PhaseProfiler)
+    profiler.enter.return_value = 'state'
+    monkeypatch.setattr(avalon.metrics.bridge, 'profiler', profiler)
+
+    with avalon.metrics.timing('some.block') as elapsed:
+        pass
+
+    profiler.exit.assert_called_with('some.block', 'state', elapsed.ms)
+
+
+class TestPhaseProfiler(object):
+    def test_get_phases_start_order(self, monkeypatch):
+        """Test that phases are returned in the order they started, even
+        when nested phases finish first.
+        """
+        profiler = avalon.metrics.PhaseProfiler(trace_memory=False)
+        monkeypatch.setattr(avalon.metrics.bridge, 'profiler', profiler)
+
+        with avalon.metrics.timing('outer'):
+            with avalon.metrics.timing('inner'):
+                pass
+
+        phases = profiler.get_phases()
+        assert ['outer', 'inner'] == [phase['name'] for phase in phases]
+        assert set(['name', 'wall_ms', 'cpu_ms', 'objects']) == set(phases[0])
+
+    def test_get_phases_count_objects(self):
+        """Test that objects created during a phase are counted."""
+        profiler = avalon.metrics.PhaseProfiler(trace_memory=False)
+        keep = []
+
+        # Make sure unrelated garbage isn't collected during the phase
+        gc.collect()
+        gc.disable()
+        try:
+            state = profiler.enter()
+            keep.extend([] for _ in range(1000))
+            profiler.exit('phase', state, 1.0)
+        finally:
+            gc.enable()
+
+        assert profiler.get_phases()[0]['objects'] >= 1000
+
+    def test_get_phases_no_optional_values(self):
+        """Test that memory and objects are not included when disabled."""
+        profiler = avalon.metrics.PhaseProfiler(trace_memory=False, count_objects=False)
+        profiler.exit('phase', profiler.enter(), 1.0)
+
+        assert {'name': 'phase', 'wall_ms': 1.0} == dict(
+            (key, val) for key, val in profiler.get_phases()[0].items() if key != 'cpu_ms')
+
+    def test_send_gauges(self, client):
+        """Test that each value of each phase is sent as a gauge."""
+        profiler = avalon.metrics.PhaseProfiler(trace_memory=False, count_objects=False)
+        profiler.exit('reload.total', profiler.enter(), 12.5)
+        profiler.send_gauges(client, 'startup')
+
+        client.gauge.assert_any_call('startup.reload.total.wall_ms', 12.5)
+        assert 2 == client.gauge.call_count
+
+
+def test_span_nested_key(monkeypatch, client):
+    """Test that spans are recorded under the key of the block they are in."""
+    monkeypatch.setattr(avalon.metrics.bridge, 'client', client)
+
+    @avalon.metrics.timed('request.songs')
+    def get_songs():
+        with avalon.metrics.span('search'):
+            with avalon.metrics.span('expand'):
+                pass
+
+    get_songs()
+
+    keys = [call[0][0] for call in client.timing.call_args_list]
+    assert ['request.songs.search.expand', 'request.songs.search'] == keys
+
+
+def test_span_no_parent(monkeypatch, client):
+    """Test that spans outside of a timed block use only their name."""
+    monkeypatch.setattr(avalon.metrics.bridge, 'client', client)
+
+    with avalon.metrics.span('search'):
+        pass
+
+    assert 'search' == client.timing.call_args[0][0]
+
+
+def test_count_nested_key(monkeypatch, client):
+    """Test that counts are recorded under the key of the block they are
+    in, to both the client and histograms.
+    """
+    histograms = avalon.metrics.HistogramRegistry()
+    monkeypatch.setattr(avalon.metrics.bridge, 'client', client)
+    monkeypatch.setattr(avalon.metrics.bridge, 'histograms', histograms)
+
+    with avalon.metrics.timing('request.albums'):
+        avalon.metrics.count('results', 42)
+
+    client.incr.assert_called_with('request.albums.results', 42)
+    summary = histograms.get_summary()
+    assert 42 == summary['request.albums.results']['max']
+    assert 1 == summary['request.albums']['count']
+
+
+def test_timed_histograms_no_client(monkeypatch):
+    """Test that timed methods are recorded to histograms without a client."""
+    histograms = avalon.metrics.HistogramRegistry()
+    monkeypatch.setattr(avalon.metrics.bridge, 'client', None)
+    monkeypatch.setattr(avalon.metrics.bridge, 'histograms', histograms)
+
+    @avalon.metrics.timed('some.method')
+    def some_method():
+        return 123
+
+    assert 123 == some_method()
+    assert 1 == histograms.get_summary()['some.method']['count']
+
+
+class TestHistogram(object):
+    def test_get_percentiles_empty(self):
+        """Test that percentiles of an empty histogram are None."""
+        histogram = avalon.metrics.Histogram()
+        assert [None, None] == histogram.get_percentiles([50, 99])
+
+    def test_get_percentiles_relative_error(self):
+        """Test that percentiles are within the relative error of the buckets."""
+        histogram = avalon.metrics.Histogram()
+        for i in range(1, 10001):
+            histogram.record(i / 10.0)
+
+        p50, p90, p99 = histogram.get_percentiles([50, 90, 99])
+        assert 500.0 <= p50 <= 500.0 * 1.04
+        assert 900.0 <= p90 <= 900.0 * 1.04
+        assert 990.0 <= p99 <= 990.0 * 1.04
+
+    def test_get_percentiles_capped_by_max(self):
+        """Test that percentiles are never larger than the largest value."""
+        histogram = avalon.metrics.Histogram()
+        histogram.record(5)
+        assert [5] == histogram.get_percentiles([100])
+
+    def test_get_percentiles_zero(self):
+        """Test that zero values are counted below every other value."""
+        histogram = avalon.metrics.Histogram()
+        histogram.record(0)
+        histogram.record(0)
+        histogram.record(100)
+
+        assert [0, 100] == histogram.get_percentiles([50, 100])
+
+    def test_get_summary(self):
+        """Test the count, total, and extremes of the summary."""
+        histogram = avalon.metrics.Histogram()
+        for val in (3, 1, 2):
+            histogram.record(val)
+
+        summary = histogram.get_summary()
+        assert 3 == summary['count']
+        assert 6 == summary['total']
+        assert 1 == summary['min']
+        assert 3 == summary['max']
+
+
+class LocalStatsd(object):
+    """Local UDP stand-in for a Statsd server that keeps each packet received."""
+
+    def __init__(self):
+        self._sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._sock.bind(('127.0.0.1', 0))
+        self._sock.settimeout(5)
+        self.port = self._sock.getsockname()[1]
+
+    def receive(self):
+        return self._sock.recvfrom(65535)[0]
+
+    def close(self):
+        self._sock.close()
+
+
+@pytest.fixture
+def local_statsd():
+    server = LocalStatsd()
+    yield server
+    server.close()
+
+
+def _new_batching_client(local_statsd, **kwargs):
+    # Use a long interval so that only explicit flushes send metrics
+    kwargs.setdefault('interval', 60)
+    return avalon.metrics.BatchingStatsClient(
+        host='127.0.0.1', port=local_statsd.port, prefix='avalon', **kwargs)
+
+
+class TestBatchingStatsClient(object):
+    def test_flush_aggregates_counters_and_gauges(self, local_statsd):
+        """Test that counters are summed and only the last gauge value sent."""
+        client = _new_batching_client(local_statsd)
+        client.incr('request.songs.results', 3)
+        client.incr('request.songs.results', 4)
+        client.decr('errors')
+        client.gauge('tracks', 10)
+        client.gauge('tracks', 12)
+        client.flush()
+
+        expected = b'avalon.errors:-1|c\navalon.request.songs.results:7|c\navalon.tracks:12|g'
+        assert expected == local_statsd.receive()
+        client.close()
+
+    def test_flush_negative_gauge(self, local_statsd):
+        """Test that negative gauges are reset first so they aren't treated as a change."""
+        client = _new_batching_client(local_statsd)
+        client.gauge('allocated', -2)
+        client.gauge('objects', 5, delta=True)
+        client.flush()
+
+        assert b'avalon.allocated:0|g\navalon.allocated:-2|g\navalon.objects:+5|g' == \
+            local_statsd.receive()
+        client.close()
+
+    def test_flush_timings_sampled(self, local_statsd):
+        """Test that at most the maximum number of timings are sent, with a sample rate."""
+        client = _new_batching_client(local_statsd, max_timings=2)
+        for ms in (1, 2, 3, 4):
+            client.timing('request.songs', ms)
+        client.flush()
+
+        lines = local_statsd.receive().split(b'\n')
+        assert 2 == len(lines)
+        assert all(line.endswith(b'|ms|@0.500000') for line in lines)
+        client.close()
+
+    def test_flush_packet_size(self, local_statsd):
+        """Test that metrics are split between packets of the maximum size."""
+        client = _new_batching_client(local_statsd, packet_size=64)
+        for i in range(10):
+            client.incr('request.counter{0}'.format(i))
+        client.flush()
+
+        received = []
+        while len(received) < 10:
+            packet = local_statsd.receive()
+            assert len(packet) <= 64
+            received.extend(packet.split(b'\n'))
+
+        assert b'avalon.request.counter0:1|c' == received[0]
+        assert b'avalon.request.counter9:1|c' == received[-1]
+        client.close()
+
+    def test_flush_nothing_recorded(self, local_statsd):
+        """Test that no packets are sent if there are no metrics."""
+        client = _new_batching_client(local_statsd)
+        client.flush()
+        client.incr('sent')
+        client.flush()
+
+        assert b'avalon.sent:1|c' == local_statsd.receive()
+        client.close()
+
+    def test_background_thread_sends(self, local_statsd):
+        """Test that metrics are sent by the background thread at the interval."""
+        client = _new_batching_client(local_statsd, interval=0.01)
+        with client.timer('request.albums'):
+            pass
+
+        assert local_statsd.receive().startswith(b'avalon.request.albums:')
+        client.close()
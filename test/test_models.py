@@ -2,6 +2,8 @@
 #
 
 from __future__ import absolute_import, unicode_literals
+import uuid
+
 import mock
 import pytest
 
@@ -33,3 +35,64 @@ def test_get_engine_success():
     create_engine = mock.Mock()
     engine = avalon.models.get_engine('sqlite:////dev/null', factory=create_engine)
     assert engine is not None, "Got unexpected 'None' engine"
+
+
+def test_get_engine_options():
+    """Make sure options are passed to the factory."""
+    create_engine = mock.Mock()
+    avalon.models.get_engine(
+        'postgresql://something/else', factory=create_engine,
+        options={'pool_size': 10, 'pool_pre_ping': True})
+    create_engine.assert_called_once_with(
+        'postgresql://something/else', pool_size=10, pool_pre_ping=True)
+
+
+def test_get_engine_unsupported_options():
+    """Make sure options not supported by the database are translated to connection errors."""
+    with pytest.raises(avalon.exc.ConnectionError):
+        avalon.models.get_engine('sqlite:////dev/null', options={'pool_size': 10})
+
+
+class TestReadOnlyDao(object):
+    def setup(self):
+        config = avalon.models.SessionHandlerConfig()
+        config.engine = avalon.models.get_engine('sqlite://')
+        config.session_factory = avalon.models.get_session_factory()
+        config.metadata = avalon.models.get_metadata()
+        self.handler = avalon.models.SessionHandler(config)
+        self.handler.connect()
+
+        with self.handler.scoped_session(read_only=False) as session:
+            for i in range(5):
+                album = avalon.models.Album()
+                album.id = uuid.uuid4()
+                album.name = 'Album {0}'.format(i)
+                session.add(album)
+
+    def test_get_all_streams_in_batches(self):
+        """Make sure all models are yielded in batches and the session is
+        only closed once they all have been.
+        """
+        closed = []
+        close = self.handler.close
+        self.handler.close = lambda session: closed.append(close(session))
+
+        dao = avalon.models.ReadOnlyDao(self.handler)
+        dao.read_batch_size = 2
+        albums = dao.get_all_albums()
+
+        first = next(albums)
+        assert [] == closed
+        rest = list(albums)
+
+        assert 1 == len(closed)
+        assert 5 == len(set([first.name] + [album.name for album in rest]))
+
+    def test_get_all_existing_session(self):
+        """Make sure an existing session is used and not closed."""
+        dao = avalon.models.ReadOnlyDao(self.handler)
+
+        with self.handler.scoped_session() as session:
+            albums = list(dao.get_all_albums(session=session))
+            assert 5 == len(albums)
+            assert session.is_active
@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+#
+
+from __future__ import absolute_import, unicode_literals
+import collections
+import threading
+
+import mock
+
+import avalon.profiling
+
+
+def _frame(filename, name, back=None):
+    frame = mock.Mock()
+    frame.f_code.co_filename = filename
+    frame.f_code.co_name = name
+    frame.f_back = back
+    return frame
+
+
+def _thread(ident, name):
+    thread = mock.Mock()
+    thread.ident = ident
+    thread.name = name
+    return thread
+
+
+class TestSamplingProfiler(object):
+    def test_sample_outermost_frame_first(self):
+        """Test that stacks start with the thread name and end with the
+        innermost frame.
+        """
+        outer = _frame('server.py', 'serve')
+        inner = _frame('search.py', 'search', back=outer)
+        profiler = avalon.profiling.SamplingProfiler(
+            frames_impl=lambda: {1: inner},
+            threads_impl=lambda: [_thread(1, 'worker')])
+
+        counts = collections.Counter()
+        profiler.sample(counts)
+
+        assert {('worker', 'server.py:serve', 'search.py:search'): 1} == counts
+
+    def test_sample_skips_current_thread(self):
+        """Test that the thread recording the profile is not included."""
+        current = threading.current_thread().ident
+        profiler = avalon.profiling.SamplingProfiler(
+            frames_impl=lambda: {current: _frame('profiling.py', 'sample')},
+            threads_impl=lambda: [])
+
+        counts = collections.Counter()
+        profiler.sample(counts)
+
+        assert 0 == len(counts)
+
+    def test_sample_escapes_separators(self):
+        """Test that semicolons and spaces in names don't break the format."""
+        profiler = avalon.profiling.SamplingProfiler(
+            frames_impl=lambda: {1: _frame('my dir/a;b.py', '<module>')},
+            threads_impl=lambda: [_thread(1, 'Dummy 1')])
+
+        counts = collections.Counter()
+        profiler.sample(counts)
+
+        assert [('Dummy_1', 'my_dir/a:b.py:<module>')] == list(counts)
+
+    def test_profile_samples_until_done(self):
+        """Test that stacks are sampled repeatedly until time is up."""
+        sleeps = []
+        profiler = avalon.profiling.SamplingProfiler(
+            interval=0.001, frames_impl=lambda: {1: _frame('a.py', 'run')},
+            threads_impl=lambda: [_thread(1, 'worker')], sleep_impl=sleeps.append)
+
+        with mock.patch('avalon.profiling.default_timer', side_effect=[0.0, 0.001, 0.002, 0.003]):
+            counts = profiler.profile(0.003)
+
+        assert 3 == counts[('worker', 'a.py:run')]
+        assert [0.001, 0.001] == sleeps
+
+
+def test_to_collapsed():
+    """Test that stacks are rendered most frequent first."""
+    counts = collections.Counter({('main', 'a.py:run'): 2, ('main', 'a.py:run', 'b.py:wait'): 5})
+    assert 'main;a.py:run;b.py:wait 5\nmain;a.py:run 2\n' == avalon.profiling.to_collapsed(counts)
@@ -0,0 +1,260 @@
+# -*- coding: utf-8 -*-
+#
+
+from __future__ import absolute_import, unicode_literals
+import subprocess
+
+import mock
+import os
+import pytest
+import simplejson
+import avalon.app.factory
+import avalon.prometheus
+
+
+@pytest.fixture
+def path(tmpdir):
+    return str(tmpdir)
+
+
+@pytest.fixture
+def exited_pid():
+    proc = subprocess.Popen(['true'])
+    proc.wait()
+    return proc.pid
+
+
+def _write_snapshot(path, pid, counters=None, gauges=None, histograms=None,
+                    buckets=avalon.prometheus.DEFAULT_BUCKETS):
+    snapshot = {
+        'pid': pid,
+        'buckets': list(buckets),
+        'counters': counters or {},
+        'gauges': gauges or {},
+        'histograms': histograms or {},
+    }
+    with open(os.path.join(path, 'metrics.{0}.json'.format(pid)), 'w') as handle:
+        simplejson.dump(snapshot, handle)
+
+
+def _read_aggregate(path):
+    with open(os.path.join(path, 'metrics.aggregate.json')) as handle:
+        return simplejson.load(handle)
+
+
+def _list_metrics(path):
+    return sorted(name for name in os.listdir(path) if name != 'metrics.lock')
+
+
+def _new_client(path):
+    # Use a long interval so that only explicit writes happen
+    return avalon.prometheus.PrometheusStatsClient(path, buckets=(0.01, 0.1), interval=60)
+
+
+class TestPrometheusStatsClient(object):
+    def test_render_own_metrics(self, path):
+        """Test that counters, gauges, and histograms are rendered in the text format."""
+        client = _new_client(path)
+        client.incr('request.songs.results', 3)
+        client.incr('request.songs.results', 2)
+        client.decr('request.songs.results')
+        client.gauge('store.tracks', 10)
+        client.gauge('store.tracks', 5, delta=True)
+        client.timing('request.songs', 5)
+        client.timing('request.songs', 50)
+        client.timing('request.songs', 500)
+
+        lines = client.render().splitlines()
+        pid = os.getpid()
+
+        assert '# TYPE avalon_request_songs_results_total counter' in lines
+        assert 'avalon_request_songs_results_total 4' in lines
+        assert '# TYPE avalon_store_tracks gauge' in lines
+        assert 'avalon_store_tracks{{pid="{0}"}} 15'.format(pid) in lines
+        assert '# TYPE avalon_request_songs_seconds histogram' in lines
+        assert 'avalon_request_songs_seconds_bucket{le="0.01"} 1' in lines
+        assert 'avalon_request_songs_seconds_bucket{le="0.1"} 2' in lines
+        assert 'avalon_request_songs_seconds_bucket{le="+Inf"} 3' in lines
+        assert 'avalon_request_songs_seconds_sum 0.555' in lines
+        assert 'avalon_request_songs_seconds_count 3' in lines
+        client.close()
+
+    def test_collect_other_processes(self, path, exited_pid):
+        """Test that counters and histograms of every process are summed and
+        only gauges of running processes are kept.
+        """
+        running_pid = os.getppid()
+        _write_snapshot(
+            path, running_pid, counters={'errors': 2}, gauges={'store.tracks': 7},
+            histograms={'request.songs': {'buckets': [1, 0, 0], 'sum': 0.005, 'count': 1}},
+            buckets=(0.01, 0.1))
+        _write_snapshot(
+            path, exited_pid, counters={'errors': 3}, gauges={'store.tracks': 7},
+            histograms={'request.songs': {'buckets': [0, 1, 0], 'sum': 0.05, 'count': 1}},
+            buckets=(0.01, 0.1))
+
+        client = _new_client(path)
+        client.incr('errors')
+        client.timing('request.songs', 500)
+        metrics = client.collect()
+
+        assert 6 == metrics['counters']['errors']
+        assert {'buckets': [1, 1, 1], 'sum': 0.555, 'count': 3} == metrics['histograms']['request.songs']
+        assert {running_pid, os.getpid()} == set(metrics['gauges'])
+        assert 7 == metrics['gauges'][running_pid]['store.tracks']
+        client.close()
+
+    def test_collect_exited_processes_once(self, path, exited_pid):
+        """Test that the files of exited processes are added to the totals
+        of exited processes and removed so they're only counted once.
+        """
+        _write_snapshot(
+            path, exited_pid, counters={'errors': 3}, gauges={'store.tracks': 7},
+            histograms={'request.songs': {'buckets': [0, 1, 0], 'sum': 0.05, 'count': 1}},
+            buckets=(0.01, 0.1))
+
+        client = _new_client(path)
+        client.incr('errors')
+
+        assert 4 == client.collect()['counters']['errors']
+        assert ['metrics.aggregate.json'] == _list_metrics(path)
+        assert {'errors': 3} == _read_aggregate(path)['counters']
+
+        metrics = client.collect()
+        assert 4 == metrics['counters']['errors']
+        assert 1 == metrics['histograms']['request.songs']['count']
+        assert [os.getpid()] == list(metrics['gauges'])
+        client.close()
+
+    def test_collect_different_buckets(self, path):
+        """Test that histograms written with different buckets are skipped."""
+        _write_snapshot(
+            path, os.getppid(), counters={'errors': 1},
+            histograms={'request.songs': {'buckets': [1, 0, 0, 0], 'sum': 0.005, 'count': 1}},
+            buckets=(0.01, 0.1, 1.0))
+
+        client = _new_client(path)
+        metrics = client.collect()
+
+        assert 1 == metrics['counters']['errors']
+        assert {} == metrics['histograms']
+        client.close()
+
+    def test_collect_invalid_file(self, path):
+        """Test that files that can't be read are skipped."""
+        with open(os.path.join(path, 'metrics.{0}.json'.format(os.getppid())), 'w') as handle:
+            handle.write('{"pid": ')
+
+        client = _new_client(path)
+        client.incr('errors')
+
+        assert {'errors': 1} == client.collect()['counters']
+        client.close()
+
+    def test_write(self, path):
+        """Test that the metrics of this process are written to its own file."""
+        client = _new_client(path)
+        client.incr('errors')
+        client.write()
+
+        with open(os.path.join(path, 'metrics.{0}.json'.format(os.getpid()))) as handle:
+            snapshot = simplejson.load(handle)
+
+        assert {'errors': 1} == snapshot['counters']
+        assert snapshot['gauges']['process.resident_memory_bytes'] > 0
+        assert ['metrics.{0}.json'.format(os.getpid())] == os.listdir(path)
+        client.close()
+
+    def test_close(self, path):
+        """Test that closing the client moves its counters and histograms into
+        the totals of exited processes, only once if closed more than once.
+        """
+        client = _new_client(path)
+        client.incr('errors')
+        client.timing('request.songs', 5)
+        client.write()
+        client.close()
+        client.close()
+
+        aggregate = _read_aggregate(path)
+        assert ['metrics.aggregate.json'] == _list_metrics(path)
+        assert {'errors': 1} == aggregate['counters']
+        assert 1 == aggregate['histograms']['request.songs']['count']
+
+    @pytest.mark.skipif(not hasattr(os, 'fork'), reason='Requires fork')
+    def test_forked_process(self, path):
+        """Test that a forked process discards inherited counters, keeps
+        inherited gauges, and adds its own metrics to the totals at exit.
+        """
+        client = _new_client(path)
+        client.incr('errors')
+        client.gauge('store.tracks', 10)
+
+        pid = os.fork()
+        if pid == 0:
+            status = 1
+            try:
+                client.incr('errors', 5)
+                client.write()
+                with open(os.path.join(path, 'metrics.{0}.json'.format(os.getpid()))) as handle:
+                    snapshot = simplejson.load(handle)
+                if snapshot['counters'] == {'errors': 5} and snapshot['gauges']['store.tracks'] == 10:
+                    status = 0
+                client.close()
+            finally:
+                os._exit(status)
+        _, status = os.waitpid(pid, 0)
+
+        metrics = client.collect()
+        assert 0 == status
+        assert {'errors': 5} == _read_aggregate(path)['counters']
+        assert 6 == metrics['counters']['errors']
+        assert [os.getpid()] == list(metrics['gauges'])
+        client.close()
+
+
+def test_remove_stale(path, exited_pid):
+    """Test that only files of processes that aren't running and the totals
+    of exited processes are removed.
+    """
+    _write_snapshot(path, os.getpid())
+    _write_snapshot(path, exited_pid)
+    with open(os.path.join(path, 'metrics.aggregate.json'), 'w') as handle:
+        handle.write('{}')
+
+    assert [exited_pid] == avalon.prometheus.remove_stale(path)
+    assert ['metrics.{0}.json'.format(os.getpid())] == _list_metrics(path)
+
+
+def test_remove_stale_other_process_running(path, exited_pid):
+    """Test that nothing is removed when another running process has a
+    metrics file, as when each worker process bootstraps the application.
+    """
+    _write_snapshot(path, os.getppid(), counters={'request.songs.results': 2})
+    _write_snapshot(path, exited_pid, counters={'request.songs.results': 3})
+    with open(os.path.join(path, 'metrics.aggregate.json'), 'w') as handle:
+        handle.write('{}')
+
+    assert [] == avalon.prometheus.remove_stale(path)
+    assert sorted([
+        'metrics.aggregate.json',
+        'metrics.{0}.json'.format(os.getppid()),
+        'metrics.{0}.json'.format(exited_pid),
+    ]) == _list_metrics(path)
+
+
+def test_new_client_keeps_totals_of_running_server(path, exited_pid):
+    """Test that creating the client of another worker process while the
+    server is running doesn't make counters go backwards.
+    """
+    _write_snapshot(path, exited_pid, counters={'request.songs.results': 3})
+    first = _new_client(path)
+    # Another worker that is still running
+    _write_snapshot(path, os.getppid(), counters={'request.songs.results': 2})
+    assert 'avalon_request_songs_results_total 5' in first.render().splitlines()
+
+    second = avalon.app.factory.new_stats_client(
+        mock.Mock(), {'METRICS_PROMETHEUS_PATH': path})
+    assert 'avalon_request_songs_results_total 5' in second.render().splitlines()
+    first.close()
+    second.close()
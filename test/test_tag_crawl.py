@@ -5,6 +5,7 @@ from __future__ import absolute_import, unicode_literals
 import mock
 
 import avalon.log
+import avalon.metrics
 import avalon.tags.read
 import avalon.tags.crawl
 
@@ -84,3 +85,16 @@ class TestTagCrawler(object):
 
         assert 2 == len(out)
 
+
+    def test_get_tags_records_timing(self, monkeypatch):
+        """Test that the time taken to find files and read tags is recorded"""
+        client = mock.Mock()
+        monkeypatch.setattr(avalon.metrics.bridge, 'client', client)
+        loader = mock.Mock(spec=avalon.tags.read.MetadataLoader)
+        loader.get_from_path.side_effect = [None]
+
+        crawler = avalon.tags.crawl.TagCrawler(loader, 'music', DummyWalk(['path.ogg']))
+        crawler.get_tags()
+
+        keys = [call[0][0] for call in client.timing.call_args_list]
+        assert ['scan.walk', 'scan.read'] == keys
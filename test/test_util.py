@@ -4,6 +4,8 @@
 from __future__ import absolute_import, unicode_literals
 import errno
 
+import os
+import pytest
 import avalon.util
 
 
@@ -27,6 +29,18 @@ def test_is_perm_error_not_io_error():
     assert False is avalon.util.is_perm_error(e)
 
 
+@pytest.mark.skipif(not os.path.exists('/proc/self/statm'), reason='Requires /proc')
+def test_get_rss_bytes_current():
+    """Test that the current memory use goes down when memory is freed,
+    unlike the peak memory use.
+    """
+    block = bytearray(64 * 1024 * 1024)
+    with_block = avalon.util.get_rss_bytes()
+    del block
+
+    assert with_block - avalon.util.get_rss_bytes() > 32 * 1024 * 1024
+
+
 def test_partition():
     input_list = ['one', 'two', 'three', 'four', 'five']
     generator = avalon.util.partition(input_list, 2)
@@ -44,3 +58,87 @@ def test_partition():
     assert 'four' in part_2
     assert 'five' in part_3
 
+
+
+class TestLRUCache(object):
+    def test_get_missing(self):
+        cache = avalon.util.LRUCache(2)
+        assert cache.get('foo') is None
+        assert 'bar' == cache.get('foo', 'bar')
+
+    def test_put_evicts_least_recently_used(self):
+        cache = avalon.util.LRUCache(2)
+        cache.put('one', 1)
+        cache.put('two', 2)
+        # Reading 'one' makes 'two' the least recently used entry
+        assert 1 == cache.get('one')
+        cache.put('three', 3)
+
+        assert 2 == len(cache)
+        assert 1 == cache.get('one')
+        assert cache.get('two') is None
+        assert 3 == cache.get('three')
+
+    def test_put_existing_key(self):
+        cache = avalon.util.LRUCache(2)
+        cache.put('one', 1)
+        cache.put('one', 11)
+
+        assert 1 == len(cache)
+        assert 11 == cache.get('one')
+
+    def test_clear(self):
+        cache = avalon.util.LRUCache(2)
+        cache.put('one', 1)
+        cache.clear()
+
+        assert 0 == len(cache)
+
+    def test_put_with_weigher(self):
+        cache = avalon.util.LRUCache(5, weigher=len)
+        cache.put('one', 'aa')
+        cache.put('two', 'bbb')
+        assert 5 == cache.weight
+
+        cache.put('three', 'c')
+        assert cache.get('one') is None
+        assert 4 == cache.weight
+        assert ['two', 'three'] == cache.keys()
+
+    def test_put_heavier_than_max(self):
+        cache = avalon.util.LRUCache(5, weigher=len)
+        cache.put('one', 'aa')
+        cache.put('one', 'bbbbbb')
+
+        assert cache.get('one') is None
+        assert 0 == cache.weight
+
+
+class TestFileSemaphore(object):
+    def test_acquire_limited_slots(self, tmpdir):
+        """Test that only as many holders as there are slots can acquire
+        the semaphore until it is released.
+        """
+        sem1 = avalon.util.FileSemaphore(str(tmpdir), 'reload', 2)
+        sem2 = avalon.util.FileSemaphore(str(tmpdir), 'reload', 2)
+        sem3 = avalon.util.FileSemaphore(str(tmpdir), 'reload', 2)
+
+        assert sem1.acquire(blocking=False)
+        assert sem2.acquire(blocking=False)
+        assert not sem3.acquire(blocking=False)
+
+        sem1.release()
+        assert sem3.acquire(blocking=False)
+
+        sem2.release()
+        sem3.release()
+
+    def test_context_manager_releases(self, tmpdir):
+        """Test that the semaphore is released when the block exits."""
+        sem1 = avalon.util.FileSemaphore(str(tmpdir), 'reload', 1)
+        sem2 = avalon.util.FileSemaphore(str(tmpdir), 'reload', 1)
+
+        with sem1:
+            assert not sem2.acquire(blocking=False)
+        assert sem2.acquire(blocking=False)
+        sem2.release()
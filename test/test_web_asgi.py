@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+#
+
+from __future__ import absolute_import, unicode_literals
+import sys
+import threading
+
+import flask
+import pytest
+
+# The adapter uses "async def" which is a syntax error before Python 3.5,
+# not an import error, so the module must be skipped before importing it.
+if sys.version_info < (3, 5):
+    pytest.skip("Requires Python 3.5 or above", allow_module_level=True)
+
+asyncio = pytest.importorskip('asyncio')
+avalon_web_asgi = pytest.importorskip('avalon.web.asgi')
+
+
+@pytest.fixture
+def wsgi_app():
+    app = flask.Flask(__name__)
+
+    @app.route('/avalon/echo', methods=['GET', 'POST'])
+    def echo():
+        return flask.jsonify(
+            path=flask.request.path,
+            script_root=flask.request.script_root,
+            args=flask.request.args.to_dict(),
+            body=flask.request.get_data(as_text=True),
+            agent=flask.request.headers.get('User-Agent'),
+            thread=threading.current_thread().name)
+
+    return app
+
+
+def _run(adapter, scope, messages):
+    """Run the adapter with the given events to receive, returning each
+    event it sent.
+    """
+    sent = []
+
+    def receive():
+        future = asyncio.get_event_loop().create_future()
+        future.set_result(messages.pop(0))
+        return future
+
+    def send(message):
+        sent.append(message)
+        future = asyncio.get_event_loop().create_future()
+        future.set_result(None)
+        return future
+
+    loop = asyncio.new_event_loop()
+    try:
+        loop.run_until_complete(adapter(scope, receive, send))
+    finally:
+        loop.close()
+    return sent
+
+
+def _http_scope(path, query_string=b'', method='GET', root_path=''):
+    return {
+        'type': 'http',
+        'http_version': '1.1',
+        'method': method,
+        'scheme': 'http',
+        'root_path': root_path,
+        'path': path,
+        'query_string': query_string,
+        'headers': [(b'host', b'localhost:8000'), (b'user-agent', b'test')],
+        'client': ('127.0.0.1', 51000),
+        'server': ('127.0.0.1', 8000),
+    }
+
+
+class TestAsgiAdapter(object):
+    def test_http_request(self, wsgi_app):
+        """Test that requests are handled by the WSGI app in the thread pool."""
+        adapter = avalon_web_asgi.AsgiAdapter(wsgi_app, threads=1)
+        sent = _run(adapter, _http_scope('/avalon/echo', b'query=caf%C3%A9&limit=2'), [
+            {'type': 'http.request', 'body': b'', 'more_body': False}])
+
+        assert 'http.response.start' == sent[0]['type']
+        assert 200 == sent[0]['status']
+        assert (b'content-type', b'application/json') in sent[0]['headers']
+        assert 'http.response.body' == sent[1]['type']
+
+        body = flask.json.loads(sent[1]['body'])
+        assert '/avalon/echo' == body['path']
+        assert {'query': 'café', 'limit': '2'} == body['args']
+        assert 'test' == body['agent']
+        assert threading.current_thread().name != body['thread']
+
+    def test_http_request_body(self, wsgi_app):
+        """Test that the body of a request sent in multiple events is combined."""
+        adapter = avalon_web_asgi.AsgiAdapter(wsgi_app, threads=1)
+        sent = _run(adapter, _http_scope('/avalon/echo', method='POST'), [
+            {'type': 'http.request', 'body': b'abc', 'more_body': True},
+            {'type': 'http.request', 'body': b'def', 'more_body': False}])
+
+        assert 'abcdef' == flask.json.loads(sent[1]['body'])['body']
+
+    def test_http_root_path(self, wsgi_app):
+        """Test that the path the app is mounted at is removed from the path."""
+        adapter = avalon_web_asgi.AsgiAdapter(wsgi_app, threads=1)
+        sent = _run(adapter, _http_scope('/music/avalon/echo', root_path='/music'), [
+            {'type': 'http.request', 'body': b'', 'more_body': False}])
+
+        body = flask.json.loads(sent[1]['body'])
+        assert '/avalon/echo' == body['path']
+        assert '/music' == body['script_root']
+
+    def test_http_not_found(self, wsgi_app):
+        """Test that the status of error responses is sent."""
+        adapter = avalon_web_asgi.AsgiAdapter(wsgi_app, threads=1)
+        sent = _run(adapter, _http_scope('/avalon/nope'), [
+            {'type': 'http.request', 'body': b'', 'more_body': False}])
+
+        assert 404 == sent[0]['status']
+
+    def test_http_disconnect(self, wsgi_app):
+        """Test that nothing is sent if the client disconnects before sending the body."""
+        adapter = avalon_web_asgi.AsgiAdapter(wsgi_app, threads=1)
+        sent = _run(adapter, _http_scope('/avalon/echo', method='POST'), [
+            {'type': 'http.disconnect'}])
+
+        assert [] == sent
+
+    def test_lifespan(self, wsgi_app):
+        """Test that startup and shutdown events are acknowledged."""
+        adapter = avalon_web_asgi.AsgiAdapter(wsgi_app, threads=1)
+        sent = _run(adapter, {'type': 'lifespan'}, [
+            {'type': 'lifespan.startup'}, {'type': 'lifespan.shutdown'}])
+
+        assert [{'type': 'lifespan.startup.complete'},
+                {'type': 'lifespan.shutdown.complete'}] == sent
+
+    def test_unsupported_type(self, wsgi_app):
+        """Test that connections other than HTTP requests aren't supported."""
+        adapter = avalon_web_asgi.AsgiAdapter(wsgi_app, threads=1)
+
+        with pytest.raises(ValueError):
+            _run(adapter, {'type': 'websocket'}, [])
+
+
+def test_get_environ_headers():
+    """Test that headers are converted to WSGI variables, combining repeated headers."""
+    scope = _http_scope('/avalon/songs')
+    scope['headers'] = [
+        (b'content-type', b'text/plain'),
+        (b'content-length', b'3'),
+        (b'x-forwarded-for', b'10.0.0.1'),
+        (b'x-forwarded-for', b'10.0.0.2')]
+    environ = avalon_web_asgi.get_environ(scope, b'abc')
+
+    assert 'text/plain' == environ['CONTENT_TYPE']
+    assert '3' == environ['CONTENT_LENGTH']
+    assert '10.0.0.1,10.0.0.2' == environ['HTTP_X_FORWARDED_FOR']
+    assert b'abc' == environ['wsgi.input'].read()
+    assert '127.0.0.1' == environ['REMOTE_ADDR']
+    assert '8000' == environ['SERVER_PORT']
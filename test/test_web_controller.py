@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+#
+
+from __future__ import absolute_import, unicode_literals
+import collections
+
+import flask
+import mock
+import pytest
+
+import avalon.exc
+import avalon.metrics
+import avalon.profiling
+import avalon.prometheus
+import avalon.web.controller
+import avalon.web.response
+import avalon.web.services
+
+
+@pytest.fixture
+def app():
+    app = flask.Flask(__name__)
+    app.json_encoder = avalon.web.response.AvalonJsonEncoder
+    return app
+
+
+@pytest.fixture
+def profiler():
+    profiler = mock.Mock(spec=avalon.profiling.SamplingProfiler)
+    profiler.profile.return_value = collections.Counter({('main', 'a.py:run'): 3})
+    return profiler
+
+
+def _new_controller(profiler, admin_token):
+    api = mock.Mock(spec=avalon.web.services.AvalonMetadataService)
+    return avalon.web.controller.AvalonController(
+        api, [], profiler=profiler, admin_token=admin_token)
+
+
+class TestGetProfile(object):
+    def test_not_enabled(self, app, profiler):
+        """Test that profiles can't be recorded without an admin token configured."""
+        controller = _new_controller(profiler, None)
+
+        with app.test_request_context('/profile'):
+            _, code = controller.get_profile()
+
+        assert 403 == code
+        assert not profiler.profile.called
+
+    def test_invalid_token(self, app, profiler):
+        """Test that profiles can't be recorded without the right token."""
+        controller = _new_controller(profiler, 's3cret')
+
+        with app.test_request_context('/profile', headers={'Authorization': 'Bearer nope'}):
+            _, code = controller.get_profile()
+
+        assert 403 == code
+        assert not profiler.profile.called
+
+    def test_invalid_seconds(self, app, profiler):
+        """Test that the number of seconds must be in range."""
+        controller = _new_controller(profiler, 's3cret')
+
+        with app.test_request_context(
+                '/profile?seconds=600', headers={'Authorization': 'Bearer s3cret'}):
+            _, code = controller.get_profile()
+
+        assert 400 == code
+        assert not profiler.profile.called
+
+    def test_success(self, app, profiler):
+        """Test that collapsed stacks are returned with the right token."""
+        controller = _new_controller(profiler, 's3cret')
+
+        with app.test_request_context(
+                '/profile?seconds=2', headers={'Authorization': 'Bearer s3cret'}):
+            res = controller.get_profile()
+
+        profiler.profile.assert_called_with(2)
+        assert 'text/plain' == res.mimetype
+        assert b'main;a.py:run 3\n' == res.get_data()
+
+
+class TestGetMetrics(object):
+    def test_not_enabled(self, app, monkeypatch, profiler):
+        """Test that an error is returned if Prometheus metrics aren't enabled."""
+        monkeypatch.setattr(avalon.metrics.bridge, 'client', None)
+        controller = _new_controller(profiler, None)
+
+        with app.test_request_context('/metrics'):
+            _, code = controller.get_metrics()
+
+        assert 503 == code
+
+    def test_enabled(self, app, monkeypatch, profiler):
+        """Test that metrics of every process are rendered in the text format."""
+        client = mock.Mock(spec=avalon.prometheus.PrometheusStatsClient)
+        client.render.return_value = 'avalon_errors_total 1\n'
+        monkeypatch.setattr(avalon.metrics.bridge, 'client', client)
+        controller = _new_controller(profiler, None)
+
+        with app.test_request_context('/metrics'):
+            res = controller.get_metrics()
+
+        assert avalon.prometheus.CONTENT_TYPE == res.headers['Content-Type']
+        assert b'avalon_errors_total 1\n' == res.get_data()
+
+
+class TestGetBatch(object):
+    def test_results_in_order(self, app, profiler):
+        """Test that the results or error of each query are returned in order."""
+        controller = _new_controller(profiler, None)
+        controller._api.get_genres.return_value = ['Rock']
+        controller._api.get_songs.side_effect = avalon.exc.InvalidParameterTypeError(
+            "Invalid field value for integer field {field}: '{value}'", field='limit', value='a')
+        controller._api.get_suggestions.return_value = {'songs': []}
+
+        payload = {'queries': [
+            {'endpoint': 'genres'},
+            {'endpoint': 'songs', 'params': {'limit': 'a'}},
+            {'endpoint': 'suggest', 'params': {'query': 'ro'}},
+            {'endpoint': 'profile'}]}
+
+        with app.test_request_context('/batch', method='POST', data=flask.json.dumps(payload)):
+            res = controller.get_batch()
+
+        results = flask.json.loads(res.get_data())['success']
+        assert ['Rock'] == results[0]['success']
+        assert 101 == results[1]['errors'][0]['code']
+        assert {'songs': []} == results[2]['success']
+        assert 102 == results[3]['errors'][0]['code']
+        assert not profiler.profile.called
+
+    def test_invalid_param_only_fails_query(self, app, profiler):
+        """Test that an invalid parameter value only results in an error
+        for its own query.
+        """
+        controller = _new_controller(profiler, None)
+        controller._api.get_genres.return_value = ['Rock']
+
+        payload = {'queries': [
+            {'endpoint': 'genres', 'params': {'limit': 5}},
+            {'endpoint': 'songs', 'params': {'album': None}}]}
+
+        with app.test_request_context('/batch', method='POST', data=flask.json.dumps(payload)):
+            res = controller.get_batch()
+
+        results = flask.json.loads(res.get_data())['success']
+        assert ['Rock'] == results[0]['success']
+        assert [] == results[0]['errors']
+        assert results[1]['success'] is None
+        assert 101 == results[1]['errors'][0]['code']
+        assert not controller._api.get_songs.called
+
+    def test_invalid_body(self, app, profiler):
+        """Test that an error is returned if the body isn't a valid batch."""
+        controller = _new_controller(profiler, None)
+
+        with app.test_request_context('/batch', method='POST', data='{"queries": '):
+            _, code = controller.get_batch()
+
+        assert 400 == code
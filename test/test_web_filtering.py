@@ -73,6 +73,24 @@ class TestSortFilter(object):
         sorted_elms = avalon.web.filtering.sort_filter(self.elms, params)
         assert sorted_elms == self.desc_sorted, "Did not get DESC sorted elms"
 
+    def test_sort_filter_relevance(self):
+        """Ensure elements ordered by relevance are left as they are."""
+        request = DummyRequest({
+            'query': 'abc',
+            'order': 'relevance',
+            'direction': 'desc'})
+        params = avalon.web.request.Parameters(request)
+        sorted_elms = avalon.web.filtering.sort_filter(self.elms, params)
+        assert sorted_elms == self.elms, "Expected elements the same order"
+
+    def test_sort_filter_relevance_no_query(self):
+        """Ensure ordering by relevance without a search is an error."""
+        request = DummyRequest({'order': 'relevance'})
+        params = avalon.web.request.Parameters(request)
+
+        with pytest.raises(avalon.exc.InvalidParameterValueError):
+            avalon.web.filtering.sort_filter(self.elms, params)
+
 
 class TestLimitFilter(object):
     def setup(self):
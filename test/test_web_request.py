@@ -5,6 +5,7 @@ from __future__ import absolute_import, unicode_literals
 import uuid
 
 import pytest
+from werkzeug.datastructures import MultiDict
 import avalon.exc
 import avalon.web.request
 
@@ -76,26 +77,159 @@ class TestParameters(object):
         val = r.get_int('limit')
         assert 12 == val
 
-    def test_get_uuid_missing(self):
-        """Ensure that a valid missing parameter results in a default value."""
+    def test_get_uuid_list_missing(self):
+        """Ensure that a missing UUID field results in no values."""
         self.request.args = {}
         r = avalon.web.request.Parameters(self.request)
-        val = r.get_uuid('artist_id')
-        assert None is val
+        assert [] == r.get_uuid_list('artist_id')
+
+    def test_items_only_valid_fields(self):
+        """Ensure that only recognized fields are included, sorted by name."""
+        self.request.args = {'query': 'dookie', 'limit': '12', 'asdf': '1'}
+        r = avalon.web.request.Parameters(self.request)
+        assert [('limit', '12'), ('query', 'dookie')] == r.items()
+
+    def test_items_no_profile_fields(self):
+        """Ensure that fields of the profile endpoint are not included."""
+        self.request.args = {'query': 'dookie', 'seconds': '10'}
+        r = avalon.web.request.Parameters(self.request)
+        assert [('query', 'dookie')] == r.items()
+
+
+class TestProfileParameters(object):
+    def setup(self):
+        self.request = DummyRequest()
+
+    def test_get_int_seconds(self):
+        """Ensure the number of seconds to profile for can be read."""
+        self.request.args = {'seconds': '10'}
+        r = avalon.web.request.ProfileParameters(self.request)
+        assert 10 == r.get_int('seconds')
+
+    def test_get_other_field(self):
+        """Ensure fields of other endpoints can't be read."""
+        self.request.args = {'limit': '10'}
+        r = avalon.web.request.ProfileParameters(self.request)
+
+        with pytest.raises(KeyError):
+            r.get_int('limit')
+
+
+class TestParametersMultiple(object):
+    def setup(self):
+        self.request = DummyRequest()
 
-    def test_get_uuid_invalid(self):
-        """Ensure that an invalid value for a UUID field results in an \
-        exception."""
-        self.request.args = {'artist_id': 'asdf'}
+    def test_get_list_invalid(self):
+        """Ensure a field that may not have multiple values causes an exception."""
+        self.request.args = {}
+        r = avalon.web.request.Parameters(self.request)
+
+        with pytest.raises(KeyError):
+            r.get_list('limit')
+
+    def test_get_list_missing(self):
+        """Ensure a missing field results in no values."""
+        self.request.args = {}
+        r = avalon.web.request.Parameters(self.request)
+        assert [] == r.get_list('album_id')
+
+    def test_get_list_repeated(self):
+        """Ensure each value of a repeated query string parameter is returned."""
+        self.request.args = MultiDict([('album_id', 'a'), ('album_id', 'b'), ('limit', '2')])
+        r = avalon.web.request.Parameters(self.request)
+        assert ['a', 'b'] == r.get_list('album_id')
+
+    def test_get_list_single_val(self):
+        """Ensure a single value is returned as a list."""
+        self.request.args = {'album_id': 'a'}
+        r = avalon.web.request.Parameters(self.request)
+        assert ['a'] == r.get_list('album_id')
+
+    def test_get_uuid_list_invalid(self):
+        """Ensure an exception is raised if any value isn't a UUID."""
+        self.request.args = {'genre_id': ['26ce4d6b-af97-45a6-b7f6-d5c1cbbfd6b1', 'asdf']}
         r = avalon.web.request.Parameters(self.request)
 
         with pytest.raises(avalon.exc.InvalidParameterTypeError):
-            r.get_uuid('artist_id')
+            r.get_uuid_list('genre_id')
 
-    def test_get_uuid_success(self):
-        """Ensure that a valid UUID value is converted to a UUID."""
-        self.request.args = {'artist_id': 'e4228e96-c165-4a83-a145-038df58f9c8c'}
+    def test_get_uuid_list_success(self):
+        """Ensure each value is converted to a UUID."""
+        vals = ['26ce4d6b-af97-45a6-b7f6-d5c1cbbfd6b1', '75d590d1-9f3d-462d-8264-0d16af227860']
+        self.request.args = {'genre_id': vals}
         r = avalon.web.request.Parameters(self.request)
-        val = r.get_uuid('artist_id')
-        expected = uuid.UUID('e4228e96-c165-4a83-a145-038df58f9c8c')
-        assert expected == val
+        assert [uuid.UUID(val) for val in vals] == r.get_uuid_list('genre_id')
+
+    def test_items_multiple_values(self):
+        """Ensure fields that may have multiple values are returned as lists."""
+        self.request.args = MultiDict([('artist_id', 'a'), ('artist_id', 'b'), ('limit', '2')])
+        r = avalon.web.request.Parameters(self.request)
+        assert [('artist_id', ['a', 'b']), ('limit', '2')] == r.items()
+
+
+class TestGetBatchParams(object):
+    def test_success(self):
+        """Test that values are converted to query string parameters."""
+        params = avalon.web.request.get_batch_params({'album': 'Dummy', 'limit': 10})
+
+        assert 'Dummy' == params.get('album')
+        assert 10 == params.get_int('limit')
+        assert '10' == params.get('limit')
+
+    def test_list_val(self):
+        """Test that lists of values are treated as multiple values."""
+        params = avalon.web.request.get_batch_params({'album': ['a', 'b']})
+
+        with pytest.raises(avalon.exc.InvalidParameterTypeError):
+            params.get('album')
+
+    @pytest.mark.parametrize('params', [
+        {'album': None},
+        {'album': {'name': 'a'}},
+        {'album_id': [['a'], 'b']},
+        {'album_id': ['a', None]},
+    ])
+    def test_invalid(self, params):
+        """Test that values that can't be query string parameters cause an exception."""
+        with pytest.raises(avalon.exc.InvalidParameterTypeError):
+            avalon.web.request.get_batch_params(params)
+
+
+class TestGetBatchQueries(object):
+    def test_success(self):
+        """Test that the endpoint and parameters of each query are returned."""
+        queries = avalon.web.request.get_batch_queries({'queries': [
+            {'endpoint': 'genres'},
+            {'endpoint': 'songs', 'params': {'album': 'Dummy', 'limit': 10}}]})
+
+        assert [('genres', {}), ('songs', {'album': 'Dummy', 'limit': 10})] == queries
+
+    def test_invalid_values_left_for_query(self):
+        """Test that parameter values aren't checked until the parameters
+        of each query are converted.
+        """
+        queries = avalon.web.request.get_batch_queries({'queries': [
+            {'endpoint': 'songs', 'params': {'album': None}}]})
+
+        assert [('songs', {'album': None})] == queries
+
+    @pytest.mark.parametrize('payload', [
+        None,
+        [],
+        {'queries': {}},
+        {'queries': ['songs']},
+        {'queries': [{'params': {}}]},
+        {'queries': [{'endpoint': 'songs', 'params': 'album=a'}]},
+    ])
+    def test_invalid(self, payload):
+        """Test that batches not in the expected format cause an exception."""
+        with pytest.raises(avalon.exc.InvalidParameterTypeError):
+            avalon.web.request.get_batch_queries(payload)
+
+    def test_too_many(self):
+        """Test that batches with more than the maximum number of queries
+        cause an exception.
+        """
+        with pytest.raises(avalon.exc.InvalidParameterValueError):
+            avalon.web.request.get_batch_queries(
+                {'queries': [{'endpoint': 'genres'}] * 3}, max_queries=2)
@@ -73,6 +73,20 @@ class TestSearchable(object):
         word = ' Verás '
         assert 'veras' == avalon.web.search.searchable(word)
 
+    def test_searchable_ascii_mixed_case_whitespace(self):
+        """Ensure that ASCII input is lowercased and stripped."""
+        assert 'the reject' == avalon.web.search.searchable(' The Reject ')
+
+    def test_searchable_bytes(self):
+        """Ensure that binary input is converted to text."""
+        assert 'veras' == avalon.web.search.searchable('Verás'.encode('utf-8'))
+
+    def test_searchable_non_ascii_cached(self):
+        """Ensure that the normalized form of non-ASCII input is cached."""
+        word = 'Mötley Crüe'
+        assert 'motley crue' == avalon.web.search.searchable(word)
+        assert 'motley crue' == avalon.web.search._SEARCHABLE_CACHE.get(word)
+
 
 class TestStripAccents(object):
     def test_strip_accents_umlaut(self):
@@ -112,6 +126,34 @@ class TestTrieNode(object):
         assert 123 in elms
         assert 456 in elms
 
+    def test_elements_read_only_view(self):
+        """Ensure that elements are returned as a view that can't be modified."""
+        node = avalon.web.search.TrieNode()
+        node.add_element(123)
+        node.add_element(456)
+
+        elms = node.get_elements()
+        with pytest.raises(AttributeError):
+            elms.add(789)
+
+        node.add_element(789)
+        assert 3 == len(elms)
+        assert set([123, 456]) == elms & set([123, 456])
+
+    def test_get_child(self):
+        """Ensure that single children can be looked up by character."""
+        node = avalon.web.search.TrieNode()
+        child1 = avalon.web.search.TrieNode()
+        child2 = avalon.web.search.TrieNode()
+
+        assert node.get_child('a') is None
+        node.add_child('a', child1)
+        assert node.get_child('a') is child1
+        assert node.get_child('b') is None
+        node.add_child('b', child2)
+        assert node.get_child('a') is child1
+        assert node.get_child('b') is child2
+
     def test_children_empty(self):
         """Ensure that trie nodes initially have no children."""
         node = avalon.web.search.TrieNode()
@@ -159,6 +201,9 @@ class _DummyNode(object):
     def add_child(self, char, node):
         self._children[char] = node
 
+    def get_child(self, char):
+        return self._children.get(char)
+
     def get_children(self):
         return dict(self._children)
 
@@ -204,6 +249,23 @@ class TestSearchTrie(object):
         assert 'b' in second_level
         assert 'c' in second_level
 
+    def test_add_sorted_same_as_add(self):
+        """Ensure that adding sorted terms in bulk builds the same nodes
+        and matches as adding each term individually.
+        """
+        terms = [('big', 'big'), ('bit', 'bit'), ('bit', 'bite'), ('bite', 'bite'), ('cat', 'cat')]
+
+        trie1 = avalon.web.search.SearchTrie(_dummy_node_factory)
+        for term, elm in terms:
+            trie1.add(term, elm)
+
+        trie2 = avalon.web.search.SearchTrie(_dummy_node_factory)
+        trie2.add_sorted(terms)
+
+        assert len(trie1) == len(trie2)
+        for query in ('b', 'bi', 'big', 'bit', 'bite', 'c', 'cat', 'd'):
+            assert trie1.search(query) == trie2.search(query)
+
     def test_search_no_term(self):
         """Ensure that an empty or None search term results in
         no results from a search.
@@ -292,6 +354,178 @@ class TestSearchTrie(object):
         results3 = trie.search('bi')
         assert 2 == len(results3)
 
+    def test_search_fuzzy(self):
+        """Ensure that terms within the maximum number of edits of the
+        start of an indexed term match.
+        """
+        trie = avalon.web.search.SearchTrie(avalon.web.search.TrieNode)
+        for term in ('radiohead', 'rancid', 'nofx'):
+            trie.add(term, term)
+
+        # Substitution, deletion, and insertion
+        assert frozenset(['radiohead']) == trie.search_fuzzy('radeo', 1, 1000)
+        assert frozenset(['radiohead']) == trie.search_fuzzy('rdio', 1, 1000)
+        assert frozenset(['radiohead']) == trie.search_fuzzy('raddio', 1, 1000)
+        assert frozenset(['nofx']) == trie.search_fuzzy('nofz', 1, 1000)
+        assert frozenset() == trie.search_fuzzy('nozz', 1, 1000)
+        assert frozenset(['nofx']) == trie.search_fuzzy('nozz', 2, 1000)
+
+    def test_search_fuzzy_visit_budget(self):
+        """Ensure that no more than the visit budget number of nodes are
+        visited when searching.
+        """
+        trie = avalon.web.search.SearchTrie(avalon.web.search.TrieNode)
+        trie.add('nofx', 'nofx')
+
+        # 'nof' is within one edit of the term, three nodes down
+        assert frozenset() == trie.search_fuzzy('nofz', 1, 2)
+        assert frozenset(['nofx']) == trie.search_fuzzy('nofz', 1, 3)
+
+    def test_search_ranked_no_match(self):
+        """Ensure that a ranked search with no matches generates nothing."""
+        trie = avalon.web.search.SearchTrie(avalon.web.search.TrieNode)
+        trie.add('bit', 'bit')
+        trie.rank([('bit', 'bit')], 10)
+
+        assert [] == list(trie.search_ranked('big'))
+        assert [] == list(trie.search_ranked(''))
+
+    def test_search_ranked_exact_match_first(self):
+        """Ensure that elements with a name equal to the term are ranked
+        first followed by the rest ordered by name.
+        """
+        names = [('bit', 'bit'), ('bite', 'bite'), ('big', 'big'), ('bit', 'bit 2')]
+        trie = avalon.web.search.SearchTrie(avalon.web.search.TrieNode)
+        trie.add_sorted(sorted(names))
+        trie.rank(sorted(names), 10)
+
+        assert ['bit', 'bit 2', 'bite'] == list(trie.search_ranked('bit'))
+        assert ['big', 'bit', 'bit 2', 'bite'] == list(trie.search_ranked('bi'))
+
+    def test_search_ranked_precomputed_top(self):
+        """Ensure that results for nodes with more elements than the top
+        size are the same as ranking all of them.
+        """
+        names = [('b', 'b'), ('ba', 'ba'), ('bb', 'bb'), ('bc', 'bc'), ('bd', 'bd')]
+        trie = avalon.web.search.SearchTrie(avalon.web.search.TrieNode)
+        trie.add_sorted(names)
+        trie.rank(names, 2)
+
+        assert 1 == len(trie._top)
+        assert ['b', 'ba', 'bb', 'bc', 'bd'] == list(trie.search_ranked('b'))
+        assert ['bc'] == list(trie.search_ranked('bc'))
+
+
+def _new_radix_trie():
+    return avalon.web.search.RadixTrie(avalon.web.search.RadixNode)
+
+
+class TestRadixTrie(object):
+    def test_add_single_term_one_node(self):
+        """Ensure that adding a single term creates a single node with
+        the entire term as its label.
+        """
+        trie = _new_radix_trie()
+        trie.add('foo', 'foo')
+
+        assert len(trie) == 2
+        children = trie._root.get_children()
+        assert ['foo'] == list(children.keys())
+
+    def test_add_splits_label(self):
+        """Ensure that adding a term that diverges part way along a label
+        splits the node at that point.
+        """
+        trie = _new_radix_trie()
+        trie.add('bite', 'bite')
+        trie.add('big', 'big')
+
+        assert len(trie) == 4
+        first_level = trie._root.get_children()
+        assert ['bi'] == list(first_level.keys())
+
+        second_level = first_level['bi'].get_children()
+        assert set(['te', 'g']) == set(second_level.keys())
+        assert frozenset(['bite', 'big']) == frozenset(first_level['bi'].get_elements())
+
+    def test_add_term_ending_mid_label(self):
+        """Ensure that adding a term that ends part way along a label
+        creates a node for it that only has matching elements.
+        """
+        trie = _new_radix_trie()
+        trie.add('bite', 'bite')
+        trie.add('bit', 'bit')
+
+        assert frozenset(['bite', 'bit']) == trie.search('bit')
+        assert frozenset(['bite']) == trie.search('bite')
+
+    def test_search_mid_label(self):
+        """Ensure that a search ending part way along a label matches
+        and a search diverging from a label does not.
+        """
+        trie = _new_radix_trie()
+        trie.add('radiohead', 'radiohead')
+
+        assert frozenset(['radiohead']) == trie.search('rad')
+        assert frozenset(['radiohead']) == trie.search('radiohead')
+        assert frozenset() == trie.search('radx')
+        assert frozenset() == trie.search('radioheads')
+        assert frozenset() == trie.search('')
+
+    def test_add_sorted_same_as_add(self):
+        """Ensure that adding sorted terms in bulk splits the same nodes and
+        builds the same matches as adding each term individually.
+        """
+        terms = sorted([
+            ('bit', 'bit'), ('bit', 'bit 2'), ('bite', 'bite'), ('biter', 'biter'),
+            ('big', 'big'), ('bitten', 'bitten'), ('b', 'b'), ('ran', 'ran'),
+            ('rancid', 'rancid'), ('radiohead', 'radiohead'), ('radio', 'radio')])
+
+        trie1 = _new_radix_trie()
+        for term, elm in terms:
+            trie1.add(term, elm)
+
+        trie2 = _new_radix_trie()
+        trie2.add_sorted(terms)
+
+        assert len(trie1) == len(trie2)
+        for query in ('b', 'bi', 'big', 'bit', 'bite', 'bitt', 'biter', 'r',
+                      'ra', 'rad', 'radio', 'radioh', 'ran', 'ranc', 'x'):
+            assert trie1.search(query) == trie2.search(query)
+
+    def test_same_results_as_search_trie(self):
+        """Ensure that regular, ranked, and fuzzy searches return the same
+        results as a trie without path compression with fewer nodes.
+        """
+        names = sorted([
+            ('big', 'big'), ('bit', 'bit'), ('bit', 'bit 2'), ('bite', 'bite'),
+            ('biter', 'biter'), ('bitten', 'bitten'), ('cat', 'cat'), ('nofx', 'nofx'),
+            ('radiohead', 'radiohead'), ('rancid', 'rancid'), ('ran', 'ran')])
+
+        trie1 = avalon.web.search.SearchTrie(avalon.web.search.TrieNode)
+        trie1.add_sorted(names)
+        trie1.rank(names, 2)
+
+        trie2 = _new_radix_trie()
+        trie2.add_sorted(names)
+        trie2.rank(names, 2)
+
+        assert len(trie2) < len(trie1)
+        for query in ('b', 'bi', 'bit', 'bite', 'bitt', 'bx', 'c', 'r', 'ra',
+                      'rad', 'ran', 'ranc', 'nofz', 'radeo', 'z'):
+            assert trie1.search(query) == trie2.search(query)
+            assert list(trie1.search_ranked(query)) == list(trie2.search_ranked(query))
+            for max_edits in (1, 2):
+                assert (trie1.search_fuzzy(query, max_edits, 1000) ==
+                        trie2.search_fuzzy(query, max_edits, 1000))
+
+    def test_search_fuzzy_visit_budget(self):
+        """Ensure that whole labels count as a single visited node."""
+        trie = _new_radix_trie()
+        trie.add('nofx', 'nofx')
+
+        assert frozenset(['nofx']) == trie.search_fuzzy('nofz', 1, 1)
+
 
 @pytest.fixture
 def album_store():
@@ -318,6 +552,17 @@ def trie_factory():
         node_factory=avalon.web.search.TrieNode)
 
 
+class _DummyPool(object):
+    def map(self, func, iterable):
+        return [func(val) for val in iterable]
+
+    def close(self):
+        pass
+
+    def join(self):
+        pass
+
+
 class TestAvalonTextSearch(object):
     def setup(self):
         self.album_id = uuid.UUID('0c254968-90cb-56d5-9af8-7bf21962fa42')
@@ -453,3 +698,192 @@ class TestAvalonTextSearch(object):
         text_search.reload()
         assert self.track1 in text_search.search_tracks("It's my job")
         assert self.track2 in text_search.search_tracks('180')
+
+    def test_search_tracks_all_terms(
+            self, album_store, artist_store, genre_store, track_store):
+        """Test that track searches with multiple words include tracks
+        that match each word in different fields.
+        """
+        album_store.get_all.return_value = frozenset([self.album])
+        artist_store.get_all.return_value = frozenset([self.artist])
+        genre_store.get_all.return_value = frozenset([self.genre])
+        track_store.get_all.return_value = frozenset([self.track1, self.track2])
+        track_store.get_by_album.return_value = frozenset([self.track1, self.track2])
+        track_store.get_by_artist.return_value = frozenset([self.track1, self.track2])
+        track_store.get_by_genre.return_value = frozenset([self.track1, self.track2])
+
+        text_search = avalon.web.search.AvalonTextSearch(
+            album_store, artist_store, genre_store, track_store, trie_factory)
+
+        text_search.reload()
+        assert set([self.track2]) == text_search.search_tracks('nofx 180')
+        assert set([self.track1]) == text_search.search_tracks('job punk shoes')
+        assert set() == text_search.search_tracks('nofx 180 job')
+        assert [self.track2] == list(text_search.search_tracks_ranked('180 nofx'))
+
+    def test_search_tracks_radix_index(
+            self, album_store, artist_store, genre_store, track_store):
+        """Test that track searches using a radix index have the same
+        results as the default index.
+        """
+        album_store.get_all.return_value = frozenset([self.album])
+        artist_store.get_all.return_value = frozenset([self.artist])
+        genre_store.get_all.return_value = frozenset([self.genre])
+        track_store.get_all.return_value = frozenset([self.track1, self.track2])
+        track_store.get_by_album.return_value = frozenset([self.track1, self.track2])
+        track_store.get_by_artist.return_value = frozenset([self.track1, self.track2])
+        track_store.get_by_genre.return_value = frozenset([self.track1, self.track2])
+
+        text_search1 = avalon.web.search.AvalonTextSearch(
+            album_store, artist_store, genre_store, track_store, trie_factory)
+        text_search2 = avalon.web.search.AvalonTextSearch(
+            album_store, artist_store, genre_store, track_store, _new_radix_trie)
+
+        text_search1.reload()
+        text_search2.reload()
+        for needle in ('180', 'nof', 'punk rock', 'job punk shoes', 'thanks', 'xyz'):
+            assert text_search1.search_tracks(needle) == text_search2.search_tracks(needle)
+            assert (list(text_search1.search_tracks_ranked(needle)) ==
+                    list(text_search2.search_tracks_ranked(needle)))
+        assert text_search1.search_tracks('nofz', fuzzy=1) == text_search2.search_tracks('nofz', fuzzy=1)
+
+    def test_search_artists_fuzzy(
+            self, album_store, artist_store, genre_store, track_store):
+        """Test that artists can be found with a typo in the needle."""
+        album_store.get_all.return_value = frozenset([self.album])
+        artist_store.get_all.return_value = frozenset([self.artist])
+        genre_store.get_all.return_value = frozenset([self.genre])
+        track_store.get_all.return_value = frozenset([self.track1, self.track2])
+
+        text_search = avalon.web.search.AvalonTextSearch(
+            album_store, artist_store, genre_store, track_store, trie_factory)
+
+        text_search.reload()
+        assert 0 == len(text_search.search_artists('nofz'))
+        assert self.artist in text_search.search_artists('nofz', fuzzy=1)
+        # Too short to allow any typos
+        assert 0 == len(text_search.search_artists('nx', fuzzy=2))
+
+    def test_search_tracks_ranked_fuzzy(
+            self, album_store, artist_store, genre_store, track_store):
+        """Test that tracks that only match with typos are ranked last."""
+        album_store.get_all.return_value = frozenset([self.album])
+        artist_store.get_all.return_value = frozenset([self.artist])
+        genre_store.get_all.return_value = frozenset([self.genre])
+        track_store.get_all.return_value = frozenset([self.track1, self.track2])
+        track_store.get_by_album.return_value = frozenset()
+        track_store.get_by_artist.return_value = frozenset()
+        track_store.get_by_genre.return_value = frozenset()
+
+        text_search = avalon.web.search.AvalonTextSearch(
+            album_store, artist_store, genre_store, track_store, trie_factory)
+
+        text_search.reload()
+        assert [] == list(text_search.search_tracks_ranked('degres'))
+        assert [self.track2] == list(text_search.search_tracks_ranked('degres', fuzzy=1))
+
+    def test_search_tracks_ranked(
+            self, album_store, artist_store, genre_store, track_store):
+        """Test that tracks with a name equal to the needle are ranked
+        first, then other tracks matching by name, then tracks with an album,
+        artist, or genre that matches.
+        """
+        track3 = self.track2._replace(id=uuid.uuid4(), name='Punk')
+        album_store.get_all.return_value = frozenset([self.album])
+        artist_store.get_all.return_value = frozenset([self.artist])
+        genre_store.get_all.return_value = frozenset([self.genre])
+        track_store.get_all.return_value = frozenset([self.track1, self.track2, track3])
+        track_store.get_by_album.return_value = frozenset()
+        track_store.get_by_artist.return_value = frozenset()
+        track_store.get_by_genre.side_effect = lambda id: frozenset(
+            [self.track1, self.track2, track3]) if id == self.genre_id else frozenset()
+
+        text_search = avalon.web.search.AvalonTextSearch(
+            album_store, artist_store, genre_store, track_store, trie_factory)
+
+        text_search.reload()
+        results = list(text_search.search_tracks_ranked('punk'))
+        assert [track3, self.track1, self.track2] == results
+
+    def test_search_tracks_ranked_stops_early(
+            self, album_store, artist_store, genre_store, track_store):
+        """Test that album, artist, and genre matches aren't looked up when
+        only tracks that match by name are consumed.
+        """
+        album_store.get_all.return_value = frozenset([self.album])
+        artist_store.get_all.return_value = frozenset([self.artist])
+        genre_store.get_all.return_value = frozenset([self.genre])
+        track_store.get_all.return_value = frozenset([self.track1, self.track2])
+
+        text_search = avalon.web.search.AvalonTextSearch(
+            album_store, artist_store, genre_store, track_store, trie_factory)
+
+        text_search.reload()
+        results = text_search.search_tracks_ranked('punk')
+        assert self.track1 == next(results)
+        assert not track_store.get_by_genre.called
+
+    def test_suggest(
+            self, album_store, artist_store, genre_store, track_store):
+        """Test that suggestions of each type are limited and cached until
+        the indexes are rebuilt.
+        """
+        album_store.get_all.return_value = frozenset([self.album])
+        artist_store.get_all.return_value = frozenset([self.artist])
+        genre_store.get_all.return_value = frozenset([self.genre])
+        track_store.get_all.return_value = frozenset([self.track1, self.track2])
+
+        text_search = avalon.web.search.AvalonTextSearch(
+            album_store, artist_store, genre_store, track_store, trie_factory)
+
+        text_search.reload()
+        suggestions = text_search.suggest('Punk', 1)
+        assert (self.genre,) == suggestions['genres']
+        assert (self.track1,) == suggestions['songs']
+        assert () == suggestions['albums']
+        assert () == suggestions['artists']
+        assert suggestions is text_search.suggest('punk ', 1)
+
+        text_search.reload()
+        assert suggestions is not text_search.suggest('punk', 1)
+
+    def test_search_tracks_field_matches_cached(
+            self, album_store, artist_store, genre_store, track_store):
+        """Test that tracks for matching albums, artists, and genres are
+        cached and looked up again when the indexes are rebuilt.
+        """
+        album_store.get_all.return_value = frozenset([self.album])
+        artist_store.get_all.return_value = frozenset([self.artist])
+        genre_store.get_all.return_value = frozenset([self.genre])
+        track_store.get_all.return_value = frozenset([self.track1, self.track2])
+        track_store.get_by_genre.return_value = frozenset([self.track1, self.track2])
+
+        text_search = avalon.web.search.AvalonTextSearch(
+            album_store, artist_store, genre_store, track_store, trie_factory)
+
+        text_search.reload()
+        assert 2 == len(text_search.search_tracks('Punk'))
+        assert 2 == len(text_search.search_tracks('punk'))
+        assert 1 == track_store.get_by_genre.call_count
+
+        text_search.reload()
+        assert 2 == track_store.get_by_genre.call_count
+        assert 2 == len(text_search.search_tracks('punk'))
+        assert 2 == track_store.get_by_genre.call_count
+
+    def test_reload_with_pool(
+            self, album_store, artist_store, genre_store, track_store):
+        """Test that names tokenized using a pool are indexed the same way."""
+        album_store.get_all.return_value = frozenset([self.album])
+        artist_store.get_all.return_value = frozenset([self.artist])
+        genre_store.get_all.return_value = frozenset([self.genre])
+        track_store.get_all.return_value = frozenset([self.track1, self.track2])
+
+        text_search = avalon.web.search.AvalonTextSearch(
+            album_store, artist_store, genre_store, track_store, trie_factory,
+            pool_factory=_DummyPool)
+
+        text_search.reload()
+        assert 1 == len(text_search.search_albums('Thanks for'))
+        assert 1 == len(text_search.search_artists('nofx'))
+        assert self.track2 in text_search.search_tracks('180')
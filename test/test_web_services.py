@@ -11,6 +11,8 @@ from avalon.packages import six
 import avalon.cache
 import avalon.compat
 import avalon.elms
+import avalon.exc
+import avalon.metrics
 import avalon.web.request
 import avalon.web.search
 import avalon.web.services
@@ -101,7 +103,7 @@ def service_config(albums, artists, genres, tracks, search, id_cache):
 
 
 @pytest.fixture
-def request():
+def dummy_request():
     return DummyRequest()
 
 
@@ -123,6 +125,22 @@ def test_intersection_no_overlap():
     assert 0 == len(res), 'Expected empty set of common results'
 
 
+def test_union_single_set():
+    set1 = frozenset(['foo', 'bar'])
+
+    res = avalon.web.services.union([set1])
+    assert res is set1, 'Expected the only set returned as is'
+
+
+def test_union_multiple_sets():
+    set1 = frozenset(['foo', 'bar'])
+    set2 = frozenset(['baz'])
+    set3 = frozenset(['bing', 'foo'])
+
+    res = avalon.web.services.union([set1, set2, set3])
+    assert frozenset(['foo', 'bar', 'baz', 'bing']) == res, 'Expected every result'
+
+
 def test_intersection_with_overlap():
     set1 = set(['foo', 'bar'])
     set2 = set(['foo', 'baz'])
@@ -156,73 +174,112 @@ class TestAvalonMetadataService(object):
         assert service_config.id_cache.reload.called, \
             'Expected ID cache reload to be called'
 
-    def test_get_albums_no_params(self, id_name_elms, service_config, request):
+    def test_reload_gauges(self, monkeypatch, service_config):
+        """Ensure that the size of each store and number of reloads are recorded."""
+        client = mock.Mock()
+        monkeypatch.setattr(avalon.metrics.bridge, 'client', client)
+
+        service = avalon.web.services.AvalonMetadataService(service_config)
+        service.reload()
+        service.reload()
+
+        client.gauge.assert_any_call('store.tracks', 0)
+        client.gauge.assert_any_call('search.nodes', 0)
+        client.gauge.assert_any_call('reload.generation', 1)
+        client.gauge.assert_called_with('reload.generation', 2)
+
+    def test_reload_with_loader(self, id_name_elms, track_elms, service_config):
+        """Ensure that reloading with a collection loader populates each
+        store from the same loaded elements.
+        """
+        collection = avalon.cache.Collection(
+            albums=id_name_elms, artists=id_name_elms,
+            genres=id_name_elms, tracks=track_elms)
+        service_config.loader = mock.Mock(spec=avalon.cache.CollectionLoader)
+        service_config.loader.load.return_value = collection
+
+        service = avalon.web.services.AvalonMetadataService(service_config)
+        service.reload()
+
+        service_config.track_store.load.assert_called_with(track_elms)
+        service_config.album_store.load.assert_called_with(id_name_elms)
+        service_config.artist_store.load.assert_called_with(id_name_elms)
+        service_config.genre_store.load.assert_called_with(id_name_elms)
+        service_config.id_cache.load.assert_called_with(
+            id_name_elms, id_name_elms, id_name_elms)
+
+        assert service_config.search.reload.called, \
+            'Expected search trie reload to be called'
+        assert not service_config.track_store.reload.called, \
+            'Expected track store not to read from the database'
+
+    def test_get_albums_no_params(self, id_name_elms, service_config, dummy_request):
         """Test that we can fetch all albums available."""
         service_config.album_store.get_all.return_value = id_name_elms
-        params = avalon.web.request.Parameters(request)
+        params = avalon.web.request.Parameters(dummy_request)
 
         service = avalon.web.services.AvalonMetadataService(service_config)
         results = service.get_albums(params)
 
         assert results == id_name_elms, 'Expected all albums returned'
 
-    def test_get_albums_query_param(self, id_name_elms, service_config, request):
+    def test_get_albums_query_param(self, id_name_elms, service_config, dummy_request):
         """Test that we can fetch a subset of albums based on a query param."""
         service_config.search.search_albums.return_value = id_name_elms
-        request.args['query'] = 'Dummy'
-        params = avalon.web.request.Parameters(request)
+        dummy_request.args['query'] = 'Dummy'
+        params = avalon.web.request.Parameters(dummy_request)
 
         service = avalon.web.services.AvalonMetadataService(service_config)
         results = service.get_albums(params)
 
         assert results == id_name_elms, 'Expected matching albums returned'
 
-    def test_get_artists_no_params(self, id_name_elms, service_config, request):
+    def test_get_artists_no_params(self, id_name_elms, service_config, dummy_request):
         """Test that we can fetch all artists available."""
         service_config.artist_store.get_all.return_value = id_name_elms
-        params = avalon.web.request.Parameters(request)
+        params = avalon.web.request.Parameters(dummy_request)
 
         service = avalon.web.services.AvalonMetadataService(service_config)
         results = service.get_artists(params)
 
         assert results == id_name_elms, 'Expected all artists returned'
 
-    def test_get_artists_query_param(self, id_name_elms, service_config, request):
+    def test_get_artists_query_param(self, id_name_elms, service_config, dummy_request):
         """Test that we can fetch a subset of artists based on a query param."""
         service_config.search.search_artists.return_value = id_name_elms
-        request.args['query'] = 'Dummy'
-        params = avalon.web.request.Parameters(request)
+        dummy_request.args['query'] = 'Dummy'
+        params = avalon.web.request.Parameters(dummy_request)
 
         service = avalon.web.services.AvalonMetadataService(service_config)
         results = service.get_artists(params)
 
         assert results == id_name_elms, 'Expected matching artists returned'
 
-    def test_get_genres_no_params(self, id_name_elms, service_config, request):
+    def test_get_genres_no_params(self, id_name_elms, service_config, dummy_request):
         """Test that we can fetch all genres available."""
         service_config.genre_store.get_all.return_value = id_name_elms
-        params = avalon.web.request.Parameters(request)
+        params = avalon.web.request.Parameters(dummy_request)
 
         service = avalon.web.services.AvalonMetadataService(service_config)
         results = service.get_genres(params)
 
         assert results == id_name_elms, 'Expected all genres returned'
 
-    def test_get_genres_query_param(self, id_name_elms, service_config, request):
+    def test_get_genres_query_param(self, id_name_elms, service_config, dummy_request):
         """Test that we can fetch a subset of genres based on a query param."""
         service_config.search.search_genres.return_value = id_name_elms
-        request.args['query'] = 'Dummy'
-        params = avalon.web.request.Parameters(request)
+        dummy_request.args['query'] = 'Dummy'
+        params = avalon.web.request.Parameters(dummy_request)
 
         service = avalon.web.services.AvalonMetadataService(service_config)
         results = service.get_genres(params)
 
         assert results == id_name_elms, 'Expected matching genres returned'
 
-    def test_get_songs_no_params(self, track_elms, service_config, request):
+    def test_get_songs_no_params(self, track_elms, service_config, dummy_request):
         """Test that we can fetch all tracks when the params are empty."""
         service_config.track_store.get_all.return_value = track_elms
-        params = avalon.web.request.Parameters(request)
+        params = avalon.web.request.Parameters(dummy_request)
 
         service = avalon.web.services.AvalonMetadataService(service_config)
         results = service.get_songs(params)
@@ -238,24 +295,24 @@ class TestAvalonMetadataService(object):
 
         assert results == track_elms, 'Expected all tracks returned'
 
-    def test_get_songs_by_query(self, track_elms, service_config, request):
+    def test_get_songs_by_query(self, track_elms, service_config, dummy_request):
         """Test that we can fetch tracks by text matching."""
         service_config.search.search_tracks.return_value = track_elms
-        request.args['query'] = 'Dummy'
-        params = avalon.web.request.Parameters(request)
+        dummy_request.args['query'] = 'Dummy'
+        params = avalon.web.request.Parameters(dummy_request)
 
         service = avalon.web.services.AvalonMetadataService(service_config)
         results = service.get_songs(params)
 
         assert results == track_elms, 'Expected matching tracks returned'
 
-    def test_get_songs_by_album(self, track_elms, service_config, request):
+    def test_get_songs_by_album(self, track_elms, service_config, dummy_request):
         """Test that we can fetch tracks by exact album."""
         album_id = uuid.UUID(avalon.compat.to_uuid_input('f83fdec7-510f-44a5-87dc-61832669a582'))
         service_config.track_store.get_by_album.return_value = track_elms
         service_config.id_cache.get_album_id.return_value = album_id
-        request.args['album'] = 'Album'
-        params = avalon.web.request.Parameters(request)
+        dummy_request.args['album'] = 'Album'
+        params = avalon.web.request.Parameters(dummy_request)
 
         service = avalon.web.services.AvalonMetadataService(service_config)
         results = service.get_songs(params)
@@ -263,13 +320,13 @@ class TestAvalonMetadataService(object):
         assert results == track_elms, 'Expected matching tracks returned'
         service_config.track_store.get_by_album.assert_called_with(album_id)
 
-    def test_get_songs_by_artist(self, track_elms, service_config, request):
+    def test_get_songs_by_artist(self, track_elms, service_config, dummy_request):
         """Test that we can fetch tracks by exact artist."""
         artist_id = uuid.UUID(avalon.compat.to_uuid_input('2221930a-f28d-44ed-856b-c84b35f76713'))
         service_config.track_store.get_by_artist.return_value = track_elms
         service_config.id_cache.get_artist_id.return_value = artist_id
-        request.args['artist'] = 'Artist'
-        params = avalon.web.request.Parameters(request)
+        dummy_request.args['artist'] = 'Artist'
+        params = avalon.web.request.Parameters(dummy_request)
 
         service = avalon.web.services.AvalonMetadataService(service_config)
         results = service.get_songs(params)
@@ -277,13 +334,13 @@ class TestAvalonMetadataService(object):
         assert results == track_elms, 'Expected matching tracks returned'
         service_config.track_store.get_by_artist.assert_called_with(artist_id)
 
-    def test_get_songs_by_genre(self, track_elms, service_config, request):
+    def test_get_songs_by_genre(self, track_elms, service_config, dummy_request):
         """Test that we can fetch tracks by exact genre."""
         genre_id = uuid.UUID(avalon.compat.to_uuid_input('c12d2a49-d086-43d6-953d-b870deb24228'))
         service_config.track_store.get_by_genre.return_value = track_elms
         service_config.id_cache.get_genre_id.return_value = genre_id
-        request.args['genre'] = 'Genre'
-        params = avalon.web.request.Parameters(request)
+        dummy_request.args['genre'] = 'Genre'
+        params = avalon.web.request.Parameters(dummy_request)
 
         service = avalon.web.services.AvalonMetadataService(service_config)
         results = service.get_songs(params)
@@ -291,12 +348,12 @@ class TestAvalonMetadataService(object):
         assert results == track_elms, 'Expected matching tracks returned'
         service_config.track_store.get_by_genre.assert_called_with(genre_id)
 
-    def test_get_songs_by_album_id(self, track_elms, service_config, request):
+    def test_get_songs_by_album_id(self, track_elms, service_config, dummy_request):
         """Test that we can fetch tracks by album UUID."""
         album_id = uuid.UUID(avalon.compat.to_uuid_input('37cac253-2bca-4a3a-be9f-2ac655e04ad8'))
         service_config.track_store.get_by_album.return_value = track_elms
-        request.args['album_id'] = six.text_type(album_id)
-        params = avalon.web.request.Parameters(request)
+        dummy_request.args['album_id'] = six.text_type(album_id)
+        params = avalon.web.request.Parameters(dummy_request)
 
         service = avalon.web.services.AvalonMetadataService(service_config)
         results = service.get_songs(params)
@@ -304,12 +361,12 @@ class TestAvalonMetadataService(object):
         assert results == track_elms, 'Expected matching tracks returned'
         service_config.track_store.get_by_album.assert_called_with(album_id)
 
-    def test_get_songs_by_artist_id(self, track_elms, service_config, request):
+    def test_get_songs_by_artist_id(self, track_elms, service_config, dummy_request):
         """Test that we can fetch tracks by artist UUID."""
         artist_id = uuid.UUID(avalon.compat.to_uuid_input('75d590d1-9f3d-462d-8264-0d16af227860'))
         service_config.track_store.get_by_artist.return_value = track_elms
-        request.args['artist_id'] = six.text_type(artist_id)
-        params = avalon.web.request.Parameters(request)
+        dummy_request.args['artist_id'] = six.text_type(artist_id)
+        params = avalon.web.request.Parameters(dummy_request)
 
         service = avalon.web.services.AvalonMetadataService(service_config)
         results = service.get_songs(params)
@@ -317,15 +374,138 @@ class TestAvalonMetadataService(object):
         assert results == track_elms, 'Expected matching tracks returned'
         service_config.track_store.get_by_artist.assert_called_with(artist_id)
 
-    def test_get_songs_by_genre_id(self, track_elms, service_config, request):
+    def test_get_songs_by_genre_id(self, track_elms, service_config, dummy_request):
         """Test that we can fetch tracks by genre UUID."""
         genre_id = uuid.UUID(avalon.compat.to_uuid_input('26ce4d6b-af97-45a6-b7f6-d5c1cbbfd6b1'))
         service_config.track_store.get_by_genre.return_value = track_elms
-        request.args['genre_id'] = six.text_type(genre_id)
-        params = avalon.web.request.Parameters(request)
+        dummy_request.args['genre_id'] = six.text_type(genre_id)
+        params = avalon.web.request.Parameters(dummy_request)
 
         service = avalon.web.services.AvalonMetadataService(service_config)
         results = service.get_songs(params)
 
         assert results == track_elms, 'Expected matching tracks returned'
         service_config.track_store.get_by_genre.assert_called_with(genre_id)
+
+    def test_get_songs_by_multiple_album_ids(self, track_elms, service_config, dummy_request):
+        """Test that we can fetch tracks on any of several albums by UUID."""
+        track1 = next(iter(track_elms))
+        track2 = track1._replace(id=uuid.uuid4(), album_id=uuid.uuid4())
+        by_album = {track1.album_id: frozenset([track1]), track2.album_id: frozenset([track2])}
+        service_config.track_store.get_by_album.side_effect = lambda val: by_album[val]
+        dummy_request.args['album_id'] = [six.text_type(track1.album_id), six.text_type(track2.album_id)]
+        params = avalon.web.request.Parameters(dummy_request)
+
+        service = avalon.web.services.AvalonMetadataService(service_config)
+        results = service.get_songs(params)
+
+        assert frozenset([track1, track2]) == results, 'Expected tracks on either album returned'
+
+    def test_get_songs_by_multiple_album_ids_and_genre_id(self, track_elms, service_config, dummy_request):
+        """Test that tracks on any of several albums are intersected with other criteria."""
+        track1 = next(iter(track_elms))
+        track2 = track1._replace(id=uuid.uuid4(), album_id=uuid.uuid4(), genre_id=uuid.uuid4())
+        by_album = {track1.album_id: frozenset([track1]), track2.album_id: frozenset([track2])}
+        service_config.track_store.get_by_album.side_effect = lambda val: by_album[val]
+        service_config.track_store.get_by_genre.return_value = frozenset([track2])
+        dummy_request.args['album_id'] = [six.text_type(track1.album_id), six.text_type(track2.album_id)]
+        dummy_request.args['genre_id'] = six.text_type(track2.genre_id)
+        params = avalon.web.request.Parameters(dummy_request)
+
+        service = avalon.web.services.AvalonMetadataService(service_config)
+        results = service.get_songs(params)
+
+        assert frozenset([track2]) == results, 'Expected tracks matching both criteria'
+        service_config.track_store.get_by_genre.assert_called_with(track2.genre_id)
+
+    def test_get_songs_by_query_ranked(self, track_elms, service_config, dummy_request):
+        """Test that only as many ranked search results as needed for the
+        limit and offset are consumed.
+        """
+        ranked = iter(sorted(track_elms) * 10)
+        service_config.search.search_tracks_ranked.return_value = ranked
+        dummy_request.args['query'] = 'Dummy'
+        dummy_request.args['order'] = 'relevance'
+        dummy_request.args['limit'] = '2'
+        dummy_request.args['offset'] = '1'
+        params = avalon.web.request.Parameters(dummy_request)
+
+        service = avalon.web.services.AvalonMetadataService(service_config)
+        results = service.get_songs(params)
+
+        assert 3 == len(results)
+        assert 7 == len(list(ranked)), 'Expected remaining results unused'
+        assert not service_config.search.search_tracks.called
+
+    def test_get_songs_by_query_ranked_and_album_id(self, track_elms, service_config, dummy_request):
+        """Test that ranked search results are limited to tracks that match
+        the other parameters, preserving their order.
+        """
+        track = next(iter(track_elms))
+        other = track._replace(id=uuid.uuid4())
+        service_config.search.search_tracks_ranked.return_value = iter([other, track])
+        service_config.track_store.get_by_album.return_value = track_elms
+        dummy_request.args['query'] = 'Dummy'
+        dummy_request.args['order'] = 'relevance'
+        dummy_request.args['album_id'] = str(track.album_id)
+        params = avalon.web.request.Parameters(dummy_request)
+
+        service = avalon.web.services.AvalonMetadataService(service_config)
+        results = service.get_songs(params)
+
+        assert [track] == results
+
+    def test_get_albums_query_param_ranked(self, id_name_elms, service_config, dummy_request):
+        """Test that albums can be searched for ordered by relevance."""
+        service_config.search.search_albums_ranked.return_value = iter(id_name_elms)
+        dummy_request.args['query'] = 'Dummy'
+        dummy_request.args['order'] = 'relevance'
+        params = avalon.web.request.Parameters(dummy_request)
+
+        service = avalon.web.services.AvalonMetadataService(service_config)
+        results = service.get_albums(params)
+
+        assert list(id_name_elms) == results
+
+    def test_get_artists_query_param_fuzzy(self, id_name_elms, service_config, dummy_request):
+        """Test that the number of typos to allow is passed to the search."""
+        service_config.search.search_artists.return_value = id_name_elms
+        dummy_request.args['query'] = 'Dummy'
+        dummy_request.args['fuzzy'] = '1'
+        params = avalon.web.request.Parameters(dummy_request)
+
+        service = avalon.web.services.AvalonMetadataService(service_config)
+        service.get_artists(params)
+
+        service_config.search.search_artists.assert_called_with('Dummy', fuzzy=1)
+
+    def test_get_songs_by_query_invalid_fuzzy(self, service_config, dummy_request):
+        """Test that an error is raised for too many typos."""
+        dummy_request.args['query'] = 'Dummy'
+        dummy_request.args['fuzzy'] = '3'
+        params = avalon.web.request.Parameters(dummy_request)
+
+        service = avalon.web.services.AvalonMetadataService(service_config)
+        with pytest.raises(avalon.exc.InvalidParameterValueError):
+            service.get_songs(params)
+
+    def test_get_suggestions_default_limit(self, service_config, dummy_request):
+        """Test that the default number of suggestions is requested."""
+        dummy_request.args['query'] = 'Dum'
+        params = avalon.web.request.Parameters(dummy_request)
+
+        service = avalon.web.services.AvalonMetadataService(service_config)
+        service.get_suggestions(params)
+
+        service_config.search.suggest.assert_called_with(
+            'Dum', avalon.web.services.DEFAULT_SUGGEST_LIMIT)
+
+    def test_get_suggestions_invalid_limit(self, service_config, dummy_request):
+        """Test that an error is raised for too many suggestions."""
+        dummy_request.args['query'] = 'Dum'
+        dummy_request.args['limit'] = '51'
+        params = avalon.web.request.Parameters(dummy_request)
+
+        service = avalon.web.services.AvalonMetadataService(service_config)
+        with pytest.raises(avalon.exc.InvalidParameterValueError):
+            service.get_suggestions(params)
@@ -0,0 +1,430 @@
+# -*- coding: utf-8 -*-
+#
+
+from __future__ import absolute_import, unicode_literals
+import io
+import select
+import signal
+import uuid
+
+import mock
+import os
+import pytest
+import simplejson
+import avalon.app.bootstrap
+import avalon.elms
+import avalon.exc
+import avalon.models
+import avalon.web.request
+import avalon.web.sharding
+from avalon.packages import six
+from werkzeug.serving import make_server
+from avalon.packages.six.moves.urllib.error import HTTPError, URLError
+
+
+class DummyRequest(object):
+    def __init__(self, args):
+        self.args = args
+
+
+class DummyPool(object):
+    def __init__(self, workers):
+        self.workers = workers
+
+    def map(self, func, iterable):
+        return [func(val) for val in iterable]
+
+
+def _params(**kwargs):
+    return avalon.web.request.Parameters(DummyRequest(kwargs))
+
+
+def _track(track_id, name):
+    return {
+        'id': track_id,
+        'name': name,
+        'length': 100,
+        'track': 1,
+        'year': 1994,
+        'album': 'Dookie',
+        'album_id': '2d24515c-a459-552a-b022-e85d1621425a',
+        'artist': 'Green Day',
+        'artist_id': '1212bd9c-5fb5-524a-b748-7ece590f8875',
+        'genre': 'Punk',
+        'genre_id': '8794d7b7-fff3-50bb-b1f1-438659e05fe5'}
+
+
+TRACK_1 = _track('cd296eb6-0f7a-4086-a5ff-bc5ee0aee172', 'Burnout')
+TRACK_2 = _track('9ad9b4a8-d9e4-4ba6-9d33-5d3b46a3c0c3', 'Having a Blast')
+TRACK_3 = _track('4be8d42b-fb6e-4b10-9b8a-8b1f5c0f3f2b', 'Chump')
+
+ALBUM = {'id': '2d24515c-a459-552a-b022-e85d1621425a', 'name': 'Dookie'}
+
+
+def test_get_shard():
+    """Ensure that tracks are assigned to shards based on their ID."""
+    track_id = uuid.UUID('cd296eb6-0f7a-4086-a5ff-bc5ee0aee172')
+    assert track_id.int % 3 == avalon.web.sharding.get_shard(track_id, 3)
+    assert 0 == avalon.web.sharding.get_shard(track_id, 1)
+
+
+class TestShardPartition(object):
+    def test_invalid_index(self):
+        """Ensure that an index outside of the number of shards is rejected."""
+        with pytest.raises(ValueError):
+            avalon.web.sharding.ShardPartition(2, 2)
+        with pytest.raises(ValueError):
+            avalon.web.sharding.ShardPartition(-1, 2)
+
+    def test_each_track_in_one_partition(self):
+        """Ensure that each track belongs to exactly one partition."""
+        partitions = [avalon.web.sharding.ShardPartition(i, 3) for i in range(3)]
+        for _ in range(20):
+            elm = avalon.elms.IdNameElm(id=uuid.uuid4(), name='')
+            assert 1 == sum(1 for partition in partitions if partition(elm))
+
+
+def _response(payload):
+    return io.BytesIO(simplejson.dumps(payload).encode('utf-8'))
+
+
+class TestShardClient(object):
+    def test_get_success(self):
+        """Ensure that the results of a request are decoded and returned."""
+        opener = mock.Mock(return_value=_response(
+            {'success': [ALBUM], 'errors': [], 'warnings': []}))
+        client = avalon.web.sharding.ShardClient(
+            'http://127.0.0.1:8001/avalon/', opener=opener)
+
+        assert [ALBUM] == client.get('albums', {'query': 'dookie', 'limit': 5})
+        opener.assert_called_once_with(
+            'http://127.0.0.1:8001/avalon/albums?limit=5&query=dookie', timeout=10)
+
+    def test_get_multiple_values(self):
+        """Ensure that parameters with multiple values are repeated."""
+        opener = mock.Mock(return_value=_response(
+            {'success': [], 'errors': [], 'warnings': []}))
+        client = avalon.web.sharding.ShardClient('http://127.0.0.1:8001/avalon', opener=opener)
+
+        client.get('songs', {'album_id': ['b', 'a'], 'limit': 5})
+        opener.assert_called_once_with(
+            'http://127.0.0.1:8001/avalon/songs?album_id=a&album_id=b&limit=5', timeout=10)
+
+    def test_get_api_error(self):
+        """Ensure that an error returned by the shard is raised as the same
+        type of error.
+        """
+        body = _response({'success': None, 'warnings': [], 'errors': [{
+            'code': 102,
+            'message': "The value of fuzzy must be between 0 and 2",
+            'message_key': 'avalon.service.error.invalid_input_value',
+            'payload': {'field': 'fuzzy', 'value': 3, 'max': 2}}]})
+        opener = mock.Mock(side_effect=HTTPError(
+            'http://127.0.0.1:8001/avalon/albums', 400, 'Bad Request', {}, body))
+        client = avalon.web.sharding.ShardClient('http://127.0.0.1:8001/avalon', opener=opener)
+
+        with pytest.raises(avalon.exc.InvalidParameterValueError) as e:
+            client.get('albums', {'fuzzy': 3})
+        assert "The value of fuzzy must be between 0 and 2" == e.value.message
+        assert 'fuzzy' == e.value.payload['field']
+
+    def test_get_permission_denied(self):
+        """Ensure that a permission error returned by the shard is raised as
+        the same type of error.
+        """
+        body = _response({'success': None, 'warnings': [], 'errors': [{
+            'code': 4,
+            'message': "Invalid or missing admin token",
+            'message_key': 'avalon.service.error.permission_denied',
+            'payload': {}}]})
+        opener = mock.Mock(side_effect=HTTPError(
+            'http://127.0.0.1:8001/avalon/songs', 403, 'Forbidden', {}, body))
+        client = avalon.web.sharding.ShardClient('http://127.0.0.1:8001/avalon', opener=opener)
+
+        with pytest.raises(avalon.exc.PermissionDeniedError):
+            client.get('songs', {})
+
+    def test_get_unavailable(self):
+        """Ensure that an error is raised if the shard can't be reached."""
+        opener = mock.Mock(side_effect=URLError('Connection refused'))
+        client = avalon.web.sharding.ShardClient('http://127.0.0.1:8001/avalon', opener=opener)
+
+        with pytest.raises(avalon.exc.ServiceUnavailableError):
+            client.get('albums', {})
+
+
+class TestShardedMetadataService(object):
+    def setup(self):
+        self.shard1 = mock.Mock(spec=avalon.web.sharding.ShardClient)
+        self.shard1.url = 'http://127.0.0.1:8001/avalon'
+        self.shard2 = mock.Mock(spec=avalon.web.sharding.ShardClient)
+        self.shard2.url = 'http://127.0.0.1:8002/avalon'
+
+        config = avalon.web.sharding.ShardedMetadataServiceConfig()
+        config.shards = [self.shard1, self.shard2]
+        config.pool_factory = DummyPool
+        self.service = avalon.web.sharding.ShardedMetadataService(config)
+
+    def test_get_songs_from_every_shard(self):
+        """Ensure that songs from every shard are combined."""
+        self.shard1.get.return_value = [TRACK_1]
+        self.shard2.get.return_value = [TRACK_2, TRACK_3]
+
+        songs = self.service.get_songs(_params(query='dookie'))
+
+        assert ['Burnout', 'Having a Blast', 'Chump'] == [elm.name for elm in songs]
+        assert uuid.UUID(TRACK_1['album_id']) == songs[0].album_id
+        self.shard1.get.assert_called_once_with('songs', {'query': 'dookie'})
+        self.shard2.get.assert_called_once_with('songs', {'query': 'dookie'})
+
+    def test_get_songs_limit_pushed_down(self):
+        """Ensure that each shard is only asked for as many results as are
+        needed for the limit and offset of the combined results.
+        """
+        self.shard1.get.return_value = []
+        self.shard2.get.return_value = []
+
+        self.service.get_songs(_params(order='name', limit='5', offset='10'))
+
+        expected = {'order': 'name', 'limit': 15, 'offset': 0}
+        self.shard1.get.assert_called_once_with('songs', expected)
+        self.shard2.get.assert_called_once_with('songs', expected)
+
+    def test_get_songs_ranked_by_name(self):
+        """Ensure that results ordered by relevance are combined by name
+        within tracks that match the query by name.
+        """
+        self.shard1.get.return_value = [TRACK_1, TRACK_3]
+        self.shard2.get.return_value = [TRACK_2]
+
+        songs = self.service.get_songs(_params(query='b', order='relevance'))
+        assert ['Burnout', 'Having a Blast', 'Chump'] == [elm.name for elm in songs]
+
+    def test_get_songs_ranked_exact_match_first(self):
+        """Ensure that a track with a name equal to the query is the most
+        relevant even when it isn't the first result of its shard.
+        """
+        self.shard1.get.return_value = [
+            _track('5f6a0d3c-8b8e-4a43-9d45-0a7f3f2d7b02', 'Basket Case'),
+            _track('1b2c3d4e-5f60-4718-8293-a4b5c6d7e804', 'Basketball'),
+        ]
+        self.shard2.get.return_value = [
+            _track('0d0e4b61-4f4a-4d0b-9d9e-2b1c8d2a1e01', 'Basket Weaving'),
+            _track('7c3a9e0a-2f5e-4f49-8a6b-6c7d1e2f3a03', 'Basket'),
+        ]
+
+        songs = self.service.get_songs(_params(query='basket', order='relevance'))
+        assert ['Basket', 'Basket Case', 'Basket Weaving', 'Basketball'] == [
+            elm.name for elm in songs]
+
+    def test_get_songs_ranked_name_before_field(self):
+        """Ensure that tracks matching the query by name are more relevant
+        than tracks only matching by album, artist, or genre.
+        """
+        self.shard1.get.return_value = [TRACK_3]
+        self.shard2.get.return_value = [_track('7c3a9e0a-2f5e-4f49-8a6b-6c7d1e2f3a03', 'Punk Rock')]
+
+        songs = self.service.get_songs(_params(query='punk', order='relevance'))
+        assert ['Punk Rock', 'Chump'] == [elm.name for elm in songs]
+
+    def test_get_songs_shard_error(self):
+        """Ensure that an error from any shard is raised since the results
+        would be incomplete.
+        """
+        self.shard1.get.return_value = [TRACK_1]
+        self.shard2.get.side_effect = avalon.exc.ServiceUnavailableError('Unavailable')
+
+        with pytest.raises(avalon.exc.ServiceUnavailableError):
+            self.service.get_songs(_params())
+
+    def test_get_songs_pool_per_process(self):
+        """Ensure that a pool is created by the first request of each process
+        and reused by every request after that.
+        """
+        pools = []
+        self.service._pool_factory = lambda workers: pools.append(DummyPool(workers)) or pools[-1]
+        self.shard1.get.return_value = [TRACK_1]
+        self.shard2.get.return_value = [TRACK_2]
+
+        self.service.get_songs(_params())
+        self.service.get_songs(_params())
+        assert 1 == len(pools)
+        assert 8 == pools[0].workers
+
+        with mock.patch('os.getpid', return_value=-1):
+            self.service.get_songs(_params())
+        assert 2 == len(pools)
+
+    def test_get_albums_from_first_available_shard(self):
+        """Ensure that albums are only fetched from a single shard, trying
+        the next one if a shard is unavailable.
+        """
+        self.shard1.get.side_effect = avalon.exc.ServiceUnavailableError('Unavailable')
+        self.shard2.get.return_value = [ALBUM]
+
+        albums = self.service.get_albums(_params(query='dookie'))
+
+        assert [avalon.elms.IdNameElm(id=uuid.UUID(ALBUM['id']), name='Dookie')] == albums
+        assert 1 == self.shard2.get.call_count
+
+    def test_get_suggestions(self):
+        """Ensure that song suggestions from each shard are combined and
+        limited.
+        """
+        self.shard1.get.return_value = {
+            'albums': [ALBUM], 'artists': [], 'genres': [], 'songs': [
+                _track('5f6a0d3c-8b8e-4a43-9d45-0a7f3f2d7b02', 'Basket Case'), TRACK_1]}
+        self.shard2.get.return_value = {
+            'albums': [ALBUM], 'artists': [], 'genres': [], 'songs': [TRACK_2]}
+
+        suggestions = self.service.get_suggestions(_params(query='b', limit='2'))
+
+        assert ['Dookie'] == [elm.name for elm in suggestions['albums']]
+        assert ['Basket Case', 'Burnout'] == [elm.name for elm in suggestions['songs']]
+
+    def test_get_suggestions_exact_match_first(self):
+        """Ensure that a song with a name equal to the query is suggested
+        first even when it isn't the first suggestion of its shard.
+        """
+        self.shard1.get.return_value = {
+            'albums': [], 'artists': [], 'genres': [], 'songs': [TRACK_2]}
+        self.shard2.get.return_value = {
+            'albums': [], 'artists': [], 'genres': [], 'songs': [
+                _track('0d0e4b61-4f4a-4d0b-9d9e-2b1c8d2a1e01', 'Blast Off'),
+                _track('7c3a9e0a-2f5e-4f49-8a6b-6c7d1e2f3a03', 'Blast')]}
+
+        suggestions = self.service.get_suggestions(_params(query='blast', limit='2'))
+        assert ['Blast', 'Blast Off'] == [elm.name for elm in suggestions['songs']]
+
+
+def _new_collection(path, num_tracks):
+    """Create a database with every track on the same album and return the
+    ID of each track.
+    """
+    config = avalon.models.SessionHandlerConfig()
+    config.engine = avalon.models.get_engine('sqlite:///' + path)
+    config.session_factory = avalon.models.get_session_factory()
+    config.metadata = avalon.models.get_metadata()
+    handler = avalon.models.SessionHandler(config)
+    handler.connect()
+
+    track_ids = []
+    with handler.scoped_session(read_only=False) as session:
+        album = avalon.models.Album(id=uuid.uuid4(), name='Dookie')
+        artist = avalon.models.Artist(id=uuid.uuid4(), name='Green Day')
+        genre = avalon.models.Genre(id=uuid.uuid4(), name='Punk')
+        session.add_all([album, artist, genre])
+
+        for i in range(num_tracks):
+            track = avalon.models.Track(
+                id=uuid.uuid4(), name='Track {0}'.format(i), length=100, track=i,
+                year=1994, album_id=album.id, artist_id=artist.id, genre_id=genre.id)
+            session.add(track)
+            track_ids.append(six.text_type(track.id))
+
+    handler.dispose()
+    return sorted(track_ids)
+
+
+def _call_forked(func, timeout=10):
+    """Call the function in a forked process and return its (JSON encoded)
+    result, failing if it takes longer than the timeout.
+    """
+    read_fd, write_fd = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        try:
+            os.close(read_fd)
+            os.write(write_fd, simplejson.dumps(func()).encode('utf-8'))
+        finally:
+            os._exit(0)
+
+    os.close(write_fd)
+    try:
+        ready, _, _ = select.select([read_fd], [], [], timeout)
+        if not ready:
+            os.kill(pid, signal.SIGKILL)
+            pytest.fail('No result from the forked process after {0}s'.format(timeout))
+        return simplejson.loads(os.read(read_fd, 65536).decode('utf-8'))
+    finally:
+        os.close(read_fd)
+        os.waitpid(pid, 0)
+
+
+def _start_shard(tmpdir, db_path, index, count):
+    """Start a shard server in a forked process and return its PID and URL."""
+    config_path = str(tmpdir.join('shard{0}.py'.format(index)))
+    with open(config_path, 'w') as handle:
+        handle.write('import logging\n')
+        handle.write('DATABASE_URL = {0!r}\n'.format(str('sqlite:///' + db_path)))
+        handle.write('LOG_LEVEL = logging.WARNING\n')
+        handle.write('SHARD_INDEX = {0}\nSHARD_COUNT = {1}\n'.format(index, count))
+
+    read_fd, write_fd = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        try:
+            os.close(read_fd)
+            os.environ['AVALON_TEST_SHARD_CONFIG'] = config_path
+            app = avalon.app.bootstrap.bootstrap('AVALON_TEST_SHARD_CONFIG')
+            server = make_server('127.0.0.1', 0, app)
+            os.write(write_fd, str(server.server_port).encode('utf-8'))
+            os.close(write_fd)
+            server.serve_forever()
+        finally:
+            os._exit(1)
+
+    os.close(write_fd)
+    try:
+        port = os.read(read_fd, 16).decode('utf-8')
+    finally:
+        os.close(read_fd)
+    return pid, 'http://127.0.0.1:{0}/avalon'.format(port)
+
+
+@pytest.fixture
+def shard_servers(tmpdir):
+    """Start two shard servers with a collection split between them and
+    return the ID of each track and the URL of each shard.
+    """
+    db_path = str(tmpdir.join('avalon.sqlite'))
+    track_ids = _new_collection(db_path, 12)
+    shards = [_start_shard(tmpdir, db_path, i, 2) for i in range(2)]
+
+    yield track_ids, [url for _, url in shards]
+
+    for pid, _ in shards:
+        os.kill(pid, signal.SIGTERM)
+        os.waitpid(pid, 0)
+
+
+def _new_sharded_service(urls):
+    config = avalon.web.sharding.ShardedMetadataServiceConfig()
+    config.shards = [avalon.web.sharding.ShardClient(url) for url in urls]
+    return avalon.web.sharding.ShardedMetadataService(config)
+
+
+@pytest.mark.skipif(not hasattr(os, 'fork'), reason='Requires fork')
+class TestShardProcesses(object):
+    def test_get_songs_from_every_shard(self, shard_servers):
+        """Ensure that songs split between shard servers are all returned."""
+        track_ids, urls = shard_servers
+        service = _new_sharded_service(urls)
+        songs = service.get_songs(_params(album='Dookie'))
+
+        assert track_ids == sorted(six.text_type(elm.id) for elm in songs)
+        assert 1 == len(service.get_albums(_params()))
+
+    def test_get_songs_forked_worker(self, shard_servers):
+        """Ensure that a worker process forked after the service was built
+        and used (such as by Gunicorn with preload_app) can still send
+        requests to every shard.
+        """
+        track_ids, urls = shard_servers
+        service = _new_sharded_service(urls)
+        service.get_songs(_params())
+
+        forked_ids = _call_forked(
+            lambda: sorted(six.text_type(elm.id) for elm in service.get_songs(_params())))
+
+        assert track_ids == forked_ids